@@ -0,0 +1,426 @@
+"""
+Batch-Generierung: Verarbeitet ein Manifest (JSONL oder CSV) mit Prompts,
+Bildpfaden und zeilenweisen Konfigurationsüberschreibungen über einen
+begrenzten Thread-Pool.
+
+Ergebnisse werden direkt nach Abschluss jeder Zeile in das Ausgabeverzeichnis
+geschrieben. Ein Fortschritts-Ledger (ledger.jsonl) hält fest, welche Zeilen
+abgeschlossen sind, sodass ein abgebrochener Lauf fortgesetzt werden kann.
+
+Aufruf:
+    python batch.py manifest.jsonl --output-dir batch_output --concurrency 4
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING, Callable
+
+from config_store import API_CONFIG_SCHEMA, MODELS_SCHEMA, ConfigStore, ConfigValidationError
+from generation import DEFAULT_BASE_WAIT_TIME, DEFAULT_MAX_RETRIES, generate_content_with_retry
+from image_output import extension_for
+from image_preprocessing import PreprocessingCache
+from pipeline import build_generation_config, ingest_image, parse_response, prepare_contents
+from rate_limiter import PRIORITY_BATCH, RateLimitScheduler, api_key_id
+from retry_policy import CircuitBreakerRegistry, RetryPolicy
+
+if TYPE_CHECKING:
+    from google import genai
+    from google.genai import types
+
+logger = logging.getLogger(__name__)
+
+# Standardwerte für den Batch-Modus
+DEFAULT_CONCURRENCY = 4
+DEFAULT_OUTPUT_DIR = "batch_output"
+# Wurzelverzeichnis, das Pfade aus dem Batch-Tab der App nicht verlassen dürfen
+DEFAULT_ROOT_DIR = "."
+LEDGER_FILE_NAME = "ledger.jsonl"
+
+# Parameter, die pro Zeile überschrieben werden dürfen
+OVERRIDE_PARAMS = ("model", "temperature", "top_p", "top_k", "max_output_tokens")
+INT_PARAMS = ("top_k", "max_output_tokens")
+FLOAT_PARAMS = ("temperature", "top_p")
+
+
+def _parse_images(value) -> list[str]:
+    if not value:
+        return []
+    if isinstance(value, list):
+        return [str(path) for path in value if path]
+    # In CSV-Dateien werden mehrere Bildpfade durch Semikolon getrennt
+    return [path.strip() for path in str(value).split(";") if path.strip()]
+
+
+def resolve_within(root_dir: str, path: str) -> str:
+    """
+    Löst einen Pfad relativ zu root_dir auf und stellt sicher, dass er nicht
+    aus root_dir herausführt (auch nicht über ".." oder symbolische Links).
+
+    Parameter:
+      root_dir: Erlaubtes Wurzelverzeichnis.
+      path: Relativer oder absoluter Pfad.
+
+    Rückgabe:
+      Der aufgelöste absolute Pfad.
+    """
+    root = os.path.realpath(root_dir)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise ValueError(f"Pfad liegt außerhalb von {root_dir}: {path}")
+    return resolved
+
+
+def _row_id(row: dict) -> str:
+    """
+    Stabile ID einer Zeile: explizite "id"-Spalte oder ein Hash über den Inhalt.
+    Dadurch bleibt die Zuordnung zum Ledger erhalten, auch wenn Zeilen umsortiert werden.
+    Die ID wird als Verzeichnisname im Ausgabeverzeichnis verwendet und darf
+    daher keine Pfadtrenner enthalten.
+    """
+    if row.get("id"):
+        row_id = str(row["id"])
+        if os.path.isabs(row_id) or any(sep in row_id for sep in ("/", "\\", "\0")) or row_id in (".", ".."):
+            raise ValueError(f"Ungültige Zeilen-ID: {row_id!r}")
+        return row_id
+    payload = json.dumps({
+        "prompt": row["prompt"],
+        "images": row["images"],
+        "overrides": row["overrides"]
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def _normalize_row(raw: dict, base_dir: str, root_dir: str | None) -> dict:
+    prompt = (raw.get("prompt") or "").strip()
+    if not prompt:
+        raise ValueError("Zeile ohne Prompt.")
+    images = [
+        path if os.path.isabs(path) else os.path.join(base_dir, path)
+        for path in _parse_images(raw.get("images"))
+    ]
+    if root_dir is not None:
+        images = [resolve_within(root_dir, path) for path in images]
+    overrides = {}
+    for name in OVERRIDE_PARAMS:
+        value = raw.get(name)
+        if value is None or value == "":
+            continue
+        if name in INT_PARAMS:
+            value = int(value)
+        elif name in FLOAT_PARAMS:
+            value = float(value)
+        overrides[name] = value
+    row = {"id": raw.get("id") or "", "prompt": prompt, "images": images, "overrides": overrides}
+    row["id"] = _row_id(row)
+    return row
+
+
+def load_manifest(path: str, base_dir: str | None = None) -> list[dict]:
+    """
+    Lädt ein Batch-Manifest im JSONL- oder CSV-Format.
+
+    Jede Zeile benötigt ein Feld "prompt". Optional sind "id", "images"
+    (Liste bzw. durch Semikolon getrennte Pfade) sowie die Überschreibungen
+    "model", "temperature", "top_p", "top_k" und "max_output_tokens".
+
+    Parameter:
+      path: Pfad zur Manifest-Datei (.jsonl oder .csv).
+      base_dir: Basisverzeichnis für relative Bildpfade (Standard: Verzeichnis des Manifests).
+
+    Rückgabe:
+      Liste normalisierter Zeilen mit den Schlüsseln id, prompt, images und overrides.
+    """
+    with open(path, 'r', encoding="utf-8", newline="") as f:
+        return parse_manifest(f.read(), os.path.splitext(path)[1].lower(),
+                              base_dir if base_dir is not None else os.path.dirname(os.path.abspath(path)))
+
+
+def parse_manifest(text: str, extension: str, base_dir: str, root_dir: str | None = None) -> list[dict]:
+    """
+    Zerlegt den Inhalt eines Manifests. Wird auch für hochgeladene Manifeste verwendet.
+
+    Parameter:
+      text: Inhalt des Manifests.
+      extension: Dateiendung (".jsonl" oder ".csv").
+      base_dir: Basisverzeichnis für relative Bildpfade.
+      root_dir: Optionales Wurzelverzeichnis, das kein Bildpfad verlassen darf
+        (für Manifeste, die nicht vom Betreiber selbst stammen).
+    """
+    if extension == ".csv":
+        raw_rows = list(enumerate(csv.DictReader(text.splitlines()), start=1))
+    else:
+        raw_rows = [(line_number, line) for line_number, line in enumerate(text.splitlines(), start=1)
+                    if line.strip()]
+    rows = []
+    seen_ids = set()
+    for line_number, raw in raw_rows:
+        try:
+            if extension != ".csv":
+                raw = json.loads(raw)
+            if not isinstance(raw, dict):
+                raise ValueError("Erwartet ein JSON-Objekt")
+            row = _normalize_row(raw, base_dir, root_dir)
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Ungültige Manifest-Zeile {line_number}: {e}") from e
+        if row["id"] in seen_ids:
+            raise ValueError(f"Doppelte Zeilen-ID im Manifest: {row['id']}")
+        seen_ids.add(row["id"])
+        rows.append(row)
+    return rows
+
+
+def read_ledger(output_dir: str) -> dict[str, dict]:
+    """
+    Liest das Fortschritts-Ledger. Für jede Zeilen-ID gilt der letzte Eintrag.
+    Unvollständige letzte Zeilen (z.B. nach einem Absturz) werden ignoriert.
+    """
+    ledger = {}
+    path = os.path.join(output_dir, LEDGER_FILE_NAME)
+    if not os.path.exists(path):
+        return ledger
+    with open(path, 'r', encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            # Fremde oder beschädigte Einträge ohne Zeilen-ID überspringen
+            if not isinstance(entry, dict) or "row_id" not in entry:
+                continue
+            ledger[entry["row_id"]] = entry
+    return ledger
+
+
+class _LedgerWriter:
+    def __init__(self, output_dir: str):
+        self._path = os.path.join(output_dir, LEDGER_FILE_NAME)
+        self._lock = threading.Lock()
+
+    def append(self, entry: dict) -> None:
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self._path, 'a', encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def _write_outputs(response: types.GenerateContentResponse, row_dir: str) -> list[str]:
+    os.makedirs(row_dir, exist_ok=True)
+    parsed = parse_response(response)
+    outputs = []
+    for image_index, image in enumerate(parsed["images"], start=1):
+        if image["mime_type"] is None:
+            continue
+        file_name = f"image_{image_index}{extension_for(image['mime_type'])}"
+        with open(os.path.join(row_dir, file_name), 'wb') as f:
+            f.write(image["data"])
+        outputs.append(file_name)
+    if parsed["text"]:
+        with open(os.path.join(row_dir, "text.txt"), 'w', encoding="utf-8") as f:
+            f.write(parsed["text"])
+        outputs.append("text.txt")
+    return outputs
+
+
+def process_row(client: genai.Client, row: dict, defaults: dict, output_dir: str,
+                max_retries: int, base_wait_time: int,
+                scheduler: RateLimitScheduler | None = None, scheduler_key: str = "",
+                preprocessing: dict | None = None,
+                preprocessing_cache: PreprocessingCache | None = None,
+                ingest_budget: dict | None = None,
+                policy: RetryPolicy | None = None,
+                breakers: CircuitBreakerRegistry | None = None) -> dict:
+    """
+    Führt die Generierung für eine Manifest-Zeile aus und schreibt die Ergebnisse.
+
+    Rückgabe:
+      Ledger-Eintrag mit Status "done" oder "failed".
+    """
+    start = time.perf_counter()
+    params = {**defaults, **row["overrides"]}
+    entry = {"row_id": row["id"], "model": params["model"]}
+    try:
+        image_entries = []
+        for image_path in row["images"]:
+            with open(image_path, 'rb') as f:
+                # Budget vor der Dekodierung prüfen
+                image_entry = ingest_image(f.read(), image_path, ingest_budget)
+            if "error" in image_entry:
+                raise ValueError(f"{image_path}: {image_entry['error']}")
+            image_entries.append(image_entry)
+        # Gleiche Bilder in mehreren Zeilen werden nur einmal vorverarbeitet
+        prepared = prepare_contents(row["prompt"], image_entries, preprocessing or {},
+                                    preprocessing_cache or PreprocessingCache())
+        if prepared["skipped"]:
+            # Im Batch schlägt die Zeile fehl, statt ohne das Bild zu generieren
+            raise ValueError("; ".join(prepared["skipped"]))
+        error_messages = []
+        response = generate_content_with_retry(
+            client=client,
+            model_name=params["model"],
+            contents=prepared["contents"],
+            config=build_generation_config(params),
+            max_retries=max_retries,
+            base_wait_time=base_wait_time,
+            on_warning=lambda msg: logger.warning("[%s] %s", row["id"], msg),
+            on_error=error_messages.append,
+            scheduler=scheduler,
+            scheduler_key=scheduler_key,
+            priority=PRIORITY_BATCH,
+            policy=policy,
+            breakers=breakers
+        )
+        if response is None or not response.candidates:
+            raise RuntimeError(error_messages[-1] if error_messages else "Keine gültige Antwort von der API erhalten.")
+        entry["outputs"] = _write_outputs(response, resolve_within(output_dir, row["id"]))
+        entry["status"] = "done"
+    except Exception as e:
+        entry["status"] = "failed"
+        entry["error"] = str(e)
+    entry["elapsed"] = round(time.perf_counter() - start, 3)
+    return entry
+
+
+def run_batch(client: genai.Client, rows: list[dict], output_dir: str, defaults: dict,
+              concurrency: int = DEFAULT_CONCURRENCY,
+              max_retries: int = DEFAULT_MAX_RETRIES,
+              base_wait_time: int = DEFAULT_BASE_WAIT_TIME,
+              on_progress: Callable[[dict, int, int], None] | None = None,
+              scheduler: RateLimitScheduler | None = None,
+              scheduler_key: str = "",
+              preprocessing: dict | None = None,
+              ingest_budget: dict | None = None,
+              policy: RetryPolicy | None = None,
+              breakers: CircuitBreakerRegistry | None = None) -> dict:
+    """
+    Verarbeitet alle noch nicht abgeschlossenen Zeilen mit begrenzter Parallelität.
+
+    Parameter:
+      client: Der initialisierte GenAI-Client.
+      rows: Zeilen aus load_manifest/parse_manifest.
+      output_dir: Ausgabeverzeichnis für Ergebnisse und Ledger.
+      defaults: Standardparameter (model, temperature, top_p, top_k, max_output_tokens).
+      concurrency: Maximale Anzahl gleichzeitiger API-Anfragen.
+      max_retries: Maximale Anzahl der Wiederholungsversuche pro Zeile.
+      base_wait_time: Basiswartezeit zwischen den Versuchen.
+      on_progress: Optionaler Callback (entry, erledigt, gesamt). Er wird im
+        aufrufenden Thread ausgeführt und darf daher Streamlit-Elemente aktualisieren.
+      scheduler: Optionaler RateLimitScheduler; Batch-Anfragen laufen mit
+        niedrigerer Priorität als interaktive Anfragen.
+      scheduler_key: Bezeichner des API-Keys für den Scheduler.
+      preprocessing: Einstellungen für die Bildvorverarbeitung (siehe image_preprocessing).
+      ingest_budget: Byte- und Pixelbudget je Eingabebild (siehe image_ingest).
+      policy: Optionale Wiederholungsstrategie (siehe retry_policy.RetryPolicy).
+      breakers: Optionale Circuit Breaker je Modell. Ist ein Modell gestört,
+        scheitern seine übrigen Zeilen sofort, statt jede für sich alle
+        Versuche auszuschöpfen; ein späterer Lauf setzt sie fort. Auf andere
+        Modelle wird im Batch nicht ausgewichen.
+
+    Rückgabe:
+      Zusammenfassung mit den Zählern total, skipped, done und failed.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    completed = {row_id for row_id, entry in read_ledger(output_dir).items() if entry.get("status") == "done"}
+    pending = [row for row in rows if row["id"] not in completed]
+    summary = {"total": len(rows), "skipped": len(rows) - len(pending), "done": 0, "failed": 0}
+    ledger = _LedgerWriter(output_dir)
+    preprocessing_cache = PreprocessingCache()
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = [
+            executor.submit(process_row, client, row, defaults, output_dir, max_retries, base_wait_time,
+                            scheduler, scheduler_key, preprocessing, preprocessing_cache, ingest_budget,
+                            policy, breakers)
+            for row in pending
+        ]
+        for finished, future in enumerate(as_completed(futures), start=1):
+            entry = future.result()
+            ledger.append(entry)
+            summary[entry["status"]] += 1
+            if on_progress:
+                on_progress(entry, finished, len(pending))
+    return summary
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Batch-Generierung mit Google GenAI.")
+    parser.add_argument("manifest", help="Pfad zum Manifest (.jsonl oder .csv).")
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR, help="Ausgabeverzeichnis für Ergebnisse und Ledger.")
+    parser.add_argument("--concurrency", type=int, default=None, help="Maximale Anzahl gleichzeitiger Anfragen.")
+    parser.add_argument("--model", default=None, help="Standardmodell für Zeilen ohne eigenes Modell.")
+    parser.add_argument("--config", default=os.path.join("config", "api_config.json"), help="Pfad zur API-Konfiguration.")
+    parser.add_argument("--models-config", default=os.path.join("config", "models.json"),
+                        help="Pfad zur Modellkonfiguration mit den Rate-Limits.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    from google import genai
+
+    api_key = os.environ.get("GENAI_API_KEY")
+    if not api_key:
+        print("Bitte setze die Umgebungsvariable GENAI_API_KEY.", file=sys.stderr)
+        return 2
+
+    # Kurzlebiger Prozess: Schema-Prüfung ja, Dateiüberwachung nicht nötig
+    config_store = ConfigStore(watch=False)
+    try:
+        api_config = config_store.load(args.config, API_CONFIG_SCHEMA)
+    except (FileNotFoundError, json.JSONDecodeError, ConfigValidationError) as e:
+        logger.warning("API-Konfiguration wird nicht verwendet: %s", e)
+        api_config = {}
+    batch_config = api_config.get("batch", {})
+    try:
+        rate_limits = config_store.load(args.models_config, MODELS_SCHEMA).get("rate_limits", {})
+    except (FileNotFoundError, json.JSONDecodeError, ConfigValidationError) as e:
+        logger.warning("Rate-Limits werden nicht verwendet: %s", e)
+        rate_limits = {}
+    breaker_config = api_config.get("circuit_breaker", {})
+
+    defaults = {
+        "model": args.model or batch_config.get("model", "gemini-2.0-flash-exp"),
+        "temperature": api_config.get("temperature", 0.7),
+        "top_p": api_config.get("top_p", 0.95),
+        "top_k": api_config.get("top_k", 40),
+        "max_output_tokens": api_config.get("max_output_tokens", 1024)
+    }
+    rows = load_manifest(args.manifest)
+
+    def report(entry: dict, finished: int, total: int) -> None:
+        detail = entry.get("error") or ", ".join(entry.get("outputs", []))
+        print(f"[{finished}/{total}] {entry['row_id']}: {entry['status']} ({entry['elapsed']:.1f}s) {detail}")
+
+    summary = run_batch(
+        client=genai.Client(api_key=api_key),
+        rows=rows,
+        output_dir=args.output_dir,
+        defaults=defaults,
+        concurrency=args.concurrency or batch_config.get("concurrency", DEFAULT_CONCURRENCY),
+        max_retries=api_config.get("max_retries", DEFAULT_MAX_RETRIES),
+        base_wait_time=api_config.get("base_wait_time", DEFAULT_BASE_WAIT_TIME),
+        on_progress=report,
+        scheduler=RateLimitScheduler(rate_limits),
+        scheduler_key=api_key_id(api_key),
+        preprocessing=api_config.get("image_preprocessing", {}),
+        ingest_budget=api_config.get("image_ingest", {}),
+        policy=RetryPolicy.from_config(api_config.get("retry", {}),
+                                       api_config.get("max_retries", DEFAULT_MAX_RETRIES),
+                                       api_config.get("base_wait_time", DEFAULT_BASE_WAIT_TIME)),
+        breakers=CircuitBreakerRegistry.from_config(breaker_config) if breaker_config.get("enabled", True) else None
+    )
+    print(f"Fertig: {summary['done']} erfolgreich, {summary['failed']} fehlgeschlagen, "
+          f"{summary['skipped']} bereits erledigt (von {summary['total']}).")
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""
+Benchmark: Zeit für das Laden der Konfiguration beim Start und pro Rerun.
+
+"Vorher" bildet den früheren Ablauf nach: Jeder Rerun las und parste alle
+Konfigurationsdateien erneut (Modelle und API-Konfiguration je zweimal, für
+den Generierungs- und den Batch-Tab). "Nachher" ruft die Ladefunktionen der
+App auf, die über den ConfigStore gehen; zusätzlich wird die Rückfallebene
+ohne watchdog (mtime-Prüfung) gemessen.
+
+Aufruf (aus dem Repository-Verzeichnis):
+    python -m benchmarks.bench_config --reruns 1000
+"""
+import argparse
+import json
+import time
+
+from benchmarks.common import load_app_module
+from config_store import API_CONFIG_SCHEMA, MODELS_SCHEMA, PROMPTS_SCHEMA, THEMES_SCHEMA, ConfigStore
+
+
+def legacy_rerun(app) -> None:
+    """
+    Früherer Ablauf: json.load für jede Datei bei jedem Zugriff.
+    """
+    for config_file in (app.MODEL_CONFIG_FILE, app.API_CONFIG_FILE, app.PROMPT_CONFIG_FILE,
+                        app.API_CONFIG_FILE, app.MODEL_CONFIG_FILE, app.THEME_CONFIG_FILE):
+        with open(config_file, 'r') as f:
+            json.load(f)
+
+
+def current_rerun(app) -> None:
+    """
+    Aktueller Ablauf: dieselben Zugriffe über die Ladefunktionen der App.
+    """
+    app.load_models_from_config(app.MODEL_CONFIG_FILE)
+    app.load_api_config(app.API_CONFIG_FILE)
+    app.load_prompts_from_config(app.PROMPT_CONFIG_FILE)
+    app.load_api_config(app.API_CONFIG_FILE)
+    app.load_models_from_config(app.MODEL_CONFIG_FILE)
+    app.load_themes_from_config(app.THEME_CONFIG_FILE)
+
+
+def stat_rerun(app, store: ConfigStore) -> None:
+    """
+    Wie current_rerun, aber mit einem ConfigStore ohne Dateiüberwachung.
+    """
+    for config_file, schema in ((app.MODEL_CONFIG_FILE, MODELS_SCHEMA), (app.API_CONFIG_FILE, API_CONFIG_SCHEMA),
+                                (app.PROMPT_CONFIG_FILE, PROMPTS_SCHEMA), (app.API_CONFIG_FILE, API_CONFIG_SCHEMA),
+                                (app.MODEL_CONFIG_FILE, MODELS_SCHEMA), (app.THEME_CONFIG_FILE, THEMES_SCHEMA)):
+        store.load(config_file, schema)
+
+
+def measure(rerun, reruns: int) -> tuple[float, float]:
+    """
+    Misst den ersten Aufruf (Start) und den Durchschnitt der folgenden Reruns.
+    """
+    start = time.perf_counter()
+    rerun()
+    cold = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(reruns):
+        rerun()
+    warm = (time.perf_counter() - start) / reruns
+    return cold, warm
+
+
+def report(label: str, cold: float, warm: float) -> None:
+    print(f"{label}:")
+    print(f"  Start (erster Rerun): {cold * 1000:.3f} ms")
+    print(f"  Pro Rerun: {warm * 1000:.3f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reruns", type=int, default=1000, help="Anzahl simulierter Reruns.")
+    args = parser.parse_args()
+
+    app = load_app_module()
+    # Das Laden des Moduls füllt den Cache bereits (TTL-Dekoratoren); für eine faire Startmessung leeren
+    app.CONFIG_STORE.invalidate()
+
+    report("Vorher (json.load bei jedem Zugriff)", *measure(lambda: legacy_rerun(app), args.reruns))
+    report("Nachher (ConfigStore mit watchdog)", *measure(lambda: current_rerun(app), args.reruns))
+    store = ConfigStore(watch=False)
+    report("Nachher ohne watchdog (mtime-Prüfung)", *measure(lambda: stat_rerun(app, store), args.reruns))
+    print(f"ConfigStore-Statistik: {app.CONFIG_STORE.stats()}")
+
+
+if __name__ == "__main__":
+    main()
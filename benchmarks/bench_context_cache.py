@@ -0,0 +1,87 @@
+"""
+Benchmark: hochgeladene Bytes und Latenz einer iterativen Sitzung (viele
+Prompts gegen dieselben Referenzbilder) mit und ohne Context Caching.
+
+Beide Varianten laufen über pipeline.prepare_contents, apply_context_cache und
+generate_content_with_retry gegen den lokalen StubClient. Der Stub rechnet die
+Upload-Zeit der Eingabebilder über --upload-bandwidth in die Latenz ein.
+
+Aufruf (aus dem Repository-Verzeichnis):
+    python -m benchmarks.bench_context_cache --prompts 10 --images 2
+"""
+import argparse
+import statistics
+import time
+
+from benchmarks.stub_client import StubBackend, synthetic_image
+from context_cache import ContextCacheRegistry
+from generation import generate_content_with_retry
+from image_preprocessing import PreprocessingCache
+from pipeline import apply_context_cache, build_generation_config, ingest_image, prepare_contents
+from rate_limiter import api_key_id
+
+API_KEY = "stub-api-key"
+MODEL_NAME = "gemini-2.0-flash-exp"
+
+
+def run_session(backend: StubBackend, images: list[bytes], prompts: int,
+                registry: ContextCacheRegistry | None) -> list[float]:
+    """
+    Sendet nacheinander prompts Anfragen mit denselben Bildern.
+
+    Rückgabe:
+      Latenzen der einzelnen Anfragen in Sekunden (einschließlich Context Caching).
+    """
+    client = backend.create_client(api_key=API_KEY)
+    preprocessing_cache = PreprocessingCache()
+    entries = [ingest_image(data, f"reference_{index}.png") for index, data in enumerate(images)]
+    latencies = []
+    for index in range(prompts):
+        start = time.perf_counter()
+        prepared = prepare_contents(f"Variante {index}: ändere den Hintergrund.", entries,
+                                    {"enabled": True}, preprocessing_cache)
+        context = apply_context_cache(prepared, client, MODEL_NAME, registry, api_key_id(API_KEY))
+        response = generate_content_with_retry(
+            client=client,
+            model_name=MODEL_NAME,
+            contents=context["contents"],
+            config=build_generation_config({}, cached_content=context["cached_content"]),
+            max_retries=1,
+            base_wait_time=0
+        )
+        if response is None:
+            raise RuntimeError("Generierung gegen den Stub fehlgeschlagen.")
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def report(label: str, backend: StubBackend, latencies: list[float]) -> None:
+    print(f"{label}:")
+    print(f"  Aufrufe: {dict(backend.calls)}")
+    print(f"  Hochgeladene Bildbytes gesamt: {backend.input_bytes}")
+    print(f"  Hochgeladene Bildbytes pro Anfrage: {backend.input_bytes / len(latencies):.0f}")
+    print(f"  Latenz p50: {statistics.median(latencies) * 1000:.1f} ms, "
+          f"gesamt: {sum(latencies) * 1000:.1f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--prompts", type=int, default=10, help="Anzahl der Prompts in der Sitzung.")
+    parser.add_argument("--images", type=int, default=2, help="Anzahl der Referenzbilder.")
+    parser.add_argument("--generate-latency", type=float, default=0.2, help="Latenz eines Generierungsaufrufs (s).")
+    parser.add_argument("--upload-bandwidth", type=float, default=2_000_000,
+                        help="Simulierte Upload-Bandbreite in Bytes pro Sekunde.")
+    parser.add_argument("--min-uses", type=int, default=2, help="Verwendungen, ab denen ein Cache angelegt wird.")
+    args = parser.parse_args()
+
+    images = [synthetic_image((2048, 2048), "PNG", seed) for seed in range(args.images)]
+
+    for label, registry in (("Ohne Context Caching", None),
+                            ("Mit Context Caching", ContextCacheRegistry(min_uses=args.min_uses))):
+        backend = StubBackend(generate_latency=args.generate_latency, metadata_latency=0.02,
+                              upload_bandwidth=args.upload_bandwidth)
+        report(label, backend, run_session(backend, images, args.prompts, registry))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Benchmark: Importzeit der Einstiegspunkte beim Kaltstart (wie python -X importtime).
+
+Jedes Ziel wird --repeat-mal in einem frischen Interpreter mit -X importtime
+geladen. Ausgegeben werden die Wandzeit des Prozesses, die Summe der
+Importzeiten und die langsamsten Pakete der obersten Ebene, jeweils als
+Median. Zusätzlich wird geprüft, ob das SDK (google.genai) oder PIL bereits
+beim Import geladen werden; beide sollen erst bei der ersten Verwendung
+geladen werden. Die Ergebnisse werden als JSON gespeichert; mit --baseline
+werden sie mit einem früheren Lauf verglichen.
+
+Ziele:
+  app     streamlit_app..py ohne main() (siehe benchmarks.common.load_app_module)
+  server  server.py (HTTP-API)
+  batch   batch.py (Batch-Modus)
+  genai   nur google.genai, als Referenz für die aufgeschobenen Kosten
+
+Aufruf (aus dem Repository-Verzeichnis):
+    python -m benchmarks.bench_import --repeat 5
+    python -m benchmarks.bench_import --baseline .cache/benchmarks/import_baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.common import REPO_ROOT
+
+TARGETS = {
+    "app": "from benchmarks.common import load_app_module; load_app_module()",
+    "server": "import server",
+    "batch": "import batch",
+    "genai": "import google.genai",
+}
+# Module, die erst bei der ersten Verwendung geladen werden sollen
+DEFERRED_MODULES = ("google.genai", "PIL.Image")
+DEFAULT_OUTPUT = os.path.join(REPO_ROOT, ".cache", "benchmarks", "import_time.json")
+
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def parse_importtime(output: str) -> dict[str, int]:
+    """
+    Liest die kumulierten Importzeiten (in Mikrosekunden) der Module der
+    obersten Ebene aus der Ausgabe von -X importtime.
+    """
+    cumulative = {}
+    for line in output.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match and len(match.group(3)) == 1:
+            cumulative[match.group(4)] = cumulative.get(match.group(4), 0) + int(match.group(2))
+    return cumulative
+
+
+def measure(code: str) -> dict:
+    """
+    Führt code in einem frischen Interpreter aus und misst Wandzeit und Importzeiten.
+    """
+    probe = f"{code}\nimport sys\nprint([name for name in {DEFERRED_MODULES!r} if name in sys.modules])"
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", probe], cwd=REPO_ROOT,
+                               capture_output=True, text=True, check=True)
+    wall = time.perf_counter() - start
+    cumulative = parse_importtime(completed.stderr)
+    return {
+        "wall_ms": wall * 1000,
+        "import_ms": sum(cumulative.values()) / 1000,
+        "top_level_ms": {name: value / 1000 for name, value in cumulative.items()},
+        "loaded": json.loads(completed.stdout.strip().splitlines()[-1].replace("'", '"'))
+    }
+
+
+def run_target(code: str, repeat: int, top: int) -> dict:
+    """
+    Misst ein Ziel repeat-mal und fasst die Läufe über den Median zusammen.
+    """
+    runs = [measure(code) for _ in range(repeat)]
+    modules = {name for run in runs for name in run["top_level_ms"]}
+    median_by_module = {name: statistics.median(run["top_level_ms"].get(name, 0.0) for run in runs)
+                        for name in modules}
+    slowest = sorted(median_by_module.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {
+        "repeat": repeat,
+        "wall_ms": statistics.median(run["wall_ms"] for run in runs),
+        "import_ms": statistics.median(run["import_ms"] for run in runs),
+        "slowest_ms": dict(slowest),
+        "deferred_loaded": runs[-1]["loaded"]
+    }
+
+
+def compare(results: dict, baseline: dict) -> None:
+    """
+    Gibt die relative Veränderung gegenüber einem früheren Lauf aus.
+    """
+    print("\nVergleich mit der Baseline (positiv = langsamer):")
+    for name, current in results["targets"].items():
+        previous = baseline.get("targets", {}).get(name)
+        if previous is None:
+            continue
+        changes = [f"{label} {(current[key] - previous[key]) / previous[key] * 100:+.1f} %"
+                   for label, key in (("Wandzeit", "wall_ms"), ("Importe", "import_ms")) if previous[key]]
+        print(f"  {name}: {', '.join(changes)}")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", action="append", choices=tuple(TARGETS),
+                        help="Zu messende Ziele (mehrfach möglich, Standard: alle).")
+    parser.add_argument("--repeat", type=int, default=5, help="Läufe pro Ziel.")
+    parser.add_argument("--top", type=int, default=5, help="Anzahl der langsamsten Pakete in der Ausgabe.")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Ziel der JSON-Ergebnisse.")
+    parser.add_argument("--baseline", help="Früherer Ergebnis-JSON zum Vergleich.")
+    args = parser.parse_args(argv)
+
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "targets": {}
+    }
+    for name in args.target or TARGETS:
+        result = run_target(TARGETS[name], args.repeat, args.top)
+        results["targets"][name] = result
+        slowest = ", ".join(f"{module} {value:.0f} ms" for module, value in result["slowest_ms"].items())
+        print(f"{name}: Wandzeit {result['wall_ms']:.0f} ms, Importe {result['import_ms']:.0f} ms "
+              f"(langsamste: {slowest}); beim Import geladen: {', '.join(result['deferred_loaded']) or '-'}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"Ergebnisse gespeichert: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            compare(results, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""
+Benchmark: API-Aufrufe und Laufzeit pro Generierung vor und nach der
+leichtgewichtigen API-Key-Validierung.
+
+"Vorher" bildet den früheren Ablauf nach: get_genai_client führte beim Aufbau
+einen Bildgenerierungsaufruf aus und validate_api_key bei jedem Klick einen
+weiteren. "Nachher" ruft die aktuellen Funktionen der App auf. Beide Varianten
+laufen gegen den lokalen StubClient.
+
+Aufruf (aus dem Repository-Verzeichnis):
+    python -m benchmarks.bench_key_validation --generations 10
+"""
+import argparse
+import time
+
+from google import genai
+from google.genai import types
+
+from benchmarks.common import load_app_module
+from benchmarks.stub_client import StubBackend
+
+API_KEY = "stub-api-key"
+
+
+def run_legacy(backend: StubBackend, generations: int) -> float:
+    """
+    Früherer Ablauf: Client-Aufbau mit Testaufruf, Validierung per Generierung,
+    danach die eigentliche Anfrage. Der Client war wie heute per Key gecacht.
+    """
+    client = None
+    start = time.perf_counter()
+    for _ in range(generations):
+        if client is None:
+            client = backend.create_client(api_key=API_KEY)
+            client.models.generate_content(model="gemini-2.0-flash-exp",
+                                           contents=["Erstelle eine futuristische Stadt."])
+        client.models.generate_content(model="gemini-2.0-flash-exp", contents=["Test API Key"])
+        client.models.generate_content(model="gemini-2.0-flash-exp", contents=["Prompt"])
+    return time.perf_counter() - start
+
+
+def run_current(app, backend: StubBackend, generations: int) -> float:
+    """
+    Aktueller Ablauf über validate_api_key, get_genai_client und generate_content_with_retry.
+    """
+    app.create_genai_client.clear()
+    app.probe_api_key.clear()
+    start = time.perf_counter()
+    for _ in range(generations):
+        if not app.validate_api_key(API_KEY):
+            raise RuntimeError("Stub-Key wurde abgelehnt.")
+        client = app.get_genai_client(API_KEY)
+        app.generate_content_with_retry(
+            client=client,
+            model_name="gemini-2.0-flash-exp",
+            contents=["Prompt"],
+            config=types.GenerateContentConfig(response_modalities=['Text', 'Image']),
+            max_retries=1,
+            base_wait_time=0
+        )
+    return time.perf_counter() - start
+
+
+def report(label: str, backend: StubBackend, elapsed: float, generations: int) -> None:
+    total_calls = sum(backend.calls.values())
+    print(f"{label}:")
+    print(f"  Aufrufe gesamt: {total_calls} ({dict(backend.calls)})")
+    print(f"  Aufrufe pro Generierung: {total_calls / generations:.2f}")
+    print(f"  Laufzeit pro Generierung: {elapsed / generations * 1000:.1f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--generations", type=int, default=10, help="Anzahl simulierter Klicks auf 'Generieren'.")
+    parser.add_argument("--generate-latency", type=float, default=0.2, help="Latenz eines Generierungsaufrufs (s).")
+    parser.add_argument("--metadata-latency", type=float, default=0.02, help="Latenz einer Metadaten-Abfrage (s).")
+    args = parser.parse_args()
+
+    backend = StubBackend(generate_latency=args.generate_latency, metadata_latency=args.metadata_latency)
+    elapsed = run_legacy(backend, args.generations)
+    report("Vorher (Generierungsaufrufe zur Validierung)", backend, elapsed, args.generations)
+
+    app = load_app_module()
+    original_client = genai.Client
+    genai.Client = backend.create_client
+    try:
+        backend.reset()
+        elapsed = run_current(app, backend, args.generations)
+        report("Nachher (Metadaten-Abfrage, gemerkt pro Key-Hash)", backend, elapsed, args.generations)
+    finally:
+        genai.Client = original_client
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+Lastbenchmark gegen den lokalen StubClient: Latenz, Durchsatz und Speicher
+der Generierung, der Bildaufnahme und der Antwortdarstellung.
+
+Szenarien:
+  generate    generate_content_with_retry (Wiederholungen, Hintergrund-Loop)
+  ingest      ingest_bytes, Vorverarbeitung und to_part für Eingabebilder
+  render      Übernahme der inline_data-Teile wie in der Ergebnisanzeige (ohne Dekodierung)
+  end_to_end  alle drei Schritte hintereinander pro Anfrage
+
+Jedes Szenario läuft mit --concurrency parallelen Threads. Ausgegeben werden
+p50/p95/p99 der Latenz, Durchsatz und der Spitzenwert des Python-Speichers
+(tracemalloc). Die Ergebnisse werden als JSON gespeichert; mit --baseline
+werden sie mit einem früheren Lauf verglichen.
+
+Aufruf (aus dem Repository-Verzeichnis):
+    python -m benchmarks.bench_load --requests 200 --concurrency 8 --error-rate 429=0.05 --error-rate 503=0.02
+    python -m benchmarks.bench_load --baseline .cache/benchmarks/baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from google.genai import types
+
+from benchmarks.common import REPO_ROOT
+from benchmarks.stub_client import StubBackend, synthetic_image
+from generation import generate_content_with_retry
+from image_ingest import ingest_bytes
+from image_output import output_images
+from image_preprocessing import preprocess_image_bytes, to_part
+
+SCENARIOS = ("generate", "ingest", "render", "end_to_end")
+DEFAULT_OUTPUT = os.path.join(REPO_ROOT, ".cache", "benchmarks", "results.json")
+MODEL_NAME = "gemini-2.0-flash-exp"
+
+
+def percentile(values: list[float], q: float) -> float:
+    """
+    Perzentil mit linearer Interpolation (q zwischen 0 und 100).
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def run_scenario(task: Callable[[int], bool], requests: int, concurrency: int) -> dict:
+    """
+    Führt task(i) für i in range(requests) mit concurrency Threads aus.
+    task gibt False zurück, wenn die Anfrage fehlgeschlagen ist.
+    """
+    latencies = []
+    failures = 0
+
+    def timed(index: int) -> tuple[float, bool]:
+        start = time.perf_counter()
+        ok = task(index)
+        return time.perf_counter() - start, ok
+
+    tracemalloc.reset_peak()
+    baseline_memory = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for latency, ok in executor.map(timed, range(requests)):
+            latencies.append(latency)
+            failures += not ok
+    wall = time.perf_counter() - start
+    peak_memory = tracemalloc.get_traced_memory()[1] - baseline_memory
+
+    return {
+        "requests": requests,
+        "failures": failures,
+        "concurrency": concurrency,
+        "wall_seconds": round(wall, 4),
+        "throughput_rps": round(requests / wall, 2) if wall else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 3),
+            "p95": round(percentile(latencies, 95) * 1000, 3),
+            "p99": round(percentile(latencies, 99) * 1000, 3),
+            "mean": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+            "max": round(max(latencies, default=0.0) * 1000, 3)
+        },
+        "peak_memory_bytes": peak_memory
+    }
+
+
+def build_tasks(backend: StubBackend, args: argparse.Namespace) -> dict[str, Callable[[int], bool]]:
+    """
+    Erstellt die Aufgaben der Szenarien. Eingabebilder werden vorab erzeugt,
+    damit ihre Erstellung nicht mitgemessen wird.
+    """
+    client = backend.create_client(api_key="stub-api-key")
+    config = types.GenerateContentConfig(response_modalities=['Text', 'Image'])
+    input_images = [synthetic_image(tuple(args.input_size), "JPEG", seed) for seed in range(args.distinct_inputs)]
+    preprocessing = {"max_edge": args.max_edge}
+    rendered_response = backend.response(MODEL_NAME)
+
+    def generate(index: int, contents: list | None = None) -> types.GenerateContentResponse | None:
+        return generate_content_with_retry(
+            client=client,
+            model_name=MODEL_NAME,
+            # Eindeutiger Prompt, damit keine Anfragen zusammengeführt werden
+            contents=contents or [f"Benchmark-Prompt {index}"],
+            config=config,
+            max_retries=args.max_retries,
+            base_wait_time=args.base_wait_time,
+            on_warning=lambda message: None,
+            on_error=lambda message: None
+        )
+
+    def ingest(index: int) -> types.Part:
+        entry = ingest_bytes(input_images[index % len(input_images)], f"input_{index}.jpg")
+        return to_part(preprocess_image_bytes(entry["data"], preprocessing))
+
+    def render(response: types.GenerateContentResponse) -> bool:
+        # Wie die Ergebnisanzeige: Bilder werden unverändert übernommen, nur der Typ wird erkannt
+        if not response.candidates:
+            return False
+        return all(image["mime_type"] for image in output_images(response))
+
+    def end_to_end(index: int) -> bool:
+        response = generate(index, [f"Benchmark-Prompt {index}", ingest(index)])
+        return response is not None and render(response)
+
+    return {
+        "generate": lambda index: generate(index) is not None,
+        "ingest": lambda index: ingest(index) is not None,
+        "render": lambda index: render(rendered_response),
+        "end_to_end": end_to_end
+    }
+
+
+def compare(results: dict, baseline: dict) -> None:
+    """
+    Gibt die relative Veränderung gegenüber einem früheren Lauf aus.
+    """
+    print("\nVergleich mit der Baseline (positiv = langsamer bzw. mehr Speicher):")
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            continue
+        changes = []
+        for label, now, before in (
+                ("p50", current["latency_ms"]["p50"], previous["latency_ms"]["p50"]),
+                ("p95", current["latency_ms"]["p95"], previous["latency_ms"]["p95"]),
+                ("p99", current["latency_ms"]["p99"], previous["latency_ms"]["p99"]),
+                ("Durchsatz", previous["throughput_rps"], current["throughput_rps"]),
+                ("Speicher", current["peak_memory_bytes"], previous["peak_memory_bytes"])):
+            if before:
+                changes.append(f"{label} {(now - before) / before * 100:+.1f} %")
+        print(f"  {name}: {', '.join(changes)}")
+
+
+def parse_error_rate(value: str) -> tuple[int, float]:
+    code, _, rate = value.partition("=")
+    try:
+        return int(code), float(rate)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Erwartet CODE=RATE, z.B. 429=0.05, erhalten: {value}")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS,
+                        help="Auszuführende Szenarien (mehrfach möglich, Standard: alle).")
+    parser.add_argument("--requests", type=int, default=100, help="Anfragen pro Szenario.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Parallele Threads.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mittlere Latenz eines Generierungsaufrufs (s).")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Relative Schwankung der Latenz.")
+    parser.add_argument("--error-rate", type=parse_error_rate, action="append", default=[],
+                        help="Fehlerquote je HTTP-Code, z.B. 429=0.05 (mehrfach möglich).")
+    parser.add_argument("--retry-delay", type=float, default=None, help="Gemeldete Wartezeit bei 429 (s).")
+    parser.add_argument("--max-retries", type=int, default=3, help="Maximale Versuche pro Anfrage.")
+    parser.add_argument("--base-wait-time", type=float, default=0.01, help="Basiswartezeit des Backoffs (s).")
+    parser.add_argument("--response-images", type=int, default=1, help="Bilder pro Antwort.")
+    parser.add_argument("--image-size", type=int, nargs=2, default=[1024, 1024], help="Größe der Antwortbilder.")
+    parser.add_argument("--input-size", type=int, nargs=2, default=[3000, 2000], help="Größe der Eingabebilder.")
+    parser.add_argument("--distinct-inputs", type=int, default=4, help="Anzahl unterschiedlicher Eingabebilder.")
+    parser.add_argument("--max-edge", type=int, default=1536, help="max_edge der Vorverarbeitung.")
+    parser.add_argument("--seed", type=int, default=0, help="Startwert für Latenz und Fehler.")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Ziel der JSON-Ergebnisse.")
+    parser.add_argument("--baseline", help="Früherer Ergebnis-JSON zum Vergleich.")
+    args = parser.parse_args(argv)
+
+    backend = StubBackend(generate_latency=args.latency, metadata_latency=0.0, latency_jitter=args.jitter,
+                          error_rates=dict(args.error_rate), retry_delay=args.retry_delay,
+                          response_images=args.response_images, image_size=tuple(args.image_size), seed=args.seed)
+    tasks = build_tasks(backend, args)
+
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "parameters": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "scenarios": {}
+    }
+    tracemalloc.start()
+    try:
+        for name in args.scenario or SCENARIOS:
+            backend.reset()
+            result = run_scenario(tasks[name], args.requests, args.concurrency)
+            result["stub_calls"] = dict(backend.calls)
+            result["stub_errors"] = {str(code): count for code, count in backend.errors.items()}
+            results["scenarios"][name] = result
+            latency = result["latency_ms"]
+            print(f"{name}: p50 {latency['p50']:.1f} ms, p95 {latency['p95']:.1f} ms, p99 {latency['p99']:.1f} ms, "
+                  f"{result['throughput_rps']:.1f} Anfragen/s, Spitzenspeicher {result['peak_memory_bytes'] / 1024 / 1024:.1f} MB, "
+                  f"Fehlschläge {result['failures']}/{result['requests']}")
+    finally:
+        tracemalloc.stop()
+    # ru_maxrss ist unter Linux in KB, unter macOS in Bytes angegeben
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results["max_rss_bytes"] = max_rss if sys.platform == "darwin" else max_rss * 1024
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"Ergebnisse gespeichert: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            compare(results, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,26 @@
+"""
+Hilfsfunktionen für die Benchmarks.
+"""
+import importlib.util
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_FILE = os.path.join(REPO_ROOT, "streamlit_app..py")
+
+
+def load_app_module():
+    """
+    Lädt die Streamlit-App als Modul, ohne main() auszuführen.
+
+    Der Dateiname der App enthält einen doppelten Punkt und ist daher nicht
+    regulär importierbar. Das Arbeitsverzeichnis wird auf das Repository
+    gesetzt, damit die relativen Pfade zu den Konfigurationsdateien stimmen.
+    """
+    os.chdir(REPO_ROOT)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    spec = importlib.util.spec_from_file_location("streamlit_app", APP_FILE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,294 @@
+"""
+Lokaler Stub für den Google GenAI-Client.
+
+Der Stub bildet die Teile von genai.Client nach, die die App verwendet, zählt
+alle Aufrufe und simuliert eine konfigurierbare Latenz, Fehlerquoten und
+Bildausgaben. Damit lassen sich Benchmarks ohne gültigen API-Key und ohne
+Kontingent ausführen. Latenz und Fehler hängen nur vom Seed und der laufenden
+Nummer des Aufrufs ab und sind damit reproduzierbar.
+"""
+import asyncio
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from io import BytesIO
+
+from google.genai import errors, types
+from PIL import Image
+
+# Antworten der API für die simulierten Fehlercodes (vereinfacht)
+_ERROR_STATUS = {
+    400: "INVALID_ARGUMENT",
+    401: "UNAUTHENTICATED",
+    403: "PERMISSION_DENIED",
+    429: "RESOURCE_EXHAUSTED",
+    500: "INTERNAL",
+    503: "UNAVAILABLE",
+}
+
+
+def synthetic_image(size: tuple[int, int] = (1024, 1024), image_format: str = "PNG", seed: int = 0) -> bytes:
+    """
+    Erzeugt ein reproduzierbares Testbild mit Farbverlauf und Rauschen, damit
+    Kompression und Dekodierung realistischer ausfallen als bei einer Einfarbfläche.
+    """
+    width, height = size
+    gradient = Image.linear_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 64).point(lambda value: (value + seed * 37) % 256)
+    image = Image.merge("RGB", (gradient, noise, gradient.rotate(90).resize(size)))
+    buffer = BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def stub_error(code: int, retry_delay: float | None = None) -> errors.APIError:
+    """
+    Erzeugt einen Fehler wie das SDK: ClientError für 4xx, ServerError für 5xx.
+    Bei 429 wird eine Wartezeit als retryDelay in den Details mitgeliefert.
+    """
+    details = []
+    if code == 429 and retry_delay is not None:
+        details.append({"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": f"{retry_delay:g}s"})
+    response_json = {"error": {"code": code, "message": f"Simulierter Fehler {code}",
+                               "status": _ERROR_STATUS.get(code, "UNKNOWN"), "details": details}}
+    error_class = errors.ServerError if code >= 500 else errors.ClientError
+    return error_class(code, response_json)
+
+
+class StubBackend:
+    """
+    Gemeinsamer Zustand aller Stub-Clients: Aufrufzähler, Latenzen, Fehler und Antwortinhalte.
+
+    Parameter:
+      generate_latency: Simulierte Dauer eines generate_content-Aufrufs in Sekunden.
+      metadata_latency: Simulierte Dauer einer Metadaten-Abfrage (list/get) in Sekunden.
+      stream_chunks: Anzahl der Teilantworten von generate_content_stream; die
+        Latenz verteilt sich gleichmäßig auf die Teilantworten.
+      latency_jitter: Relative Schwankung der Latenz (0.2 = ±20 %).
+      error_rates: Zuordnung HTTP-Code -> Wahrscheinlichkeit pro Generierungsaufruf,
+        z.B. {429: 0.05, 503: 0.01}.
+      retry_delay: Wartezeit, die bei simulierten 429-Fehlern gemeldet wird (None = keine).
+      response_images: Anzahl der Bilder (inline_data) pro Antwort.
+      image_size: Größe der Antwortbilder in Pixeln.
+      image_format: Format der Antwortbilder (z.B. "PNG" oder "JPEG").
+      seed: Startwert für Latenzschwankung und Fehlerauswahl.
+      upload_bandwidth: Simulierte Upload-Bandbreite in Bytes pro Sekunde; die
+        Eingabebilder einer Anfrage verlängern deren Latenz entsprechend (None = kein Aufschlag).
+    """
+
+    def __init__(self, generate_latency: float = 0.2, metadata_latency: float = 0.02, stream_chunks: int = 4,
+                 latency_jitter: float = 0.0, error_rates: dict[int, float] | None = None,
+                 retry_delay: float | None = None, response_images: int = 0,
+                 image_size: tuple[int, int] = (1024, 1024), image_format: str = "PNG", seed: int = 0,
+                 upload_bandwidth: float | None = None):
+        self.generate_latency = generate_latency
+        self.metadata_latency = metadata_latency
+        self.stream_chunks = stream_chunks
+        self.latency_jitter = latency_jitter
+        self.error_rates = dict(error_rates or {})
+        self.retry_delay = retry_delay
+        self.response_images = response_images
+        self.image_format = image_format.upper()
+        self.seed = seed
+        self.upload_bandwidth = upload_bandwidth
+        self.input_bytes = 0
+        self.calls: Counter[str] = Counter()
+        self.errors: Counter[int] = Counter()
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._cached_contents: dict[str, float] = {}
+        self._image_data = synthetic_image(image_size, self.image_format, seed) if response_images else b""
+
+    def _next_outcome(self, name: str, latency: float) -> tuple[float, int | None]:
+        """
+        Zählt den Aufruf und bestimmt Latenz und ggf. Fehlercode anhand der laufenden Nummer.
+        """
+        with self._lock:
+            self.calls[name] += 1
+            self._sequence += 1
+            rng = random.Random(self.seed * 1_000_003 + self._sequence)
+        if self.latency_jitter:
+            latency *= 1 + rng.uniform(-self.latency_jitter, self.latency_jitter)
+        error_code = None
+        if name.startswith("generate_content"):
+            draw = rng.random()
+            for code, rate in sorted(self.error_rates.items()):
+                if draw < rate:
+                    error_code = code
+                    break
+                draw -= rate
+        if error_code is not None:
+            with self._lock:
+                self.errors[error_code] += 1
+        return max(0.0, latency), error_code
+
+    def record(self, name: str, latency: float) -> None:
+        latency, error_code = self._next_outcome(name, latency)
+        time.sleep(latency)
+        if error_code is not None:
+            raise stub_error(error_code, self.retry_delay)
+
+    async def record_async(self, name: str, latency: float) -> None:
+        latency, error_code = self._next_outcome(name, latency)
+        await asyncio.sleep(latency)
+        if error_code is not None:
+            raise stub_error(error_code, self.retry_delay)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls.clear()
+            self.errors.clear()
+            self._sequence = 0
+            self.input_bytes = 0
+            self._cached_contents.clear()
+
+    def generate_latency_for(self, contents, config=None) -> float:
+        """
+        Zählt die hochgeladenen Bildbytes einer Anfrage und gibt deren Latenz zurück.
+        Ein Verweis auf einen abgelaufenen oder unbekannten Cache löst einen 400-Fehler aus.
+        """
+        cached_content = getattr(config, "cached_content", None)
+        if cached_content:
+            with self._lock:
+                expires_at = self._cached_contents.get(cached_content, 0.0)
+            if expires_at < time.time():
+                raise stub_error(400)
+        payload = _payload_bytes(contents)
+        with self._lock:
+            self.input_bytes += payload
+        if self.upload_bandwidth:
+            return self.generate_latency + payload / self.upload_bandwidth
+        return self.generate_latency
+
+    def create_cache(self, model: str, config: types.CreateCachedContentConfig) -> types.CachedContent:
+        # Das Anlegen lädt das Präfix einmal hoch
+        payload = _payload_bytes(config.contents)
+        upload = payload / self.upload_bandwidth if self.upload_bandwidth else 0.0
+        self.record("caches.create", self.metadata_latency + upload)
+        ttl = float((config.ttl or "3600s").rstrip("s"))
+        with self._lock:
+            self.input_bytes += payload
+            name = f"cachedContents/stub-{self.calls['caches.create']}"
+            self._cached_contents[name] = time.time() + ttl
+        return types.CachedContent(name=name, model=f"models/{model}",
+                                   expire_time=datetime.fromtimestamp(time.time() + ttl, timezone.utc))
+
+    def update_cache(self, name: str, config: types.UpdateCachedContentConfig) -> types.CachedContent:
+        self.record("caches.update", self.metadata_latency)
+        ttl = float((config.ttl or "3600s").rstrip("s"))
+        with self._lock:
+            if self._cached_contents.get(name, 0.0) < time.time():
+                raise stub_error(404)
+            self._cached_contents[name] = time.time() + ttl
+        return types.CachedContent(name=name, expire_time=datetime.fromtimestamp(time.time() + ttl, timezone.utc))
+
+    def response(self, model: str) -> types.GenerateContentResponse:
+        """
+        Vollständige Antwort: ein Textteil und response_images Bilder sowie usage_metadata.
+        """
+        parts = [types.Part(text=f"Stub-Antwort von {model}")]
+        parts += [types.Part.from_bytes(data=self._image_data, mime_type=f"image/{self.image_format.lower()}")
+                  for _ in range(self.response_images)]
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role="model", parts=parts), finish_reason="STOP")],
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=10, candidates_token_count=10 + 1290 * self.response_images,
+                total_token_count=20 + 1290 * self.response_images)
+        )
+
+    def create_client(self, api_key: str = "", **kwargs) -> "StubClient":
+        """
+        Fabrik mit derselben Signatur wie genai.Client.
+        """
+        return StubClient(self, api_key)
+
+
+def _payload_bytes(contents) -> int:
+    """
+    Summe der Bildbytes (inline_data) in contents, egal ob als Part oder Content übergeben.
+    """
+    total = 0
+    for item in contents or []:
+        parts = (item.parts or []) if isinstance(item, types.Content) else [item]
+        for part in parts:
+            if isinstance(part, types.Part) and part.inline_data and part.inline_data.data:
+                total += len(part.inline_data.data)
+    return total
+
+
+class _StubModels:
+    def __init__(self, backend: StubBackend):
+        self._backend = backend
+
+    def generate_content(self, *, model: str, contents, config=None) -> types.GenerateContentResponse:
+        self._backend.record("generate_content", self._backend.generate_latency_for(contents, config))
+        return self._backend.response(model)
+
+    def list(self, *, config=None) -> list[types.Model]:
+        self._backend.record("list", self._backend.metadata_latency)
+        return [types.Model(name="models/stub")]
+
+    def get(self, *, model: str, config=None) -> types.Model:
+        self._backend.record("get", self._backend.metadata_latency)
+        return types.Model(name=f"models/{model}")
+
+
+class _StubAsyncModels:
+    def __init__(self, backend: StubBackend):
+        self._backend = backend
+
+    async def generate_content(self, *, model: str, contents, config=None) -> types.GenerateContentResponse:
+        await self._backend.record_async("generate_content", self._backend.generate_latency_for(contents, config))
+        return self._backend.response(model)
+
+    async def generate_content_stream(self, *, model: str, contents, config=None):
+        await self._backend.record_async("generate_content_stream",
+                                         self._backend.generate_latency_for(contents, config) - self._backend.generate_latency)
+        return self._stream(model)
+
+    async def _stream(self, model: str):
+        # Text wird auf die Teilantworten verteilt, Bilder folgen in der letzten
+        response = self._backend.response(model)
+        text, images = response.candidates[0].content.parts[0].text, response.candidates[0].content.parts[1:]
+        words = text.split(" ")
+        chunks = max(1, self._backend.stream_chunks)
+        for index in range(chunks):
+            await asyncio.sleep(self._backend.generate_latency / chunks)
+            chunk_text = " ".join(words[index * len(words) // chunks:(index + 1) * len(words) // chunks])
+            last = index == chunks - 1
+            yield types.GenerateContentResponse(
+                candidates=[types.Candidate(content=types.Content(
+                    role="model", parts=[types.Part(text=chunk_text + ("" if last else " "))] + (images if last else [])
+                ))],
+                usage_metadata=response.usage_metadata if last else None
+            )
+
+
+class _StubCaches:
+    def __init__(self, backend: StubBackend):
+        self._backend = backend
+
+    def create(self, *, model: str, config: types.CreateCachedContentConfig) -> types.CachedContent:
+        return self._backend.create_cache(model, config)
+
+    def update(self, *, name: str, config: types.UpdateCachedContentConfig) -> types.CachedContent:
+        return self._backend.update_cache(name, config)
+
+
+class _StubAio:
+    def __init__(self, backend: StubBackend):
+        self.models = _StubAsyncModels(backend)
+
+
+class StubClient:
+    """
+    Ersatz für genai.Client, der alle Aufrufe an ein StubBackend meldet.
+    """
+
+    def __init__(self, backend: StubBackend, api_key: str = ""):
+        self.api_key = api_key
+        self.models = _StubModels(backend)
+        self.caches = _StubCaches(backend)
+        self.aio = _StubAio(backend)
@@ -0,0 +1,322 @@
+import json
+import os
+import threading
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # watchdog ist optional; ohne ihn wird bei jedem Zugriff die mtime geprüft
+    FileSystemEventHandler = object
+    Observer = None
+
+# Schemas der Konfigurationsdateien (vereinfachte Form von JSON Schema)
+_NUMBER = {"type": "number"}
+_INTEGER = {"type": "integer"}
+_STRING = {"type": "string"}
+_BOOLEAN = {"type": "boolean"}
+
+MODELS_SCHEMA = {
+    "type": "object",
+    "required": ["models"],
+    "properties": {
+        "models": {"type": "array", "items": _STRING},
+        "rate_limits": {
+            "type": "object",
+            "values": {"type": "object", "properties": {"rpm": _NUMBER, "tpm": _NUMBER}}
+        }
+    }
+}
+
+PROMPTS_SCHEMA = {
+    "type": "object",
+    "required": ["prompts"],
+    "properties": {"prompts": {"type": "array", "items": _STRING}}
+}
+
+API_CONFIG_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "temperature": _NUMBER,
+        "top_p": _NUMBER,
+        "top_k": _INTEGER,
+        "max_output_tokens": _INTEGER,
+        "max_retries": _INTEGER,
+        "base_wait_time": _NUMBER,
+        "cache_ttl": _NUMBER,
+        "key_validation_ttl": _NUMBER,
+        "streaming": _BOOLEAN,
+        "response_cache": {
+            "type": "object",
+            "properties": {
+                "memory_max_entries": _INTEGER,
+                "memory_ttl": _NUMBER,
+                "disk_enabled": _BOOLEAN,
+                "disk_dir": _STRING,
+                "disk_max_entries": _INTEGER,
+                "disk_ttl": _NUMBER
+            }
+        },
+        "image_ingest": {
+            "type": "object",
+            "properties": {"max_bytes": _INTEGER, "max_pixels": _INTEGER}
+        },
+        "image_preprocessing": {
+            "type": "object",
+            "properties": {
+                "enabled": _BOOLEAN,
+                "max_edge": _INTEGER,
+                "format": {"type": "string", "enum": ["JPEG", "WEBP", "PNG", "jpeg", "webp", "png"]},
+                "quality": _INTEGER,
+                "strip_metadata": _BOOLEAN
+            }
+        },
+        "metrics": {
+            "type": "object",
+            "properties": {
+                "prometheus_enabled": _BOOLEAN,
+                "prometheus_host": _STRING,
+                "prometheus_port": _INTEGER,
+                "otel_log_enabled": _BOOLEAN,
+                "otel_log_path": _STRING
+            }
+        },
+        "history": {
+            "type": "object",
+            "properties": {
+                "enabled": _BOOLEAN,
+                "db_path": _STRING,
+                "blob_dir": _STRING,
+                "thumbnail_size": _INTEGER,
+                "page_size": _INTEGER
+            }
+        },
+        "context_cache": {
+            "type": "object",
+            "properties": {
+                "enabled": _BOOLEAN,
+                "ttl": _NUMBER,
+                "min_uses": _INTEGER,
+                "refresh_margin": _NUMBER,
+                "max_entries": _INTEGER,
+                "negative_ttl": _NUMBER
+            }
+        },
+        "retry": {
+            "type": "object",
+            "properties": {"max_wait": _NUMBER, "deadline": _NUMBER, "attempt_timeout": _NUMBER}
+        },
+        "circuit_breaker": {
+            "type": "object",
+            "properties": {
+                "enabled": _BOOLEAN,
+                "failure_threshold": _INTEGER,
+                "recovery_time": _NUMBER,
+                "max_fallbacks": _INTEGER
+            }
+        },
+        "batch": {
+            "type": "object",
+            "properties": {"concurrency": _INTEGER, "output_dir": _STRING, "root_dir": _STRING, "model": _STRING}
+        },
+        "server": {
+            "type": "object",
+            "properties": {
+                "host": _STRING,
+                "port": _INTEGER,
+                "max_concurrency": _INTEGER,
+                "max_queue": _INTEGER,
+                "queue_timeout": _NUMBER,
+                "max_images": _INTEGER,
+                "client_pool_size": _INTEGER,
+                "model": _STRING
+            }
+        }
+    }
+}
+
+THEMES_SCHEMA = {
+    "type": "object",
+    "required": ["themes"],
+    "properties": {
+        "themes": {
+            "type": "object",
+            "values": {
+                "type": "object",
+                "required": ["background_color", "text_color", "button_color", "button_text_color"],
+                "values": _STRING
+            }
+        }
+    }
+}
+
+_TYPE_CHECKS = {
+    "object": lambda value: isinstance(value, dict),
+    "array": lambda value: isinstance(value, list),
+    "string": lambda value: isinstance(value, str),
+    "number": lambda value: isinstance(value, (int, float)) and not isinstance(value, bool),
+    "integer": lambda value: isinstance(value, int) and not isinstance(value, bool),
+    "boolean": lambda value: isinstance(value, bool),
+}
+
+
+class ConfigValidationError(ValueError):
+    """
+    Wird ausgelöst, wenn eine Konfigurationsdatei nicht dem erwarteten Schema entspricht.
+    """
+
+    def __init__(self, path: str, errors: list[str]):
+        super().__init__(f"{path}: " + "; ".join(errors))
+        self.path = path
+        self.errors = errors
+
+
+def validate(data, schema: dict, location: str = "$") -> list[str]:
+    """
+    Prüft Daten gegen ein vereinfachtes Schema.
+
+    Unterstützt werden "type", "properties", "required", "values" (Schema für
+    alle Werte eines Objekts ohne eigene Property), "items" und "enum".
+
+    Rückgabe:
+      Liste der gefundenen Fehler (leer, wenn die Daten gültig sind).
+    """
+    expected = schema.get("type")
+    if expected and not _TYPE_CHECKS[expected](data):
+        return [f"{location}: erwartet {expected}, gefunden {type(data).__name__}"]
+    errors = []
+    if "enum" in schema and data not in schema["enum"]:
+        errors.append(f"{location}: {data!r} ist nicht erlaubt ({', '.join(map(str, schema['enum']))})")
+    if expected == "object":
+        properties = schema.get("properties", {})
+        for name in schema.get("required", []):
+            if name not in data:
+                errors.append(f"{location}: Feld '{name}' fehlt")
+        for name, value in data.items():
+            child_schema = properties.get(name, schema.get("values"))
+            if child_schema is not None:
+                errors.extend(validate(value, child_schema, f"{location}.{name}"))
+    elif expected == "array" and "items" in schema:
+        for index, item in enumerate(data):
+            errors.extend(validate(item, schema["items"], f"{location}[{index}]"))
+    return errors
+
+
+# Ereignisse, die auf eine Änderung hinweisen (reine Lesezugriffe werden ignoriert)
+_CHANGE_EVENTS = {"created", "modified", "deleted", "moved", "closed"}
+
+
+class _InvalidationHandler(FileSystemEventHandler):
+    def __init__(self, store: "ConfigStore"):
+        super().__init__()
+        self._store = store
+
+    def on_any_event(self, event) -> None:
+        if event.is_directory or event.event_type not in _CHANGE_EVENTS:
+            return
+        for path in (getattr(event, "src_path", None), getattr(event, "dest_path", None)):
+            if path:
+                self._store.invalidate(os.fsdecode(path))
+
+
+class ConfigStore:
+    """
+    Prozessweiter Cache für JSON-Konfigurationsdateien.
+
+    Jede Datei wird nur beim ersten Zugriff und nach einer Änderung gelesen,
+    geparst und validiert. Ist watchdog installiert, werden Änderungen per
+    Dateisystem-Ereignis erkannt und der Cache ohne Dateizugriff bedient;
+    andernfalls wird bei jedem Zugriff die mtime verglichen (ein stat-Aufruf).
+    Die zurückgegebenen Daten werden geteilt und dürfen nicht verändert werden.
+    """
+
+    def __init__(self, watch: bool = True):
+        self._entries: dict[str, tuple[tuple[int, int], object]] = {}
+        # Zähler je Datei, damit ein während des Lesens geänderter Inhalt nicht gecacht wird
+        self._versions: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._watch = watch and Observer is not None
+        self._observer = None
+        self._watched_dirs: set[str] = set()
+        self._stats = {"hits": 0, "loads": 0, "invalidations": 0}
+
+    def load(self, path: str, schema: dict | None = None):
+        """
+        Liefert den Inhalt einer JSON-Datei aus dem Cache oder lädt ihn neu.
+
+        Ausnahmen:
+          FileNotFoundError, json.JSONDecodeError und ConfigValidationError
+          werden weitergereicht, damit der Aufrufer Standardwerte verwenden kann.
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and self._is_watched(path):
+                self._stats["hits"] += 1
+                return entry[1]
+        self._ensure_watch(os.path.dirname(path))
+
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == signature:
+                self._stats["hits"] += 1
+                return entry[1]
+            version = self._versions.get(path, 0)
+
+        with open(path, 'r', encoding="utf-8") as f:
+            data = json.load(f)
+        if schema is not None:
+            errors = validate(data, schema)
+            if errors:
+                raise ConfigValidationError(path, errors)
+
+        with self._lock:
+            if self._versions.get(path, 0) == version:
+                self._entries[path] = (signature, data)
+            self._stats["loads"] += 1
+        return data
+
+    def invalidate(self, path: str | None = None) -> None:
+        """
+        Verwirft den Cache-Eintrag einer Datei (oder alle Einträge ohne Pfadangabe).
+        """
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+                for known_path in self._versions:
+                    self._versions[known_path] += 1
+            else:
+                path = os.path.abspath(path)
+                self._versions[path] = self._versions.get(path, 0) + 1
+                if self._entries.pop(path, None) is None:
+                    return
+            self._stats["invalidations"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), watching=sorted(self._watched_dirs))
+
+    def _is_watched(self, path: str) -> bool:
+        return os.path.dirname(path) in self._watched_dirs
+
+    def _ensure_watch(self, directory: str) -> None:
+        if not self._watch or directory in self._watched_dirs:
+            return
+        with self._lock:
+            if directory in self._watched_dirs:
+                return
+            try:
+                if self._observer is None:
+                    self._observer = Observer()
+                    self._observer.daemon = True
+                    self._observer.start()
+                self._observer.schedule(_InvalidationHandler(self), directory, recursive=False)
+            except OSError:
+                # z.B. erschöpfte inotify-Limits: mtime-Prüfung bleibt als Rückfallebene
+                return
+            self._watched_dirs.add(directory)
+
+
+# Gemeinsame Instanz für App, Batch-Modus und Benchmarks
+CONFIG_STORE = ConfigStore()
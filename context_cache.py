@@ -0,0 +1,233 @@
+"""
+Explizites Context Caching der Gemini-API für wiederkehrende Präfixe.
+
+Wer viele Prompts gegen dieselben Referenzbilder schickt, lädt diese Bilder
+sonst bei jedem Aufruf erneut hoch und zahlt ihre Tokens jedes Mal. Die
+Registry legt für ein solches Präfix (Bilder und optional eine
+Systemanweisung) einmal einen Cache bei der API an und gibt danach nur noch
+dessen Namen zurück; die Anfrage enthält dann nur den Prompt und verweist über
+cached_content auf das Präfix.
+"""
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+from metrics import METRICS
+from retry_policy import ERROR_UNKNOWN, classify_error
+
+if TYPE_CHECKING:
+    from google import genai
+    from google.genai import types
+
+# Standardwerte für das Context Caching (Zeiten in Sekunden)
+DEFAULT_CONTEXT_CACHE_CONFIG = {
+    "enabled": True,
+    "ttl": 900,
+    "min_uses": 2,
+    "refresh_margin": 60,
+    "max_entries": 64,
+    "negative_ttl": 300
+}
+
+
+def context_cache_key(model_name: str, owner: str, images: list[bytes],
+                      system_instruction: str | None = None) -> str:
+    """
+    Berechnet den inhaltsadressierten Schlüssel eines Präfixes.
+
+    Parameter:
+      model_name: Das Modell; Caches gelten nur für das Modell, mit dem sie angelegt wurden.
+      owner: Kennung des API-Keys (z.B. rate_limiter.api_key_id); Caches
+             gehören dem Projekt des Keys und sind für andere Keys unsichtbar.
+      images: Die vorverarbeiteten Bilder des Präfixes in Upload-Reihenfolge.
+      system_instruction: Optionale Systemanweisung des Präfixes.
+
+    Rückgabe:
+      Ein SHA-256-Hexdigest.
+    """
+    digest = hashlib.sha256()
+    digest.update(model_name.encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(owner.encode("utf-8"))
+    for image_bytes in images:
+        digest.update(b"\x00")
+        digest.update(hashlib.sha256(image_bytes).digest())
+    digest.update(b"\x00")
+    digest.update((system_instruction or "").encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ContextCacheRegistry:
+    """
+    Lokale Registry der Cache-Handles der API, geschlüsselt nach Inhalts-Hash.
+
+    Ein Cache wird erst angelegt, wenn ein Präfix min_uses-mal verwendet wurde,
+    denn das Anlegen kostet einen zusätzlichen Aufruf und Speichergebühren.
+    Kurz vor Ablauf wird die TTL verlängert; ist der Handle abgelaufen oder
+    schlägt die Verlängerung fehl, wird der Cache neu angelegt. Schlägt das
+    Anlegen fehl (z.B. zu wenige Tokens für das Modell oder ein Netzwerkfehler),
+    werden für negative_ttl Sekunden alle Präfixe desselben Modells und Keys
+    inline gesendet, statt das Anlegen bei jeder Anfrage erneut zu versuchen.
+    Die Registry ist threadsicher und
+    wird von allen Sitzungen gemeinsam genutzt; die Netzwerkaufrufe laufen
+    nur unter der Sperre des jeweiligen Eintrags.
+
+    Parameter:
+      ttl: Lebensdauer eines Caches bei der API.
+      min_uses: Anzahl Verwendungen eines Präfixes, ab der ein Cache angelegt wird.
+      refresh_margin: Restlaufzeit, ab der die TTL vor der Verwendung verlängert wird.
+      max_entries: Maximale Anzahl lokal gehaltener Einträge (LRU).
+      negative_ttl: Dauer, für die nach einem fehlgeschlagenen Anlegen kein
+        weiterer Cache für dasselbe Modell und denselben Key angelegt wird.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_CONTEXT_CACHE_CONFIG["ttl"],
+                 min_uses: int = DEFAULT_CONTEXT_CACHE_CONFIG["min_uses"],
+                 refresh_margin: float = DEFAULT_CONTEXT_CACHE_CONFIG["refresh_margin"],
+                 max_entries: int = DEFAULT_CONTEXT_CACHE_CONFIG["max_entries"],
+                 negative_ttl: float = DEFAULT_CONTEXT_CACHE_CONFIG["negative_ttl"]):
+        self.ttl = ttl
+        self.min_uses = min_uses
+        self.refresh_margin = refresh_margin
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        # (owner, Modell) -> Zeitpunkt, bis zu dem nach einem Fehler nichts angelegt wird
+        self._failed_until: dict[tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "inline": 0, "created": 0, "extended": 0, "errors": 0, "invalidated": 0}
+
+    @classmethod
+    def from_config(cls, config: dict) -> "ContextCacheRegistry":
+        """
+        Erstellt die Registry aus dem Abschnitt "context_cache" der api_config.json.
+        """
+        settings = {**DEFAULT_CONTEXT_CACHE_CONFIG, **config}
+        return cls(
+            ttl=settings["ttl"],
+            min_uses=settings["min_uses"],
+            refresh_margin=settings["refresh_margin"],
+            max_entries=settings["max_entries"],
+            negative_ttl=settings["negative_ttl"],
+        )
+
+    def resolve(self, client: genai.Client, model_name: str, key: str, parts: list[types.Part],
+                system_instruction: str | None = None, owner: str = "") -> str | None:
+        """
+        Liefert den Namen eines gültigen Caches für das Präfix und legt ihn bei
+        Bedarf an, verlängert oder erneuert ihn.
+
+        Parameter:
+          client: Client des API-Keys, dem der Cache gehört.
+          model_name: Das Modell der Anfrage.
+          key: Schlüssel aus context_cache_key.
+          parts: Die Teile des Präfixes (z.B. die vorverarbeiteten Bilder).
+          system_instruction: Optionale Systemanweisung des Präfixes.
+          owner: Kennung des API-Keys; fehlgeschlagenes Anlegen wird je Key und
+            Modell gemerkt (siehe negative_ttl).
+
+        Rückgabe:
+          Der Cache-Name (cachedContents/...) oder None, wenn das Präfix
+          inline gesendet werden soll.
+        """
+        from google.genai import types
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = {"lock": threading.Lock(), "name": None, "expires_at": 0.0, "uses": 0, "error": None}
+                self._entries[key] = entry
+                while len(self._entries) > self.max_entries:
+                    # Der Cache bei der API läuft über seine TTL von selbst ab
+                    self._entries.popitem(last=False)
+            self._entries.move_to_end(key)
+            entry["uses"] += 1
+
+        with entry["lock"]:
+            now = time.time()
+            if entry["name"] and now < entry["expires_at"] - self.refresh_margin:
+                return self._result(entry, "hit")
+            if entry["uses"] < self.min_uses:
+                return self._result(entry, "inline")
+
+            if entry["name"] and now < entry["expires_at"]:
+                try:
+                    updated = client.caches.update(
+                        name=entry["name"],
+                        config=types.UpdateCachedContentConfig(ttl=f"{int(self.ttl)}s")
+                    )
+                    entry["expires_at"] = self._expires_at(updated, now)
+                    return self._result(entry, "extended")
+                except Exception as e:
+                    # API- oder Netzwerkfehler: Handle nicht mehr verwendbar, unten neu anlegen
+                    if classify_error(e) == ERROR_UNKNOWN:
+                        raise
+
+            scope = (owner, model_name)
+            with self._lock:
+                failed_until = self._failed_until.get(scope, 0.0)
+            if now < failed_until:
+                entry.update(name=None, expires_at=0.0)
+                return self._result(entry, "inline")
+            try:
+                cached = client.caches.create(
+                    model=model_name,
+                    config=types.CreateCachedContentConfig(
+                        contents=[types.Content(role="user", parts=parts)],
+                        system_instruction=system_instruction,
+                        ttl=f"{int(self.ttl)}s",
+                        display_name=f"prefix-{key[:16]}"
+                    )
+                )
+            except Exception as e:
+                # Z.B. zu wenige Tokens, Modell ohne Context Caching oder Zeitüberschreitung;
+                # die Anfrage selbst läuft mit dem Präfix inline weiter
+                if classify_error(e) == ERROR_UNKNOWN:
+                    raise
+                with self._lock:
+                    self._failed_until[scope] = now + self.negative_ttl
+                entry.update(name=None, expires_at=0.0, error=str(e)[:200])
+                return self._result(entry, "error")
+            entry.update(name=cached.name, expires_at=self._expires_at(cached, now), error=None)
+            return self._result(entry, "created")
+
+    def invalidate(self, key: str) -> None:
+        """
+        Verwirft den Handle eines Präfixes, z.B. wenn eine Anfrage mit diesem
+        Cache fehlgeschlagen ist. Die nächste Verwendung legt ihn neu an.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            self._stats["invalidated"] += 1
+        with entry["lock"]:
+            entry.update(name=None, expires_at=0.0)
+
+    def stats(self) -> dict:
+        """
+        Gibt die Zähler und die aktiven Handles (ohne Schlüssel) zurück.
+        """
+        now = time.time()
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["active"] = sum(1 for entry in self._entries.values()
+                                  if entry["name"] and entry["expires_at"] > now)
+            return stats
+
+    def _result(self, entry: dict, result: str) -> str | None:
+        counter = {"hit": "hits", "error": "errors"}.get(result, result)
+        with self._lock:
+            self._stats[counter] += 1
+        METRICS.inc("genai_context_cache_total", {"result": result})
+        return entry["name"] if result in ("hit", "extended", "created") else None
+
+    def _expires_at(self, cached: types.CachedContent, now: float) -> float:
+        if cached.expire_time is not None:
+            return cached.expire_time.timestamp()
+        return now + self.ttl
@@ -0,0 +1,790 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import queue
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Iterator
+
+if TYPE_CHECKING:
+    from google import genai
+    from google.genai import types
+
+from metrics import METRICS, NULL_TRACE, Trace, record_usage
+from rate_limiter import PRIORITY_INTERACTIVE, RateLimitScheduler, estimate_tokens, retry_after_seconds
+from retry_policy import (BREAKER_ERRORS, ERROR_CIRCUIT_OPEN, ERROR_LABELS, ERROR_QUOTA, ERROR_UNKNOWN,
+                          RETRYABLE_ERRORS, CircuitBreakerRegistry, RetryPolicy, SafetyBlockedError,
+                          blocked_reason, classify_error)
+
+logger = logging.getLogger(__name__)
+
+# Standardwerte für Wiederholungsversuche
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BASE_WAIT_TIME = 1
+
+
+class GenerationError(RuntimeError):
+    """
+    Wird ausgelöst, wenn ein API-Aufruf endgültig fehlschlägt.
+
+    Parameter:
+      message: Die Fehlermeldung.
+      error_class: Die Fehlerklasse des letzten Versuchs (siehe retry_policy.classify_error).
+    """
+
+    def __init__(self, message: str, error_class: str = ERROR_UNKNOWN):
+        super().__init__(message)
+        self.error_class = error_class
+
+
+def request_fingerprint(model_name: str, contents: list, config: types.GenerateContentConfig | None) -> str:
+    """
+    Berechnet einen Hash über alle Bestandteile einer Anfrage.
+    Identische Anfragen erhalten denselben Fingerabdruck.
+
+    Parameter:
+      model_name: Der Name des Modells.
+      contents: Liste der Inhalte (Text, Bytes, PIL-Bilder oder SDK-Typen).
+      config: Konfigurationseinstellungen für die API-Anfrage.
+    """
+    digest = hashlib.sha256()
+    digest.update(model_name.encode("utf-8"))
+    for item in contents:
+        _update_fingerprint(digest, item)
+    if config is not None:
+        digest.update(b"\x00")
+        digest.update(config.model_dump_json(exclude_none=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _update_fingerprint(digest, item) -> None:
+    digest.update(b"\x00")
+    # PIL-Bilder können nur vorkommen, wenn PIL bereits geladen ist
+    pil_image = sys.modules.get("PIL.Image")
+    inline_data = getattr(item, "inline_data", None)
+    if isinstance(item, str):
+        digest.update(item.encode("utf-8"))
+    elif isinstance(item, bytes):
+        digest.update(hashlib.sha256(item).digest())
+    elif pil_image is not None and isinstance(item, pil_image.Image):
+        digest.update(f"{item.mode}{item.size}".encode("utf-8"))
+        digest.update(hashlib.sha256(item.tobytes()).digest())
+    elif inline_data is not None and inline_data.data is not None:
+        # Bilddaten direkt hashen; model_dump_json würde sie erst Base64-kodieren
+        digest.update(f"{inline_data.mime_type}".encode("utf-8"))
+        digest.update(hashlib.sha256(inline_data.data).digest())
+    elif isinstance(getattr(item, "parts", None), list):
+        digest.update(f"{getattr(item, 'role', None)}".encode("utf-8"))
+        for part in item.parts:
+            _update_fingerprint(digest, part)
+    elif hasattr(item, "model_dump_json"):
+        digest.update(item.model_dump_json(exclude_none=True).encode("utf-8"))
+    else:
+        digest.update(repr(item).encode("utf-8"))
+
+
+# Laufende Anfragen je Event-Loop und Fingerabdruck für das Zusammenführen (Coalescing)
+_in_flight: dict[tuple[int, int, str], asyncio.Task] = {}
+# Anzahl der Aufrufer, die auf eine laufende Anfrage warten
+_waiter_counts: dict[asyncio.Task, int] = {}
+_coalescing_stats = {"upstream_calls": 0, "coalesced": 0}
+
+
+def coalescing_stats() -> dict:
+    """
+    Gibt zurück, wie viele Anfragen an die API gingen und wie viele sich einer
+    bereits laufenden identischen Anfrage angeschlossen haben.
+    """
+    return dict(_coalescing_stats, in_flight=len(_in_flight))
+
+
+# Fehler je Klasse und Entscheidungen der Wiederholungsstrategie
+_retry_stats = {"errors": {}, "retried": 0, "gave_up": 0, "fallbacks": 0, "rejected": 0}
+
+
+def retry_stats() -> dict:
+    """
+    Gibt die Fehler je Fehlerklasse sowie die Zahl der Wiederholungen,
+    Abbrüche, Ausweichmodelle und vom Circuit Breaker abgewiesenen Aufrufe zurück.
+    """
+    return {**_retry_stats, "errors": dict(_retry_stats["errors"])}
+
+
+def _check_circuit(breakers: CircuitBreakerRegistry | None, model_name: str) -> None:
+    """
+    Bricht sofort ab, wenn der Circuit Breaker des Modells keinen Aufruf zulässt.
+    """
+    if breakers is not None and not breakers.allow(model_name):
+        _retry_stats["rejected"] += 1
+        raise GenerationError(f"{model_name} ist nach wiederholten Fehlern vorübergehend gesperrt "
+                              f"(nächster Versuch in {breakers.retry_in(model_name):.0f} Sekunden).",
+                              ERROR_CIRCUIT_OPEN)
+
+
+def _handle_attempt_error(error: Exception, model_name: str, attempt: int, previous_delay: float | None,
+                          started: float, policy: RetryPolicy, breakers: CircuitBreakerRegistry | None,
+                          scheduler: RateLimitScheduler | None, scheduler_key: str) -> tuple[str, float, bool]:
+    """
+    Klassifiziert den Fehler eines Versuchs, meldet ihn an Circuit Breaker und
+    Scheduler und entscheidet über einen weiteren Versuch.
+
+    Rückgabe:
+      Fehlerklasse, Wartezeit vor dem nächsten Versuch und ob erneut versucht wird.
+    """
+    error_class = classify_error(error)
+    METRICS.inc("genai_errors_total", {"model": model_name, "class": error_class})
+    _retry_stats["errors"][error_class] = _retry_stats["errors"].get(error_class, 0) + 1
+    if breakers is not None and error_class != ERROR_QUOTA:
+        # 429 betrifft nur diesen Key und sagt nichts über den Zustand des Modells aus
+        breakers.record(model_name, healthy=error_class not in BREAKER_ERRORS)
+    retry_after = retry_after_seconds(error)
+    delay = policy.next_delay(previous_delay, retry_after)
+    if scheduler is not None and error_class == ERROR_QUOTA:
+        # Alle Sitzungen mit diesem Key und Modell pausieren, nicht nur diese Anfrage
+        scheduler.throttle(scheduler_key, model_name, retry_after or delay)
+    retry = policy.should_retry(error_class, attempt, delay, started)
+    _retry_stats["retried" if retry else "gave_up"] += 1
+    return error_class, delay, retry
+
+
+def _failure_message(error: Exception, error_class: str, attempts: int, policy: RetryPolicy) -> str:
+    # Zeitüberschreitungen haben oft keinen eigenen Text
+    error = str(error) or type(error).__name__
+    if error_class not in RETRYABLE_ERRORS:
+        return f"API-Aufruf fehlgeschlagen ({ERROR_LABELS[error_class]}, keine Wiederholung): {error}"
+    if attempts < policy.max_retries:
+        return (f"API-Aufruf hat das Zeitbudget von {policy.deadline} Sekunden nach {attempts} "
+                f"Versuchen überschritten: {error}")
+    return f"API-Aufruf ist nach {attempts} Versuchen fehlgeschlagen: {error}"
+
+
+def _time_left(deadline: float | None) -> float | None:
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+def _can_fall_back(error: GenerationError, policy: RetryPolicy, started: float) -> bool:
+    """
+    Ausgewichen wird nur bei Störungen des Modells, solange Zeitbudget bleibt.
+    """
+    return error.error_class in RETRYABLE_ERRORS | {ERROR_CIRCUIT_OPEN} and policy.remaining(started) != 0
+
+
+def _note_fallback(model_name: str, fallback: str, error: GenerationError, trace: Trace,
+                   on_warning: Callable[[str], None]) -> None:
+    _retry_stats["fallbacks"] += 1
+    METRICS.inc("genai_circuit_breaker_total", {"model": model_name, "event": "fallback"})
+    trace.annotate(fallback_model=fallback, fallback_from=model_name)
+    on_warning(f"{model_name} nicht verfügbar ({ERROR_LABELS[error.error_class]}). Weiche auf {fallback} aus...")
+
+
+async def _generate_with_model(client: genai.Client, model_name: str, contents: list,
+                               config: types.GenerateContentConfig, on_warning: Callable[[str], None],
+                               scheduler: RateLimitScheduler | None, scheduler_key: str, priority: int,
+                               trace: Trace, policy: RetryPolicy, breakers: CircuitBreakerRegistry | None,
+                               started: float) -> types.GenerateContentResponse:
+    labels = {"model": model_name}
+    estimated_tokens = estimate_tokens(contents)
+    delay = None
+    for attempt in range(policy.max_retries):
+        _check_circuit(breakers, model_name)
+        if scheduler is not None:
+            with trace.span("rate_limit", estimated_tokens=estimated_tokens):
+                await scheduler.acquire(scheduler_key, model_name, estimated_tokens, priority)
+        METRICS.inc("genai_attempts_total", labels)
+        attempt_span = trace.start_span("api_attempt", attempt=attempt + 1, model=model_name)
+        try:
+            response = await asyncio.wait_for(
+                client.aio.models.generate_content(
+                    model=model_name,
+                    contents=contents,
+                    config=config
+                ),
+                timeout=policy.attempt_timeout_for(started)
+            )
+            usage = record_usage(model_name, response.usage_metadata)
+            if scheduler is not None and response.usage_metadata:
+                scheduler.settle(scheduler_key, model_name, estimated_tokens,
+                                 response.usage_metadata.prompt_token_count)
+            reason = blocked_reason(response)
+            if reason is not None:
+                raise SafetyBlockedError(f"Die Antwort wurde von den Sicherheitsfiltern blockiert ({reason}).")
+            trace.end_span(attempt_span, status="ok", **{f"tokens_{kind}": count for kind, count in usage.items()})
+            trace.annotate(attempts=attempt + 1, **{f"tokens_{kind}": count for kind, count in usage.items()})
+            METRICS.inc("genai_requests_total", {**labels, "status": "ok"})
+            if breakers is not None:
+                breakers.record(model_name, healthy=True)
+            return response
+        except Exception as e:
+            error_class, delay, retry = _handle_attempt_error(e, model_name, attempt, delay, started, policy,
+                                                              breakers, scheduler, scheduler_key)
+            trace.end_span(attempt_span, status="error", error_class=error_class, error=str(e)[:200])
+            if retry:
+                METRICS.inc("genai_retries_total", labels)
+                on_warning(f"API-Aufruf fehlgeschlagen ({ERROR_LABELS[error_class]}, Versuch {attempt + 1}/"
+                           f"{policy.max_retries}). Wiederhole in {delay:.2f} Sekunden...")
+                with trace.span("backoff", seconds=round(delay, 3)):
+                    await asyncio.sleep(delay)
+            else:
+                trace.annotate(attempts=attempt + 1)
+                METRICS.inc("genai_requests_total", {**labels, "status": "error"})
+                raise GenerationError(_failure_message(e, error_class, attempt + 1, policy), error_class) from e
+    raise GenerationError("API-Aufruf wurde nicht ausgeführt (max_retries < 1).")
+
+
+async def _generate_upstream(client: genai.Client, model_name: str, contents: list,
+                             config: types.GenerateContentConfig, on_warning: Callable[[str], None],
+                             scheduler: RateLimitScheduler | None, scheduler_key: str,
+                             priority: int, trace: Trace | None, policy: RetryPolicy,
+                             breakers: CircuitBreakerRegistry | None,
+                             fallback_models: list[str]) -> types.GenerateContentResponse:
+    trace = trace or NULL_TRACE
+    started = time.monotonic()
+    models = [model_name, *fallback_models]
+    for index, model in enumerate(models):
+        try:
+            return await _generate_with_model(client, model, contents, config, on_warning, scheduler,
+                                              scheduler_key, priority, trace, policy, breakers, started)
+        except GenerationError as e:
+            if index == len(models) - 1 or not _can_fall_back(e, policy, started):
+                trace.annotate(error_class=e.error_class)
+                raise
+            _note_fallback(model, models[index + 1], e, trace, on_warning)
+    raise GenerationError("API-Aufruf wurde nicht ausgeführt (kein Modell angegeben).")
+
+
+async def generate_content_with_retry_async(client: genai.Client, model_name: str, contents: list,
+                                            config: types.GenerateContentConfig,
+                                            max_retries: int, base_wait_time: int,
+                                            on_warning: Callable[[str], None] | None = None,
+                                            on_error: Callable[[str], None] | None = None,
+                                            coalesce_key: str | None = None,
+                                            scheduler: RateLimitScheduler | None = None,
+                                            scheduler_key: str = "",
+                                            priority: int = PRIORITY_INTERACTIVE,
+                                            trace: Trace | None = None,
+                                            policy: RetryPolicy | None = None,
+                                            breakers: CircuitBreakerRegistry | None = None,
+                                            fallback_models: list[str] | None = None) -> types.GenerateContentResponse | None:
+    """
+    Asynchrone Generierung mit Wiederholungsversuchen über client.aio.models.
+    Wiederholt werden nur vorübergehende Fehler (Kontingent, Serverfehler,
+    Zeitüberschreitungen; siehe retry_policy); Authentifizierungsfehler,
+    ungültige Anfragen und blockierte Antworten schlagen sofort fehl. Die
+    Wartezeit zwischen den Versuchen blockiert keinen Thread. Mit einem
+    Scheduler wartet jeder Versuch, bis die Requests- und Tokens-pro-Minute-
+    Limits des Keys und Modells es zulassen.
+
+    Ist ein Modell gestört (alle Versuche vorübergehend fehlgeschlagen oder
+    Circuit Breaker offen), wird nacheinander auf fallback_models
+    ausgewichen. Das tatsächlich verwendete Modell wird im Trace als
+    fallback_model vermerkt.
+
+    Identische gleichzeitige Anfragen werden zusammengeführt: Die erste Anfrage
+    führt den API-Aufruf aus, alle weiteren warten auf dasselbe Ergebnis.
+
+    Parameter:
+      client, model_name, contents, config, max_retries, base_wait_time:
+        Wie bei generate_content_with_retry.
+      on_warning: Optionaler Callback für Meldungen zu Wiederholungsversuchen.
+      on_error: Optionaler Callback für die Meldung nach dem letzten Fehlversuch.
+      coalesce_key: Optionaler Schlüssel für das Zusammenführen. Ohne Angabe
+        wird er mit request_fingerprint berechnet.
+      scheduler: Optionaler RateLimitScheduler, der vor jedem Versuch angefragt wird.
+      scheduler_key: Bezeichner des API-Keys für den Scheduler (siehe api_key_id).
+      priority: Priorität in der Warteschlange des Schedulers (kleiner = früher).
+      trace: Optionaler Trace (siehe metrics.Trace) für Wartezeiten, Versuche und
+        Token-Zahlen. Schließt sich die Anfrage einer laufenden an, wird nur
+        coalesced=True vermerkt.
+      policy: Optionale RetryPolicy (Wartezeiten, Zeitbudget, Zeitlimit je
+        Versuch). Ohne Angabe gelten max_retries, base_wait_time und die
+        Standardwerte aus retry_policy.DEFAULT_RETRY_CONFIG.
+      breakers: Optionale prozessweite CircuitBreakerRegistry.
+      fallback_models: Ausweichmodelle in der Reihenfolge ihrer Verwendung.
+
+    Rückgabe:
+      Die API-Antwort, oder None, wenn alle Versuche fehlschlagen.
+    """
+    on_warning = on_warning or logger.warning
+    on_error = on_error or logger.error
+    # Der Client gehört zum Schlüssel, damit Anfragen verschiedener API-Keys getrennt bleiben
+    key = (id(asyncio.get_running_loop()), id(client),
+           coalesce_key or request_fingerprint(model_name, contents, config))
+
+    task = _in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_generate_upstream(
+            client, model_name, contents, config, on_warning, scheduler, scheduler_key, priority, trace,
+            policy or RetryPolicy(max_retries, base_wait_time), breakers, fallback_models or []))
+        _in_flight[key] = task
+        _coalescing_stats["upstream_calls"] += 1
+
+        def _forget(done_task: asyncio.Task) -> None:
+            if _in_flight.get(key) is done_task:
+                del _in_flight[key]
+
+        task.add_done_callback(_forget)
+    else:
+        _coalescing_stats["coalesced"] += 1
+        (trace or NULL_TRACE).annotate(coalesced=True)
+
+    _waiter_counts[task] = _waiter_counts.get(task, 0) + 1
+    try:
+        # shield: Bricht ein Aufrufer ab, laufen die anderen Wartenden weiter
+        return await asyncio.shield(task)
+    except GenerationError as e:
+        on_error(str(e))
+        return None
+    finally:
+        _waiter_counts[task] -= 1
+        if not _waiter_counts[task]:
+            del _waiter_counts[task]
+            if not task.done():
+                # Der letzte Wartende hat abgebrochen: Die Anfrage wird nicht mehr gebraucht
+                if _in_flight.get(key) is task:
+                    del _in_flight[key]
+                task.cancel()
+
+
+class _BackgroundLoop:
+    """
+    Prozessweite Event-Loop in einem Hintergrund-Thread. Alle synchronen
+    Aufrufer (Streamlit-Sitzungen, Batch-Worker) teilen sich diese Loop, damit
+    identische Anfragen über Sitzungsgrenzen hinweg zusammengeführt werden.
+    """
+
+    def __init__(self):
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def get(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever,
+                                                name="genai-event-loop", daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def is_current_thread(self) -> bool:
+        return self._thread is threading.current_thread()
+
+
+_background_loop = _BackgroundLoop()
+
+
+def generate_content_with_retry(client: genai.Client, model_name: str, contents: list, config: types.GenerateContentConfig,
+                                max_retries: int, base_wait_time: int,
+                                on_warning: Callable[[str], None] | None = None,
+                                on_error: Callable[[str], None] | None = None,
+                                coalesce_key: str | None = None,
+                                scheduler: RateLimitScheduler | None = None,
+                                scheduler_key: str = "",
+                                priority: int = PRIORITY_INTERACTIVE,
+                                trace: Trace | None = None,
+                                policy: RetryPolicy | None = None,
+                                breakers: CircuitBreakerRegistry | None = None,
+                                fallback_models: list[str] | None = None) -> types.GenerateContentResponse | None:
+    """
+    Generiert Inhalte unter Verwendung von Wiederholungsversuchen (Decorrelated Jitter).
+
+    Synchroner Wrapper um generate_content_with_retry_async: Die Anfrage läuft
+    in der gemeinsamen Hintergrund-Loop. Meldungen werden im aufrufenden Thread
+    an die Callbacks (z.B. st.warning/st.error) oder andernfalls an das Logging
+    weitergegeben, damit Streamlit-Elemente im richtigen Kontext entstehen.
+
+    Parameter:
+      client: Der initialisierte GenAI-Client.
+      model_name: Der Name des zu verwendenden Modells.
+      contents: Liste der Inhalte (Text und ggf. Bilder).
+      config: Konfigurationseinstellungen für die API-Anfrage.
+      max_retries: Maximale Anzahl der Wiederholungsversuche bei einem Fehler.
+      base_wait_time: Basiswartezeit vor dem nächsten Versuch.
+      on_warning: Optionaler Callback für Meldungen zu Wiederholungsversuchen.
+      on_error: Optionaler Callback für die Meldung nach dem letzten Fehlversuch.
+      coalesce_key: Optionaler Schlüssel für das Zusammenführen identischer Anfragen.
+      scheduler: Optionaler prozessweiter RateLimitScheduler.
+      scheduler_key: Bezeichner des API-Keys für den Scheduler (siehe api_key_id).
+      priority: Priorität in der Warteschlange des Schedulers (kleiner = früher).
+      trace: Optionaler Trace (siehe metrics.Trace).
+      policy: Optionale RetryPolicy; überschreibt max_retries und base_wait_time.
+      breakers: Optionale prozessweite CircuitBreakerRegistry.
+      fallback_models: Ausweichmodelle bei einem gestörten Modell.
+
+    Rückgabe:
+      Die API-Antwort, oder None, wenn alle Versuche fehlschlagen.
+    """
+    if _background_loop.is_current_thread():
+        raise RuntimeError("generate_content_with_retry darf nicht in der Event-Loop aufgerufen werden; "
+                           "verwende generate_content_with_retry_async.")
+    on_warning = on_warning or logger.warning
+    on_error = on_error or logger.error
+    # Den Fingerabdruck hier berechnen, damit das Hashen der Bilder nicht die gemeinsame Loop blockiert
+    coalesce_key = coalesce_key or request_fingerprint(model_name, contents, config)
+    # Meldungen aus der Event-Loop; None signalisiert das Ende der Anfrage
+    messages: queue.Queue[tuple[Callable[[str], None], str] | None] = queue.Queue()
+
+    future = asyncio.run_coroutine_threadsafe(
+        generate_content_with_retry_async(
+            client, model_name, contents, config, max_retries, base_wait_time,
+            on_warning=lambda msg: messages.put((on_warning, msg)),
+            on_error=lambda msg: messages.put((on_error, msg)),
+            coalesce_key=coalesce_key,
+            scheduler=scheduler,
+            scheduler_key=scheduler_key,
+            priority=priority,
+            trace=trace,
+            policy=policy,
+            breakers=breakers,
+            fallback_models=fallback_models
+        ),
+        _background_loop.get()
+    )
+    future.add_done_callback(lambda _: messages.put(None))
+    try:
+        while (item := messages.get()) is not None:
+            callback, message = item
+            callback(message)
+        return future.result()
+    finally:
+        # Löst ein Callback eine Ausnahme aus, wird die Anfrage abgebrochen
+        future.cancel()
+
+
+def merge_stream_chunks(chunks: list[types.GenerateContentResponse]) -> types.GenerateContentResponse | None:
+    """
+    Fügt die Teilantworten eines Streams zu einer vollständigen Antwort zusammen,
+    z.B. für den Antwort-Cache. Aufeinanderfolgende Textteile werden verbunden,
+    Bilder bleiben eigene Teile; usage_metadata stammt aus der letzten Teilantwort.
+
+    Rückgabe:
+      Die zusammengeführte Antwort, oder None, wenn keine Teilantwort vorliegt.
+    """
+    if not chunks:
+        return None
+    from google.genai import types
+
+    parts: list[types.Part] = []
+    finish_reason = None
+    usage_metadata = None
+    has_candidates = False
+    for chunk in chunks:
+        usage_metadata = chunk.usage_metadata or usage_metadata
+        if not chunk.candidates:
+            continue
+        has_candidates = True
+        candidate = chunk.candidates[0]
+        finish_reason = candidate.finish_reason or finish_reason
+        for part in (candidate.content.parts if candidate.content and candidate.content.parts else []):
+            if part.text and parts and parts[-1].text:
+                parts[-1] = types.Part(text=parts[-1].text + part.text)
+            else:
+                parts.append(part)
+    candidates = [types.Candidate(content=types.Content(role="model", parts=parts),
+                                  finish_reason=finish_reason)] if has_candidates else []
+    return types.GenerateContentResponse(candidates=candidates, usage_metadata=usage_metadata,
+                                         model_version=chunks[-1].model_version)
+
+
+async def _close_stream(stream) -> None:
+    aclose = getattr(stream, "aclose", None)
+    if aclose is None:
+        return
+    try:
+        await aclose()
+    except Exception as e:
+        logger.debug("Stream konnte nicht geschlossen werden: %s", e)
+
+
+async def _stream_with_model(client: genai.Client, model_name: str, contents: list,
+                             config: types.GenerateContentConfig, on_warning: Callable[[str], None],
+                             scheduler: RateLimitScheduler | None, scheduler_key: str, priority: int,
+                             trace: Trace, policy: RetryPolicy, breakers: CircuitBreakerRegistry | None,
+                             started: float, metrics: dict, result: dict) -> AsyncIterator[dict]:
+    """
+    Versuche eines Streams mit einem Modell. Liefert chunk- und restart-
+    Ereignisse, legt die zusammengeführte Antwort in result["response"] ab und
+    löst nach dem letzten Fehlversuch GenerationError aus.
+    """
+    labels = {"model": model_name}
+    estimated_tokens = estimate_tokens(contents)
+    delay = None
+    for attempt in range(policy.max_retries):
+        _check_circuit(breakers, model_name)
+        if scheduler is not None:
+            with trace.span("rate_limit", estimated_tokens=estimated_tokens):
+                await scheduler.acquire(scheduler_key, model_name, estimated_tokens, priority)
+        metrics["attempts"] += 1
+        METRICS.inc("genai_attempts_total", labels)
+        attempt_span = trace.start_span("api_attempt", attempt=attempt + 1, stream=True, model=model_name)
+        # Das Zeitlimit gilt für den gesamten Stream, nicht für jede Teilantwort
+        timeout = policy.attempt_timeout_for(started)
+        attempt_deadline = None if timeout is None else time.monotonic() + timeout
+        chunks = []
+        stream = None
+        try:
+            stream = await asyncio.wait_for(
+                client.aio.models.generate_content_stream(
+                    model=model_name,
+                    contents=contents,
+                    config=config
+                ),
+                timeout=_time_left(attempt_deadline)
+            )
+            try:
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(stream.__anext__(), timeout=_time_left(attempt_deadline))
+                    except StopAsyncIteration:
+                        break
+                    if metrics["ttft"] is None:
+                        metrics["ttft"] = time.monotonic() - started
+                        METRICS.observe("genai_time_to_first_token_seconds", metrics["ttft"], labels)
+                    chunks.append(chunk)
+                    yield {"type": "chunk", "response": chunk}
+            finally:
+                # Auch nach Zeitüberschreitung oder Abbruch die Verbindung des Streams freigeben
+                await _close_stream(stream)
+            response = merge_stream_chunks(chunks)
+            usage = record_usage(model_name, response.usage_metadata if response is not None else None)
+            if scheduler is not None and response is not None and response.usage_metadata:
+                scheduler.settle(scheduler_key, model_name, estimated_tokens,
+                                 response.usage_metadata.prompt_token_count)
+            reason = blocked_reason(response) if response is not None else None
+            if reason is not None:
+                raise SafetyBlockedError(f"Die Antwort wurde von den Sicherheitsfiltern blockiert ({reason}).")
+            trace.end_span(attempt_span, status="ok", chunks=len(chunks),
+                           **{f"tokens_{kind}": count for kind, count in usage.items()})
+            METRICS.inc("genai_requests_total", {**labels, "status": "ok"})
+            if breakers is not None:
+                breakers.record(model_name, healthy=True)
+            result.update(response=response, usage=usage)
+            return
+        except Exception as e:
+            error_class, delay, retry = _handle_attempt_error(e, model_name, attempt, delay, started, policy,
+                                                              breakers, scheduler, scheduler_key)
+            trace.end_span(attempt_span, status="error", chunks=len(chunks), error_class=error_class,
+                           error=str(e)[:200])
+            if retry:
+                METRICS.inc("genai_retries_total", labels)
+                if chunks:
+                    metrics["restarts"] += 1
+                    yield {"type": "restart"}
+                on_warning(f"Stream nach {len(chunks)} Teilantworten fehlgeschlagen ({ERROR_LABELS[error_class]}, "
+                           f"Versuch {attempt + 1}/{policy.max_retries}). Starte neu in {delay:.2f} Sekunden...")
+                with trace.span("backoff", seconds=round(delay, 3)):
+                    await asyncio.sleep(delay)
+            else:
+                METRICS.inc("genai_requests_total", {**labels, "status": "error"})
+                result["partial"] = bool(chunks)
+                raise GenerationError(_failure_message(e, error_class, attempt + 1, policy), error_class) from e
+    raise GenerationError("API-Aufruf wurde nicht ausgeführt (max_retries < 1).")
+
+
+async def generate_content_stream_with_retry_async(client: genai.Client, model_name: str, contents: list,
+                                                   config: types.GenerateContentConfig,
+                                                   max_retries: int, base_wait_time: int,
+                                                   on_warning: Callable[[str], None] | None = None,
+                                                   on_error: Callable[[str], None] | None = None,
+                                                   scheduler: RateLimitScheduler | None = None,
+                                                   scheduler_key: str = "",
+                                                   priority: int = PRIORITY_INTERACTIVE,
+                                                   trace: Trace | None = None,
+                                                   policy: RetryPolicy | None = None,
+                                                   breakers: CircuitBreakerRegistry | None = None,
+                                                   fallback_models: list[str] | None = None) -> AsyncIterator[dict]:
+    """
+    Streamt eine Generierung über client.aio.models.generate_content_stream
+    mit Wiederholungsversuchen.
+
+    Liefert Ereignisse als Dictionaries:
+      {"type": "chunk", "response": ...}: eine Teilantwort, sobald sie eintrifft.
+      {"type": "restart"}: Der Stream ist nach bereits gelieferten Teilantworten
+        abgebrochen und wird neu gestartet (ggf. mit einem Ausweichmodell);
+        bisher angezeigte Teile verwerfen.
+      {"type": "done", "response": ..., "metrics": ...}: immer das letzte
+        Ereignis. response ist die zusammengeführte Antwort (siehe
+        merge_stream_chunks) oder None, wenn alle Versuche fehlschlagen.
+        metrics enthält ttft (Sekunden bis zur ersten Teilantwort), total,
+        attempts, restarts und model (das tatsächlich verwendete Modell).
+
+    Da die API einen abgebrochenen Stream nicht fortsetzen kann, beginnt jeder
+    Versuch von vorn. Identische Streams werden nicht zusammengeführt.
+
+    Parameter:
+      Wie bei generate_content_with_retry_async (ohne coalesce_key).
+    """
+    on_warning = on_warning or logger.warning
+    on_error = on_error or logger.error
+    trace = trace or NULL_TRACE
+    policy = policy or RetryPolicy(max_retries, base_wait_time)
+    started = time.monotonic()
+    metrics = {"ttft": None, "total": None, "attempts": 0, "restarts": 0, "model": model_name}
+    models = [model_name, *(fallback_models or [])]
+    response = None
+    for index, model in enumerate(models):
+        result = {}
+        try:
+            async for event in _stream_with_model(client, model, contents, config, on_warning, scheduler,
+                                                  scheduler_key, priority, trace, policy, breakers,
+                                                  started, metrics, result):
+                yield event
+        except GenerationError as e:
+            if index == len(models) - 1 or not _can_fall_back(e, policy, started):
+                trace.annotate(error_class=e.error_class)
+                on_error(str(e))
+                break
+            _note_fallback(model, models[index + 1], e, trace, on_warning)
+            if result.get("partial"):
+                metrics["restarts"] += 1
+                yield {"type": "restart"}
+            continue
+        response = result["response"]
+        metrics["model"] = model
+        trace.annotate(ttft=round(metrics["ttft"] or 0.0, 4),
+                       **{f"tokens_{kind}": count for kind, count in result["usage"].items()})
+        break
+    metrics["total"] = time.monotonic() - started
+    trace.annotate(attempts=metrics["attempts"], restarts=metrics["restarts"])
+    yield {"type": "done", "response": response, "metrics": metrics}
+
+
+def generate_content_stream_with_retry(client: genai.Client, model_name: str, contents: list,
+                                       config: types.GenerateContentConfig,
+                                       max_retries: int, base_wait_time: int,
+                                       on_warning: Callable[[str], None] | None = None,
+                                       on_error: Callable[[str], None] | None = None,
+                                       scheduler: RateLimitScheduler | None = None,
+                                       scheduler_key: str = "",
+                                       priority: int = PRIORITY_INTERACTIVE,
+                                       trace: Trace | None = None,
+                                       policy: RetryPolicy | None = None,
+                                       breakers: CircuitBreakerRegistry | None = None,
+                                       fallback_models: list[str] | None = None) -> Iterator[dict]:
+    """
+    Synchroner Wrapper um generate_content_stream_with_retry_async: Der Stream
+    läuft in der gemeinsamen Hintergrund-Loop, Ereignisse und Meldungen werden
+    im aufrufenden Thread geliefert. Wird der Generator vorzeitig geschlossen
+    (z.B. durch einen Streamlit-Rerun), wird der Stream abgebrochen.
+
+    Parameter:
+      Wie bei generate_content_with_retry (ohne coalesce_key).
+
+    Rückgabe:
+      Iterator über die Ereignisse (siehe generate_content_stream_with_retry_async).
+    """
+    if _background_loop.is_current_thread():
+        raise RuntimeError("generate_content_stream_with_retry darf nicht in der Event-Loop aufgerufen werden; "
+                           "verwende generate_content_stream_with_retry_async.")
+    on_warning = on_warning or logger.warning
+    on_error = on_error or logger.error
+    # Meldungen (Callback, Text) und Ereignisse (None, Ereignis); None signalisiert das Ende
+    messages: queue.Queue[tuple[Callable[[str], None] | None, object] | None] = queue.Queue()
+
+    async def _pump() -> None:
+        async for event in generate_content_stream_with_retry_async(
+                client, model_name, contents, config, max_retries, base_wait_time,
+                on_warning=lambda msg: messages.put((on_warning, msg)),
+                on_error=lambda msg: messages.put((on_error, msg)),
+                scheduler=scheduler,
+                scheduler_key=scheduler_key,
+                priority=priority,
+                trace=trace,
+                policy=policy,
+                breakers=breakers,
+                fallback_models=fallback_models):
+            messages.put((None, event))
+
+    future = asyncio.run_coroutine_threadsafe(_pump(), _background_loop.get())
+    future.add_done_callback(lambda _: messages.put(None))
+    try:
+        while (item := messages.get()) is not None:
+            callback, payload = item
+            if callback is None:
+                yield payload
+            else:
+                callback(payload)
+        future.result()
+    finally:
+        future.cancel()
+
+
+def generate_fan_out(client: genai.Client, model_names: list[str], contents: list,
+                     config: types.GenerateContentConfig,
+                     max_retries: int, base_wait_time: int,
+                     on_warning: Callable[[str], None] | None = None,
+                     on_error: Callable[[str], None] | None = None,
+                     scheduler: RateLimitScheduler | None = None,
+                     scheduler_key: str = "",
+                     priority: int = PRIORITY_INTERACTIVE,
+                     trace: Trace | None = None,
+                     policy: RetryPolicy | None = None,
+                     breakers: CircuitBreakerRegistry | None = None) -> Iterator[dict]:
+    """
+    Sendet dieselben Inhalte gleichzeitig an mehrere Modelle und liefert die
+    Ergebnisse in der Reihenfolge, in der sie fertig werden. Die Gesamtdauer
+    entspricht damit ungefähr dem langsamsten einzelnen Aufruf.
+
+    Jeder Aufruf läuft über generate_content_with_retry_async (mit
+    Wiederholungen, Coalescing und Scheduler). Mehrere Kandidaten pro Modell
+    werden über config.candidate_count angefordert. Da jedes Ergebnis einem
+    bestimmten Modell zugeordnet ist, wird nicht auf andere Modelle ausgewichen;
+    ein offener Circuit Breaker lässt den Aufruf des Modells sofort scheitern.
+
+    Parameter:
+      model_names: Die Modelle, an die die Anfrage gesendet wird.
+      Übrige wie bei generate_content_with_retry; Meldungen erhalten den
+      Modellnamen als Präfix.
+
+    Rückgabe:
+      Iterator über Dictionaries mit model, response (None bei Fehlschlag)
+      und latency (Sekunden ab Start des Fan-outs).
+    """
+    if _background_loop.is_current_thread():
+        raise RuntimeError("generate_fan_out darf nicht in der Event-Loop aufgerufen werden.")
+    on_warning = on_warning or logger.warning
+    on_error = on_error or logger.error
+    trace = trace or NULL_TRACE
+    messages: queue.Queue[tuple[Callable[[str], None] | None, object] | None] = queue.Queue()
+    fan_out_span = trace.start_span("fan_out", models=len(model_names))
+
+    # Fingerabdrücke im aufrufenden Thread berechnen (siehe generate_content_with_retry)
+    coalesce_keys = {model_name: request_fingerprint(model_name, contents, config) for model_name in model_names}
+
+    async def _run_one(model_name: str, started: float) -> None:
+        # Spans explizit unter dem Fan-out einhängen, da die Aufrufe gleichzeitig offen sind
+        span = trace.start_span("model_call", parent=fan_out_span, model=model_name)
+        response = await generate_content_with_retry_async(
+            client, model_name, contents, config, max_retries, base_wait_time,
+            on_warning=lambda msg: messages.put((on_warning, f"{model_name}: {msg}")),
+            on_error=lambda msg: messages.put((on_error, f"{model_name}: {msg}")),
+            coalesce_key=coalesce_keys[model_name],
+            scheduler=scheduler,
+            scheduler_key=scheduler_key,
+            priority=priority,
+            policy=policy,
+            breakers=breakers
+        )
+        trace.end_span(span, status="ok" if response is not None else "error")
+        messages.put((None, {"model": model_name, "response": response, "latency": time.perf_counter() - started}))
+
+    async def _run_all() -> None:
+        started = time.perf_counter()
+        await asyncio.gather(*(_run_one(model_name, started) for model_name in model_names))
+
+    future = asyncio.run_coroutine_threadsafe(_run_all(), _background_loop.get())
+    future.add_done_callback(lambda _: messages.put(None))
+    try:
+        while (item := messages.get()) is not None:
+            callback, payload = item
+            if callback is None:
+                yield payload
+            else:
+                callback(payload)
+        future.result()
+    finally:
+        future.cancel()
+        trace.end_span(fan_out_span)
@@ -0,0 +1,331 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from io import BytesIO
+from typing import Iterator
+
+from image_output import extension_for
+
+# Standardwerte für den Verlauf (Abschnitt "history" in api_config.json)
+DEFAULT_HISTORY_CONFIG = {
+    "enabled": True,
+    "db_path": os.path.join("data", "history.sqlite3"),
+    "blob_dir": os.path.join("data", "blobs"),
+    "thumbnail_size": 256,
+    "page_size": 24
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS generations (
+    id INTEGER PRIMARY KEY,
+    owner TEXT,
+    created_at REAL NOT NULL,
+    model TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    params TEXT NOT NULL,
+    input_hashes TEXT NOT NULL,
+    output_text TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL,
+    duration_ms REAL,
+    ttft_ms REAL,
+    total_tokens INTEGER
+);
+CREATE TABLE IF NOT EXISTS outputs (
+    generation_id INTEGER NOT NULL REFERENCES generations(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    mime_type TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    thumbnail BLOB,
+    PRIMARY KEY (generation_id, position)
+);
+CREATE INDEX IF NOT EXISTS outputs_sha256 ON outputs(sha256);
+"""
+
+# Erst nach der Migration anlegen: ältere Datenbanken haben die Spalte owner noch nicht
+_OWNER_INDEX = "CREATE INDEX IF NOT EXISTS generations_owner ON generations(owner, id)"
+
+# Volltextindex über die Prompts, synchron gehalten per Trigger
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS generations_fts USING fts5(
+    prompt, content='generations', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS generations_ai AFTER INSERT ON generations BEGIN
+    INSERT INTO generations_fts(rowid, prompt) VALUES (new.id, new.prompt);
+END;
+CREATE TRIGGER IF NOT EXISTS generations_ad AFTER DELETE ON generations BEGIN
+    INSERT INTO generations_fts(generations_fts, rowid, prompt) VALUES ('delete', old.id, old.prompt);
+END;
+"""
+
+# Spalten für die Seitenansicht: ohne Volltext der Ausgabe, mit dem ersten Vorschaubild
+_PAGE_COLUMNS = """
+    g.id, g.created_at, g.model, g.prompt, g.status, g.duration_ms, g.ttft_ms, g.total_tokens,
+    (SELECT COUNT(*) FROM outputs o WHERE o.generation_id = g.id) AS image_count,
+    (SELECT o.thumbnail FROM outputs o WHERE o.generation_id = g.id ORDER BY o.position LIMIT 1) AS thumbnail
+"""
+
+
+def make_thumbnail(image_bytes: bytes, size: int) -> tuple[bytes | None, tuple[int, int] | None]:
+    """
+    Erstellt ein kleines JPEG-Vorschaubild (längste Kante size Pixel).
+
+    Rückgabe:
+      (Vorschaubild, Originalgröße) oder (None, None), wenn die Daten kein Bild sind.
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        with Image.open(BytesIO(image_bytes)) as image:
+            dimensions = image.size
+            if image.format == "JPEG":
+                image.draft("RGB", (size, size))
+            image.thumbnail((size, size))
+            if image.mode in ("RGBA", "LA", "P"):
+                rgba = image.convert("RGBA")
+                image = Image.new("RGB", rgba.size, (255, 255, 255))
+                image.paste(rgba, mask=rgba.getchannel("A"))
+            elif image.mode != "RGB":
+                image = image.convert("RGB")
+            buffer = BytesIO()
+            image.save(buffer, format="JPEG", quality=75, optimize=True)
+            return buffer.getvalue(), dimensions
+    except (UnidentifiedImageError, OSError):
+        return None, None
+
+
+def fts_query(text: str) -> str | None:
+    """
+    Wandelt eine Sucheingabe in eine FTS5-Abfrage um: Jedes Wort wird als
+    Präfix gesucht, alle Wörter müssen vorkommen. Sonderzeichen werden ignoriert.
+    """
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+class HistoryStore:
+    """
+    Persistenter Verlauf aller Generierungen: Metadaten in SQLite, Bilder
+    inhaltsadressiert (SHA-256) im Blob-Verzeichnis, Vorschaubilder als kleine
+    JPEGs direkt in der Datenbank. Seiten werden per Keyset-Paginierung
+    (id < cursor) gelesen und enthalten nur die Vorschaubilder, sodass auch
+    bei tausenden Einträgen keine großen Bilder geladen werden.
+
+    Jeder Eintrag gehört einem Besitzer (in der App der Bezeichner des
+    API-Keys, siehe rate_limiter.api_key_id). Alle Lesezugriffe sind auf einen
+    Besitzer beschränkt, damit Sitzungen mit anderen Keys weder Prompts noch
+    Bilder fremder Generierungen sehen. Einträge aus Datenbanken ohne
+    Besitzer-Spalte bleiben erhalten, sind aber niemandem zugeordnet.
+
+    Jeder Thread erhält eine eigene Verbindung; die Datenbank läuft im
+    WAL-Modus, damit Lesezugriffe nicht auf Schreibvorgänge warten.
+
+    Parameter:
+      db_path: Pfad zur SQLite-Datenbank.
+      blob_dir: Verzeichnis für die Ausgabedateien.
+      thumbnail_size: Längste Kante der Vorschaubilder in Pixeln.
+    """
+
+    def __init__(self, db_path: str, blob_dir: str, thumbnail_size: int = DEFAULT_HISTORY_CONFIG["thumbnail_size"]):
+        self.db_path = db_path
+        self.blob_dir = blob_dir
+        self.thumbnail_size = thumbnail_size
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        os.makedirs(blob_dir, exist_ok=True)
+        connection = self._connection()
+        with self._write_lock, connection:
+            connection.executescript(_SCHEMA)
+            columns = {row["name"] for row in connection.execute("PRAGMA table_info(generations)")}
+            if "owner" not in columns:
+                connection.execute("ALTER TABLE generations ADD COLUMN owner TEXT")
+            connection.execute(_OWNER_INDEX)
+            try:
+                connection.executescript(_FTS_SCHEMA)
+                self.full_text_search = True
+            except sqlite3.OperationalError:
+                # SQLite ohne FTS5: Suche fällt auf LIKE zurück
+                self.full_text_search = False
+
+    @classmethod
+    def from_config(cls, config: dict) -> "HistoryStore":
+        """
+        Erstellt den Verlauf aus dem Abschnitt "history" der API-Konfiguration.
+        """
+        config = {**DEFAULT_HISTORY_CONFIG, **config}
+        return cls(config["db_path"], config["blob_dir"], config["thumbnail_size"])
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            self._local.connection = connection
+        return connection
+
+    def blob_path(self, sha256: str, mime_type: str) -> str:
+        return os.path.join(self.blob_dir, sha256[:2], sha256 + extension_for(mime_type))
+
+    def _write_blob(self, data: bytes, mime_type: str) -> str:
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(sha256, mime_type)
+        if not os.path.exists(path):
+            # Erst in eine temporäre Datei schreiben, damit nie eine halbe Datei sichtbar wird
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        return sha256
+
+    def record(self, owner: str, model: str, prompt: str, params: dict, input_hashes: list[str],
+               output_text: str, images: list[tuple[bytes, str]], status: str,
+               duration_ms: float | None = None, ttft_ms: float | None = None,
+               total_tokens: int | None = None) -> int:
+        """
+        Speichert eine Generierung.
+
+        Parameter:
+          owner: Besitzer des Eintrags (z.B. der Bezeichner des API-Keys).
+          model, prompt, params: Modell, Prompt und Sampling-Parameter.
+          input_hashes: SHA-256 der Eingabebilder.
+          output_text: Zusammengefügter Text der Antwort.
+          images: Ausgabebilder als Liste von (Bytes, MIME-Typ).
+          status: Ergebnis, z.B. "ok" oder "error".
+          duration_ms, ttft_ms, total_tokens: Gesamtdauer, Zeit bis zur ersten
+            Teilantwort und verbrauchte Tokens (sofern bekannt).
+
+        Rückgabe:
+          Die id des neuen Eintrags.
+        """
+        outputs = []
+        for position, (data, mime_type) in enumerate(images):
+            thumbnail, dimensions = make_thumbnail(data, self.thumbnail_size)
+            sha256 = self._write_blob(data, mime_type)
+            width, height = dimensions or (None, None)
+            outputs.append((position, sha256, mime_type, len(data), width, height, thumbnail))
+
+        connection = self._connection()
+        with self._write_lock, connection:
+            cursor = connection.execute(
+                "INSERT INTO generations (owner, created_at, model, prompt, params, input_hashes, output_text, "
+                "status, duration_ms, ttft_ms, total_tokens) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (owner, time.time(), model, prompt, json.dumps(params, sort_keys=True), json.dumps(input_hashes),
+                 output_text, status, duration_ms, ttft_ms, total_tokens))
+            generation_id = cursor.lastrowid
+            connection.executemany(
+                "INSERT INTO outputs (generation_id, position, sha256, mime_type, bytes, width, height, thumbnail) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(generation_id, *output) for output in outputs])
+        return generation_id
+
+    def _search_clause(self, owner: str, query: str | None) -> tuple[str, str, list]:
+        """
+        Liefert (JOIN, WHERE-Bedingung, Parameter) für die Einträge eines
+        Besitzers und eine optionale Suche.
+        """
+        if not query or not query.strip():
+            return "", "g.owner = ?", [owner]
+        if self.full_text_search:
+            match = fts_query(query)
+            if match is None:
+                return "", "g.owner = ?", [owner]
+            return ("JOIN generations_fts f ON f.rowid = g.id", "g.owner = ? AND generations_fts MATCH ?",
+                    [owner, match])
+        return "", "g.owner = ? AND g.prompt LIKE ?", [owner, f"%{query.strip()}%"]
+
+    def page(self, owner: str, query: str | None = None, before_id: int | None = None,
+             limit: int = 24) -> list[dict]:
+        """
+        Liest eine Seite des Verlaufs, neueste Einträge zuerst.
+
+        Parameter:
+          owner: Besitzer, dessen Einträge gelesen werden.
+          query: Optionale Suche in den Prompts.
+          before_id: Nur Einträge mit kleinerer id (Cursor der vorherigen Seite).
+          limit: Anzahl der Einträge.
+
+        Rückgabe:
+          Liste von Dictionaries mit id, created_at, model, prompt, status,
+          duration_ms, ttft_ms, total_tokens, image_count und thumbnail.
+        """
+        join, condition, parameters = self._search_clause(owner, query)
+        if before_id is not None:
+            condition += " AND g.id < ?"
+            parameters.append(before_id)
+        rows = self._connection().execute(
+            f"SELECT {_PAGE_COLUMNS} FROM generations g {join} WHERE {condition} ORDER BY g.id DESC LIMIT ?",
+            parameters + [limit]).fetchall()
+        return [dict(row) for row in rows]
+
+    def count(self, owner: str, query: str | None = None) -> int:
+        join, condition, parameters = self._search_clause(owner, query)
+        return self._connection().execute(
+            f"SELECT COUNT(*) FROM generations g {join} WHERE {condition}", parameters).fetchone()[0]
+
+    def get(self, owner: str, generation_id: int) -> dict | None:
+        """
+        Liest einen Eintrag vollständig, inkl. Parameter und Ausgaben (ohne Bilddaten).
+        Einträge anderer Besitzer werden wie fehlende Einträge behandelt.
+        """
+        connection = self._connection()
+        row = connection.execute("SELECT * FROM generations WHERE id = ? AND owner = ?",
+                                 (generation_id, owner)).fetchone()
+        if row is None:
+            return None
+        entry = dict(row)
+        entry["params"] = json.loads(entry["params"])
+        entry["input_hashes"] = json.loads(entry["input_hashes"])
+        entry["outputs"] = [dict(output) for output in connection.execute(
+            "SELECT position, sha256, mime_type, bytes, width, height FROM outputs "
+            "WHERE generation_id = ? ORDER BY position", (generation_id,))]
+        return entry
+
+    def iter_outputs(self, owner: str, query: str | None = None) -> Iterator[dict]:
+        """
+        Alle Ausgabebilder der Einträge, die zur Suche passen (neueste zuerst),
+        ohne Bilddaten. Die Zeilen werden fortlaufend gelesen.
+
+        Rückgabe:
+          Dictionaries mit generation_id, position, sha256 und mime_type.
+        """
+        join, condition, parameters = self._search_clause(owner, query)
+        rows = self._connection().execute(
+            f"SELECT o.generation_id, o.position, o.sha256, o.mime_type FROM generations g {join} "
+            f"JOIN outputs o ON o.generation_id = g.id WHERE {condition} ORDER BY g.id DESC, o.position",
+            parameters)
+        for row in rows:
+            yield dict(row)
+
+    def load_blob(self, sha256: str, mime_type: str) -> bytes | None:
+        """
+        Lädt eine Ausgabedatei in voller Größe, oder None, wenn sie fehlt.
+        """
+        try:
+            with open(self.blob_path(sha256, mime_type), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def recent_prompts(self, owner: str, limit: int = 5) -> list[str]:
+        """
+        Die zuletzt verwendeten, unterschiedlichen Prompts eines Besitzers (neueste zuerst).
+        """
+        # Nur die jüngsten Einträge lesen statt über den ganzen Verlauf zu gruppieren
+        rows = self._connection().execute(
+            "SELECT prompt FROM generations WHERE owner = ? ORDER BY id DESC LIMIT ?", (owner, limit * 20))
+        prompts = list(dict.fromkeys(row[0] for row in rows))
+        return prompts[:limit]
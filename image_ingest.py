@@ -0,0 +1,71 @@
+import hashlib
+from io import BytesIO
+
+# Standardbudget für eingehende Bilder: wird vor jeder Dekodierung geprüft
+DEFAULT_INGEST_BUDGET = {
+    "max_bytes": 20 * 1024 * 1024,
+    "max_pixels": 40_000_000
+}
+
+
+class ImageBudgetError(ValueError):
+    """
+    Wird ausgelöst, wenn ein Bild das konfigurierte Byte- oder Pixelbudget überschreitet.
+    """
+
+
+def inspect_header(data: bytes) -> dict:
+    """
+    Liest Format, Größe und Farbmodus aus dem Bild-Header, ohne die Pixeldaten
+    zu dekodieren. PIL.Image.open liest nur den Header; load() wird nicht aufgerufen.
+
+    Ausnahmen:
+      PIL.UnidentifiedImageError, wenn das Format nicht erkannt wird.
+    """
+    from PIL import Image
+
+    with Image.open(BytesIO(data)) as image:
+        return {
+            "format": image.format,
+            "size": image.size,
+            "mode": image.mode,
+            "mime_type": Image.MIME.get(image.format, "application/octet-stream")
+        }
+
+
+def ingest_bytes(data: bytes, name: str, budget: dict | None = None) -> dict:
+    """
+    Nimmt ein Bild entgegen: prüft das Byte-Budget, liest den Header, prüft
+    das Pixel-Budget und berechnet den Inhalts-Hash. Die Pixeldaten werden
+    dabei nicht dekodiert.
+
+    Parameter:
+      data: Die Rohdaten des Bildes.
+      name: Der Dateiname (für Meldungen).
+      budget: Optionales Budget mit "max_bytes" und "max_pixels".
+
+    Rückgabe:
+      Dictionary mit name, data, sha256, bytes, format, size, mode und mime_type.
+
+    Ausnahmen:
+      ImageBudgetError bei Überschreitung des Budgets,
+      PIL.UnidentifiedImageError bei unbekanntem Format.
+    """
+    budget = {**DEFAULT_INGEST_BUDGET, **(budget or {})}
+    if len(data) > budget["max_bytes"]:
+        raise ImageBudgetError(
+            f"{name} ist mit {len(data) / 1024 / 1024:.1f} MB größer als erlaubt "
+            f"({budget['max_bytes'] / 1024 / 1024:.1f} MB).")
+    header = inspect_header(data)
+    width, height = header["size"]
+    if width * height > budget["max_pixels"]:
+        raise ImageBudgetError(
+            f"{name} hat {width}x{height} Pixel und überschreitet das Budget von "
+            f"{budget['max_pixels'] / 1_000_000:.1f} Megapixeln.")
+    return {
+        "name": name,
+        "data": data,
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "bytes": len(data),
+        **header
+    }
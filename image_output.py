@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import io
+import os
+import zipfile
+from typing import TYPE_CHECKING, BinaryIO, Iterable
+
+if TYPE_CHECKING:
+    from google.genai import types
+
+# Dateiendungen der Ausgabebilder nach MIME-Typ
+IMAGE_EXTENSIONS = {"image/png": ".png", "image/jpeg": ".jpg", "image/webp": ".webp", "image/gif": ".gif"}
+
+# Signaturen am Dateianfang, an denen das Format ohne Dekodierung erkannt wird
+_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+def sniff_mime_type(data: bytes) -> str | None:
+    """
+    Erkennt den MIME-Typ eines Bildes an den ersten Bytes, ohne es zu dekodieren.
+
+    Rückgabe:
+      Der MIME-Typ oder None, wenn das Format nicht erkannt wird.
+    """
+    for signature, mime_type in _SIGNATURES:
+        if data[:len(signature)] == signature:
+            return mime_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def extension_for(mime_type: str) -> str:
+    return IMAGE_EXTENSIONS.get(mime_type, ".bin")
+
+
+def inline_image(blob: types.Blob) -> dict:
+    """
+    Übernimmt ein Bild aus inline_data, ohne die Bytes zu kopieren oder zu
+    dekodieren. Der MIME-Typ wird an den Daten erkannt, sonst aus der Antwort
+    übernommen.
+
+    Rückgabe:
+      Dictionary mit data und mime_type; mime_type ist None, wenn die Daten
+      nicht als Bild erkannt werden.
+    """
+    declared = blob.mime_type or ""
+    mime_type = sniff_mime_type(blob.data or b"") or (declared if declared.startswith("image/") else None)
+    return {"data": blob.data, "mime_type": mime_type}
+
+
+def output_images(response: types.GenerateContentResponse | None) -> list[dict]:
+    """
+    Sammelt die Bilder (inline_data) aller Kandidaten einer Antwort (siehe inline_image).
+
+    Rückgabe:
+      Liste von Dictionaries mit data, mime_type, candidate und position.
+    """
+    images = []
+    for candidate_index, candidate in enumerate((response.candidates or []) if response is not None else []):
+        for part in (candidate.content.parts or []) if candidate.content else []:
+            if part.inline_data and part.inline_data.data:
+                images.append({**inline_image(part.inline_data), "candidate": candidate_index, "position": len(images)})
+    return images
+
+
+def write_zip(target: BinaryIO, entries: Iterable[tuple[str, bytes | str]]) -> int:
+    """
+    Schreibt ein ZIP-Archiv Eintrag für Eintrag in target. Dateien werden in
+    Blöcken kopiert und nie vollständig geladen. Bilder sind bereits
+    komprimiert, daher werden sie nur gespeichert (ZIP_STORED).
+
+    Parameter:
+      target: Beschreibbares Dateiobjekt.
+      entries: Paare aus Name im Archiv und Inhalt (Bytes) oder Dateipfad.
+
+    Rückgabe:
+      Anzahl der geschriebenen Einträge. Fehlende Dateien werden übersprungen.
+    """
+    written = 0
+    with zipfile.ZipFile(target, "w", compression=zipfile.ZIP_STORED) as archive:
+        for name, source in entries:
+            if isinstance(source, str):
+                if not os.path.exists(source):
+                    continue
+                archive.write(source, name)
+            else:
+                archive.writestr(name, source)
+            written += 1
+    return written
+
+
+def zip_bytes(entries: Iterable[tuple[str, bytes | str]]) -> bytes:
+    """
+    Erstellt ein ZIP-Archiv im Speicher, z.B. für st.download_button.
+
+    Rückgabe:
+      Der Inhalt des Archivs.
+    """
+    target = io.BytesIO()
+    write_zip(target, entries)
+    return target.getvalue()
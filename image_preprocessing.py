@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from google.genai import types
+    from PIL import Image
+
+# Standardwerte für die Bildvorverarbeitung
+DEFAULT_PREPROCESSING = {
+    "enabled": True,
+    "max_edge": 1536,
+    "format": "JPEG",
+    "quality": 85,
+    "strip_metadata": True
+}
+DEFAULT_CACHE_ENTRIES = 64
+
+SUPPORTED_FORMATS = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+
+def _normalize_mode(image: Image.Image, output_format: str) -> Image.Image:
+    """
+    Bringt das Bild in einen Farbmodus, den das Zielformat unterstützt.
+    Transparenz wird für JPEG auf weißen Hintergrund gelegt.
+    """
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    if has_alpha and output_format != "JPEG":
+        return image if image.mode == "RGBA" else image.convert("RGBA")
+    if has_alpha:
+        from PIL import Image
+
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return image if image.mode == "RGB" else image.convert("RGB")
+
+
+def preprocess_image_bytes(image_bytes: bytes, settings: dict) -> dict:
+    """
+    Verkleinert, normalisiert und kodiert ein Bild neu, bevor es an die API geht.
+
+    Parameter:
+      image_bytes: Die Rohdaten des hochgeladenen Bildes.
+      settings: Einstellungen (enabled, max_edge, format, quality, strip_metadata),
+        siehe DEFAULT_PREPROCESSING.
+
+    Rückgabe:
+      Dictionary mit den Schlüsseln data, mime_type, original_bytes,
+      processed_bytes, original_dimensions und dimensions.
+
+    Ausnahmen:
+      PIL.UnidentifiedImageError und Image.DecompressionBombError werden weitergereicht.
+    """
+    from PIL import Image, ImageOps
+
+    settings = {**DEFAULT_PREPROCESSING, **settings}
+    image = Image.open(BytesIO(image_bytes))
+    original_dimensions = image.size
+    original_mime = Image.MIME.get(image.format, "image/png")
+
+    if not settings["enabled"]:
+        return {
+            "data": image_bytes, "mime_type": original_mime,
+            "original_bytes": len(image_bytes), "processed_bytes": len(image_bytes),
+            "original_dimensions": original_dimensions, "dimensions": original_dimensions
+        }
+
+    output_format = str(settings["format"]).upper()
+    if output_format not in SUPPORTED_FORMATS:
+        raise ValueError(f"Nicht unterstütztes Zielformat: {settings['format']}")
+
+    max_edge = settings["max_edge"]
+    resized = bool(max_edge) and max(image.size) > max_edge
+    if resized and image.format == "JPEG":
+        # draft() lässt den JPEG-Decoder direkt in reduzierter Auflösung dekodieren
+        image.draft(image.mode, (max_edge, max_edge))
+    # Ausrichtung aus den EXIF-Daten anwenden, bevor die Metadaten entfernt werden
+    image = ImageOps.exif_transpose(image)
+    if resized:
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    image = _normalize_mode(image, output_format)
+
+    save_kwargs = {"format": output_format}
+    if output_format in ("JPEG", "WEBP"):
+        save_kwargs["quality"] = settings["quality"]
+    if output_format == "JPEG":
+        save_kwargs["optimize"] = True
+    if not settings["strip_metadata"]:
+        exif = image.info.get("exif")
+        if exif:
+            save_kwargs["exif"] = exif
+    buffer = BytesIO()
+    image.save(buffer, **save_kwargs)
+    data = buffer.getvalue()
+
+    # Ohne Verkleinerung und ohne Metadatenbereinigung lohnt sich eine größere Neukodierung nicht
+    if not resized and not settings["strip_metadata"] and len(data) >= len(image_bytes):
+        return {
+            "data": image_bytes, "mime_type": original_mime,
+            "original_bytes": len(image_bytes), "processed_bytes": len(image_bytes),
+            "original_dimensions": original_dimensions, "dimensions": original_dimensions
+        }
+    return {
+        "data": data, "mime_type": SUPPORTED_FORMATS[output_format],
+        "original_bytes": len(image_bytes), "processed_bytes": len(data),
+        "original_dimensions": original_dimensions, "dimensions": image.size
+    }
+
+
+class PreprocessingCache:
+    """
+    Threadsicherer LRU-Cache für vorverarbeitete Bilder, adressiert über den
+    SHA-256-Hash der Rohdaten und die Einstellungen.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple[str, tuple], dict] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def preprocess(self, image_bytes: bytes, settings: dict, digest: str | None = None) -> dict:
+        """
+        Wie preprocess_image_bytes, aber mit Cache. Das Ergebnis enthält
+        zusätzlich "cached" (True bei einem Treffer) und "sha256" der Rohdaten.
+        Ein bereits bekannter Hash (z.B. aus image_ingest) kann übergeben werden.
+        """
+        digest = digest or hashlib.sha256(image_bytes).hexdigest()
+        key = (digest, tuple(sorted({**DEFAULT_PREPROCESSING, **settings}.items())))
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                return {**result, "cached": True}
+        result = {**preprocess_image_bytes(image_bytes, settings), "sha256": digest}
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return {**result, "cached": False}
+
+
+def to_part(preprocessed: dict) -> types.Part:
+    """
+    Erzeugt aus einem vorverarbeiteten Bild einen API-Inhalt. Die kodierten
+    Bytes werden unverändert übertragen, ohne erneute Kodierung durch das SDK.
+    """
+    from google.genai import types
+
+    return types.Part.from_bytes(data=preprocessed["data"], mime_type=preprocessed["mime_type"])
@@ -0,0 +1,374 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Standardwerte für den Export der Metriken (Abschnitt "metrics" in api_config.json)
+DEFAULT_METRICS_CONFIG = {
+    "prometheus_enabled": False,
+    "prometheus_host": "127.0.0.1",
+    "prometheus_port": 9464,
+    "otel_log_enabled": False,
+    "otel_log_path": os.path.join(".cache", "traces.jsonl")
+}
+
+# Grenzen der Histogramm-Buckets in Sekunden
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Bekannte Metriken: Name -> (Typ, Beschreibung)
+METRIC_DEFINITIONS = {
+    "genai_stage_duration_seconds": ("histogram", "Dauer der Verarbeitungsschritte einer Anfrage in Sekunden."),
+    "genai_time_to_first_token_seconds": ("histogram", "Zeit bis zur ersten Teilantwort eines Streams in Sekunden."),
+    "genai_requests_total": ("counter", "Generierungsanfragen an die API nach Modell und Ergebnis."),
+    "genai_attempts_total": ("counter", "Einzelne API-Aufrufe einschließlich Wiederholungen."),
+    "genai_retries_total": ("counter", "Wiederholungsversuche nach einem fehlgeschlagenen API-Aufruf."),
+    "genai_errors_total": ("counter", "Fehlgeschlagene API-Aufrufe nach Modell und Fehlerklasse (retry_policy.py)."),
+    "genai_circuit_breaker_total": ("counter", "Ereignisse der Circuit Breaker nach Modell (opened, closed, rejected, fallback)."),
+    "genai_tokens_total": ("counter", "Verbrauchte Tokens laut usage_metadata nach Modell und Art."),
+    "genai_context_cache_total": ("counter", "Verwendungen des Context Cachings nach Ergebnis (context_cache.py)."),
+    "genai_rate_limit_queue_depth": ("gauge", "Wartende Anfragen im RateLimitScheduler nach API-Key und Modell."),
+    "genai_rate_limit_wait_seconds": ("histogram", "Wartezeit im RateLimitScheduler bis zum Senden in Sekunden."),
+    "server_requests_total": ("counter", "Anfragen an den HTTP-Server (server.py) nach Statuscode."),
+    "server_request_duration_seconds": ("histogram", "Dauer der Anfragen an den HTTP-Server in Sekunden."),
+}
+
+# Felder aus usage_metadata und ihre Bezeichnung in den Metriken
+USAGE_FIELDS = {
+    "prompt_token_count": "prompt",
+    "candidates_token_count": "candidates",
+    "cached_content_token_count": "cached",
+    "thoughts_token_count": "thoughts",
+    "total_token_count": "total"
+}
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...], extra: tuple[str, str] | None = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + "}"
+
+
+class MetricsRegistry:
+    """
+    Prozessweite Sammlung von Zählern, Messwerten (Gauges) und Histogrammen mit Labels.
+    Threadsicher; der Export erfolgt im Textformat von Prometheus.
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._series: dict[str, dict[tuple, object]] = {name: {} for name in METRIC_DEFINITIONS}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, labels: dict | None = None, value: float = 1) -> None:
+        """
+        Erhöht einen Zähler.
+        """
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            series = self._series[name]
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, labels: dict | None = None) -> None:
+        """
+        Setzt den aktuellen Wert eines Gauges.
+        """
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            self._series[name][key] = value
+
+    def observe(self, name: str, value: float, labels: dict | None = None) -> None:
+        """
+        Trägt einen Messwert in ein Histogramm ein.
+        """
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            series = self._series[name]
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram["counts"][index] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def snapshot(self) -> dict:
+        """
+        Gibt Zählerstände sowie Anzahl und Mittelwert der Histogramme zurück (für den Debug-Modus).
+        """
+        result = {}
+        with self._lock:
+            for name, series in self._series.items():
+                for key, value in series.items():
+                    label = name + _format_labels(key)
+                    if isinstance(value, dict):
+                        result[label] = {"count": value["count"],
+                                         "mean": value["sum"] / value["count"] if value["count"] else 0.0}
+                    else:
+                        result[label] = value
+        return result
+
+    def to_prometheus(self) -> str:
+        """
+        Exportiert alle Metriken im Textformat von Prometheus (Version 0.0.4).
+        """
+        lines = []
+        with self._lock:
+            for name, series in self._series.items():
+                metric_type, description = METRIC_DEFINITIONS[name]
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for key, value in sorted(series.items()):
+                    if metric_type == "histogram":
+                        for bound, count in zip(self.buckets, value["counts"]):
+                            lines.append(f"{name}_bucket{_format_labels(key, ('le', repr(bound)))} {count}")
+                        lines.append(f"{name}_bucket{_format_labels(key, ('le', '+Inf'))} {value['count']}")
+                        lines.append(f"{name}_sum{_format_labels(key)} {value['sum']}")
+                        lines.append(f"{name}_count{_format_labels(key)} {value['count']}")
+                    else:
+                        lines.append(f"{name}{_format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# Gemeinsame Instanz für App, Generierung und Batch-Modus
+METRICS = MetricsRegistry()
+
+
+def record_usage(model_name: str, usage_metadata, registry: MetricsRegistry = METRICS) -> dict:
+    """
+    Zählt die Tokens aus usage_metadata einer Antwort.
+
+    Rückgabe:
+      Dictionary Art -> Anzahl (z.B. {"prompt": 12, "total": 1300}) für Span-Attribute.
+    """
+    usage = {}
+    if usage_metadata is None:
+        return usage
+    for field, kind in USAGE_FIELDS.items():
+        count = getattr(usage_metadata, field, None)
+        if count:
+            usage[kind] = count
+            registry.inc("genai_tokens_total", {"model": model_name, "type": kind}, count)
+    return usage
+
+
+class Trace:
+    """
+    Zeitlicher Ablauf einer Anfrage als Baum von Spans.
+
+    Jeder Span hat Name, Start, Ende und Attribute. Ohne explizite Angabe wird
+    ein neuer Span unter dem zuletzt geöffneten, noch nicht beendeten Span
+    eingehängt. Beim Beenden eines Spans wird seine Dauer im Histogramm
+    genai_stage_duration_seconds erfasst. Spans dürfen aus verschiedenen
+    Threads (z.B. der Event-Loop der Generierung) ergänzt werden.
+
+    Parameter:
+      name: Name des Wurzel-Spans (z.B. "generate").
+      attributes: Attribute des Wurzel-Spans; "model" wird als Label verwendet.
+      registry: Ziel der Metriken (Standard: METRICS).
+      exporter: Optionaler Exporter (siehe OTelJsonExporter), der beim Abschluss aufgerufen wird.
+    """
+
+    def __init__(self, name: str, attributes: dict | None = None, registry: MetricsRegistry = METRICS,
+                 exporter: "OTelJsonExporter | None" = None):
+        self.trace_id = os.urandom(16).hex()
+        self.registry = registry
+        self.exporter = exporter
+        self.spans: list[dict] = []
+        self._lock = threading.Lock()
+        self.root = self._new_span(name, None, dict(attributes or {}))
+
+    def _new_span(self, name: str, parent: dict | None, attributes: dict) -> dict:
+        span = {
+            "name": name,
+            "span_id": os.urandom(8).hex(),
+            "parent_id": parent["span_id"] if parent else None,
+            "start": time.time_ns(),
+            "end": None,
+            "attributes": attributes
+        }
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def start_span(self, name: str, parent: dict | None = None, **attributes) -> dict:
+        """
+        Beginnt einen Span und gibt ihn zurück (beenden mit end_span).
+        """
+        if parent is None:
+            with self._lock:
+                parent = next((span for span in reversed(self.spans) if span["end"] is None), self.root)
+        return self._new_span(name, parent, attributes)
+
+    def end_span(self, span: dict, **attributes) -> None:
+        """
+        Beendet einen Span, ergänzt Attribute und erfasst die Dauer.
+        """
+        span["attributes"].update(attributes)
+        span["end"] = time.time_ns()
+        self.registry.observe("genai_stage_duration_seconds", (span["end"] - span["start"]) / 1e9,
+                              {"stage": span["name"], "model": self.root["attributes"].get("model", "")})
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """
+        Kontextmanager für einen Span. Bei einer Ausnahme erhält er status="error".
+        """
+        span = self.start_span(name, **attributes)
+        try:
+            yield span
+        except BaseException as e:
+            self.end_span(span, status="error", error=type(e).__name__)
+            raise
+        self.end_span(span, status=span["attributes"].get("status", "ok"))
+
+    def annotate(self, **attributes) -> None:
+        """
+        Ergänzt Attribute des Wurzel-Spans (z.B. cache_hit oder Token-Zahlen).
+        """
+        self.root["attributes"].update(attributes)
+
+    def finish(self, **attributes) -> None:
+        """
+        Beendet den Wurzel-Span sowie alle noch offenen Spans und exportiert den Trace.
+        """
+        for span in list(reversed(self.spans)):
+            if span["end"] is None and span is not self.root:
+                self.end_span(span, status="unfinished")
+        self.end_span(self.root, **attributes)
+        if self.exporter is not None:
+            self.exporter.export(self)
+
+    def duration_ms(self) -> float:
+        """
+        Dauer des Wurzel-Spans in Millisekunden (bis jetzt, falls noch offen).
+        """
+        return ((self.root["end"] or time.time_ns()) - self.root["start"]) / 1e6
+
+    def breakdown(self) -> list[dict]:
+        """
+        Gibt die Spans als Tabelle zurück: Schritt (eingerückt nach Tiefe),
+        Start relativ zum Beginn, Dauer und Attribute.
+        """
+        depth = {self.root["span_id"]: 0}
+        rows = []
+        for span in sorted(self.spans, key=lambda item: item["start"]):
+            level = depth.get(span["parent_id"], -1) + 1 if span["parent_id"] else 0
+            depth[span["span_id"]] = level
+            end = span["end"] or time.time_ns()
+            rows.append({
+                "Schritt": "  " * level + span["name"],
+                "Start (ms)": round((span["start"] - self.root["start"]) / 1e6, 1),
+                "Dauer (ms)": round((end - span["start"]) / 1e6, 1),
+                "Attribute": ", ".join(f"{key}={value}" for key, value in span["attributes"].items())
+            })
+        return rows
+
+    def to_otel(self, service_name: str = "genai-streamlit-app") -> dict:
+        """
+        Wandelt den Trace in das JSON-Format des OpenTelemetry-Protokolls (OTLP/JSON) um.
+        """
+        def attribute(key, value) -> dict:
+            if isinstance(value, bool):
+                return {"key": key, "value": {"boolValue": value}}
+            if isinstance(value, int):
+                return {"key": key, "value": {"intValue": str(value)}}
+            if isinstance(value, float):
+                return {"key": key, "value": {"doubleValue": value}}
+            return {"key": key, "value": {"stringValue": str(value)}}
+
+        spans = []
+        for span in self.spans:
+            otel_span = {
+                "traceId": self.trace_id,
+                "spanId": span["span_id"],
+                "name": span["name"],
+                "kind": 1,
+                "startTimeUnixNano": str(span["start"]),
+                "endTimeUnixNano": str(span["end"] or span["start"]),
+                "attributes": [attribute(key, value) for key, value in span["attributes"].items()],
+                "status": {"code": 2 if span["attributes"].get("status") == "error" else 1}
+            }
+            if span["parent_id"]:
+                otel_span["parentSpanId"] = span["parent_id"]
+            spans.append(otel_span)
+        return {"resourceSpans": [{
+            "resource": {"attributes": [attribute("service.name", service_name)]},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}]
+        }]}
+
+
+class _NullTrace:
+    """
+    Platzhalter ohne Wirkung für Aufrufe ohne Trace.
+    """
+
+    def start_span(self, name: str, parent: dict | None = None, **attributes) -> dict:
+        return {"name": name, "attributes": attributes}
+
+    def end_span(self, span: dict, **attributes) -> None:
+        pass
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        yield {"name": name, "attributes": attributes}
+
+    def annotate(self, **attributes) -> None:
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+
+class OTelJsonExporter:
+    """
+    Hängt abgeschlossene Traces als OTLP/JSON-Zeilen an eine Datei an, z.B. für
+    den filelog-Receiver des OpenTelemetry Collectors.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, trace: Trace) -> None:
+        line = json.dumps(trace.to_otel(), ensure_ascii=False) + "\n"
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+def start_prometheus_server(registry: MetricsRegistry = METRICS, host: str = "127.0.0.1",
+                            port: int = 9464) -> ThreadingHTTPServer:
+    """
+    Startet einen lokalen HTTP-Endpunkt /metrics für Prometheus in einem Hintergrund-Thread.
+
+    Ausnahmen:
+      OSError, wenn der Port bereits belegt ist.
+    """
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.to_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args) -> None:
+            pass
+
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-endpoint", daemon=True).start()
+    return server
@@ -0,0 +1,211 @@
+"""
+Kern der Generierungspipeline ohne Streamlit-Abhängigkeit: Eingabebilder
+aufnehmen und vorverarbeiten, die Anfrage aufbauen und die Antwort zerlegen.
+
+Die Streamlit-App, der Batch-Modus (batch.py) und der HTTP-Server
+(server.py) verwenden dieselben Funktionen; die App ergänzt nur die
+Darstellung, das Streaming und die Rückmeldungen an die Sitzung.
+"""
+from __future__ import annotations
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+from context_cache import ContextCacheRegistry, context_cache_key
+from image_ingest import ImageBudgetError, ingest_bytes
+from image_output import output_images
+from image_preprocessing import PreprocessingCache, to_part
+from metrics import NULL_TRACE, Trace
+
+if TYPE_CHECKING:
+    from google import genai
+    from google.genai import types
+
+# Sampling-Parameter, die pro Anfrage gesetzt werden dürfen
+SAMPLING_PARAMS = ("temperature", "top_p", "top_k", "max_output_tokens")
+
+# Anzahl gleichzeitig gehaltener Clients (je API-Key einer)
+DEFAULT_CLIENT_POOL_SIZE = 32
+
+
+class ClientPool:
+    """
+    Hält genau einen genai.Client pro API-Key und verwendet ihn für alle
+    Anfragen wieder, damit Verbindungen des SDK nicht für jede Anfrage neu
+    aufgebaut werden. Bei mehr als max_size Keys wird der am längsten nicht
+    genutzte Client verworfen. Die Keys werden nur als Hash gespeichert.
+
+    Parameter:
+      max_size: Maximale Anzahl gleichzeitig gehaltener Clients.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_CLIENT_POOL_SIZE):
+        self.max_size = max_size
+        self._clients: OrderedDict[str, genai.Client] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "created": 0, "evicted": 0}
+
+    def get(self, api_key: str) -> genai.Client:
+        key = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                self._stats["hits"] += 1
+                return client
+            from google import genai
+
+            client = genai.Client(api_key=api_key)
+            self._clients[key] = client
+            self._stats["created"] += 1
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+                self._stats["evicted"] += 1
+            return client
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, size=len(self._clients))
+
+
+def ingest_image(data: bytes, name: str, budget: dict | None = None) -> dict:
+    """
+    Nimmt ein Eingabebild entgegen (siehe image_ingest.ingest_bytes) und
+    wandelt Fehler in einen Eintrag mit Meldung um, statt sie auszulösen.
+
+    Rückgabe:
+      Dictionary aus ingest_bytes oder {"name": ..., "error": ...} bei Fehlern.
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        return ingest_bytes(data, name, budget)
+    except ImageBudgetError as e:
+        return {"name": name, "error": str(e)}
+    except Image.DecompressionBombError:
+        return {"name": name, "error": "Das Bild ist zu groß und kann nicht verarbeitet werden."}
+    except UnidentifiedImageError as e:
+        return {"name": name, "error": f"Ungültiges Bildformat: {e}"}
+
+
+def prepare_contents(prompt: str, image_entries: list[dict], preprocessing: dict,
+                     preprocessing_cache: PreprocessingCache, trace: Trace | None = None) -> dict:
+    """
+    Baut die Eingabeinhalte einer Anfrage: den Prompt und die vorverarbeiteten
+    Bilder. Hier wird jedes Bild zum ersten und einzigen Mal dekodiert.
+
+    Parameter:
+      prompt: Der Textprompt.
+      image_entries: Einträge aus ingest_image; Einträge mit "error" werden übersprungen.
+      preprocessing: Einstellungen der Bildvorverarbeitung (siehe image_preprocessing).
+      preprocessing_cache: Cache für vorverarbeitete Bilder (per Inhalts-Hash).
+      trace: Optionaler Trace; je Bild wird ein Span "image_preprocessing" erfasst.
+
+    Rückgabe:
+      Dictionary mit contents (für die API), input_images (vorverarbeitete
+      Bytes für den Cache-Schlüssel), report (Bytegrößen vor/nach der
+      Vorverarbeitung) und skipped (Meldungen zu übersprungenen Bildern).
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    trace = trace or NULL_TRACE
+    prepared = {"contents": [prompt], "input_images": [], "report": [], "skipped": []}
+    for entry in image_entries:
+        if "error" in entry:
+            prepared["skipped"].append(f"Bild {entry['name']} wird übersprungen: {entry['error']}")
+            continue
+        try:
+            # Verkleinern, neu kodieren und Metadaten entfernen (gecacht per Inhalts-Hash)
+            with trace.span("image_preprocessing", file=entry["name"]) as span:
+                preprocessed = preprocessing_cache.preprocess(entry["data"], preprocessing, digest=entry["sha256"])
+                span["attributes"].update(cached=preprocessed["cached"], bytes=preprocessed["processed_bytes"])
+        except UnidentifiedImageError:
+            prepared["skipped"].append(f"Fehler beim Verarbeiten des Bildes: {entry['name']}")
+            continue
+        except Image.DecompressionBombError:
+            prepared["skipped"].append(f"Das Bild {entry['name']} ist zu groß und kann nicht verarbeitet werden.")
+            continue
+        prepared["contents"].append(to_part(preprocessed))
+        prepared["input_images"].append(preprocessed["data"])
+        prepared["report"].append({
+            "Datei": entry["name"],
+            "Bytes vorher": preprocessed["original_bytes"],
+            "Bytes nachher": preprocessed["processed_bytes"],
+            "Größe vorher": str(preprocessed["original_dimensions"]),
+            "Größe nachher": str(preprocessed["dimensions"]),
+            "Format": preprocessed["mime_type"],
+            "Aus Cache": preprocessed["cached"]
+        })
+    return prepared
+
+
+def apply_context_cache(prepared: dict, client: genai.Client, model_name: str,
+                        registry: ContextCacheRegistry | None, owner: str,
+                        trace: Trace | None = None) -> dict:
+    """
+    Ersetzt die Eingabebilder durch einen Verweis auf einen Context Cache der
+    API, sobald dieselben Bilder wiederholt verwendet werden (siehe
+    context_cache.ContextCacheRegistry). Der gecachte Inhalt steht im Kontext
+    vor dem Prompt.
+
+    Parameter:
+      prepared: Ergebnis von prepare_contents.
+      client: Client des API-Keys.
+      model_name: Das Modell der Anfrage.
+      registry: Die Registry oder None, wenn das Context Caching deaktiviert ist.
+      owner: Kennung des API-Keys (siehe rate_limiter.api_key_id).
+      trace: Optionaler Trace; erfasst wird ein Span "context_cache".
+
+    Rückgabe:
+      Dictionary mit contents (für die API), cached_content (Cache-Name oder
+      None) und key (Schlüssel des Präfixes für invalidate).
+    """
+    if registry is None or not prepared["input_images"]:
+        return {"contents": prepared["contents"], "cached_content": None, "key": None}
+    trace = trace or NULL_TRACE
+    key = context_cache_key(model_name, owner, prepared["input_images"])
+    with trace.span("context_cache", images=len(prepared["input_images"])) as span:
+        cached_content = registry.resolve(client, model_name, key, prepared["contents"][1:], owner=owner)
+        span["attributes"].update(cached=cached_content is not None)
+    if cached_content is None:
+        return {"contents": prepared["contents"], "cached_content": None, "key": key}
+    return {"contents": prepared["contents"][:1], "cached_content": cached_content, "key": key}
+
+
+def build_generation_config(params: dict, candidate_count: int = 1,
+                            cached_content: str | None = None) -> types.GenerateContentConfig:
+    """
+    Erstellt die Konfiguration einer Anfrage aus den Sampling-Parametern.
+    Fehlende Parameter bleiben auf den Standardwerten des Modells.
+    """
+    from google.genai import types
+
+    return types.GenerateContentConfig(
+        response_modalities=['Text', 'Image'],
+        candidate_count=candidate_count if candidate_count > 1 else None,
+        cached_content=cached_content,
+        **{name: params.get(name) for name in SAMPLING_PARAMS}
+    )
+
+
+def parse_response(response: types.GenerateContentResponse | None) -> dict:
+    """
+    Zerlegt eine Antwort in Text und Bilder aller Kandidaten. Die Bilder
+    bleiben unverändert (siehe image_output.output_images).
+
+    Rückgabe:
+      Dictionary mit text, images, finish_reasons und total_tokens.
+    """
+    candidates = (response.candidates or []) if response is not None else []
+    texts = [part.text for candidate in candidates
+             for part in ((candidate.content.parts or []) if candidate.content else []) if part.text]
+    usage = response.usage_metadata if response is not None else None
+    return {
+        "text": "\n\n".join(texts),
+        "images": output_images(response),
+        "finish_reasons": [candidate.finish_reason.value if candidate.finish_reason else None
+                           for candidate in candidates],
+        "total_tokens": usage.total_token_count if usage else None
+    }
@@ -0,0 +1,250 @@
+import asyncio
+import email.utils
+import hashlib
+import heapq
+import itertools
+import re
+import time
+
+from metrics import METRICS
+
+# Standardgrenzen, falls ein Modell keinen eigenen Eintrag in models.json hat
+DEFAULT_RATE_LIMITS = {"rpm": 10, "tpm": 1000000}
+
+# Prioritäten: kleinere Werte werden zuerst bedient
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+# Grobe Token-Schätzung vor dem Aufruf: ca. 4 Zeichen pro Token, feste Kosten pro Bild
+CHARS_PER_TOKEN = 4
+TOKENS_PER_IMAGE = 258
+
+
+def api_key_id(api_key: str) -> str:
+    """
+    Kurzer, nicht umkehrbarer Bezeichner eines API-Keys für Limits und Metriken.
+    """
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+def estimate_tokens(contents: list) -> int:
+    """
+    Schätzt die Eingabe-Tokens einer Anfrage für das Tokens-pro-Minute-Limit.
+    Texte zählen ca. ein Token pro vier Zeichen, alle anderen Teile (Bilder) pauschal.
+    """
+    tokens = 0
+    for item in contents:
+        if isinstance(item, str):
+            tokens += max(1, len(item) // CHARS_PER_TOKEN)
+        else:
+            tokens += TOKENS_PER_IMAGE
+    return tokens
+
+
+def retry_after_seconds(error: Exception) -> float | None:
+    """
+    Liest die vom Server empfohlene Wartezeit aus einem API-Fehler.
+
+    Berücksichtigt den HTTP-Header Retry-After (Sekunden oder HTTP-Datum) sowie
+    das Feld "retryDelay" (z.B. "17s") in den Fehlerdetails der Gemini API.
+
+    Rückgabe:
+      Wartezeit in Sekunden oder None, wenn keine Angabe vorhanden ist.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers:
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                try:
+                    parsed = email.utils.parsedate_to_datetime(value)
+                except (TypeError, ValueError):
+                    # Unlesbarer Header (z.B. "soon"): wie ein fehlender Header behandeln
+                    parsed = None
+                if parsed is not None:
+                    return max(0.0, parsed.timestamp() - time.time())
+    match = re.search(r"retryDelay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", str(getattr(error, "details", "") or error))
+    if match:
+        return float(match.group(1))
+    return None
+
+
+class TokenBucket:
+    """
+    Token-Bucket mit kontinuierlicher Auffüllung.
+
+    Parameter:
+      capacity: Maximale Anzahl an Tokens (entspricht dem Limit pro Minute).
+      refill_per_second: Auffüllrate in Tokens pro Sekunde.
+    """
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.refill_per_second)
+        self._updated = now
+
+    def time_until(self, amount: float, now: float) -> float:
+        """
+        Sekunden, bis amount Tokens verfügbar sind (0, wenn sofort).
+        """
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self._tokens >= amount:
+            return 0.0
+        return (amount - self._tokens) / self.refill_per_second
+
+    def consume(self, amount: float, now: float) -> None:
+        """
+        Entnimmt Tokens. Negative Mengen geben Tokens zurück (z.B. nach einer Überschätzung).
+        """
+        self._refill(now)
+        self._tokens = min(self.capacity, self._tokens - min(amount, self.capacity))
+
+
+class _Group:
+    """
+    Limits und Warteschlange für eine Kombination aus API-Key und Modell.
+    """
+
+    def __init__(self, key: str, model: str, rpm: float, tpm: float):
+        self.labels = {"key": key, "model": model}
+        self.requests = TokenBucket(rpm, rpm / 60.0)
+        self.tokens = TokenBucket(tpm, tpm / 60.0)
+        self.waiters: list = []
+        self.blocked_until = 0.0
+        self.timer: asyncio.TimerHandle | None = None
+
+
+class RateLimitScheduler:
+    """
+    Prozessweiter Scheduler für API-Anfragen mit Requests-pro-Minute- und
+    Tokens-pro-Minute-Buckets je API-Key und Modell.
+
+    Anfragen warten in einer Prioritätswarteschlange, bis beide Buckets genug
+    Kapazität haben. Meldet eine Anfrage ein 429 mit Retry-After, pausiert die
+    ganze Gruppe, damit andere Sitzungen nicht ebenfalls in das Limit laufen.
+    Alle Methoden außer stats() müssen in derselben Event-Loop laufen.
+
+    Parameter:
+      limits: Zuordnung Modellname -> {"rpm": ..., "tpm": ...}; der Eintrag
+        "default" gilt für alle übrigen Modelle.
+    """
+
+    def __init__(self, limits: dict | None = None):
+        self.limits = dict(limits or {})
+        self._groups: dict[tuple[str, str], _Group] = {}
+        self._sequence = itertools.count()
+        self._stats = {"acquired": 0, "throttled": 0, "total_wait": 0.0, "max_wait": 0.0, "last_wait": 0.0}
+
+    def _limits_for(self, model: str) -> dict:
+        return {**DEFAULT_RATE_LIMITS, **self.limits.get("default", {}), **self.limits.get(model, {})}
+
+    def _group(self, key: str, model: str) -> _Group:
+        group = self._groups.get((key, model))
+        if group is None:
+            limits = self._limits_for(model)
+            group = _Group(key, model, limits["rpm"], limits["tpm"])
+            self._groups[(key, model)] = group
+        return group
+
+    async def acquire(self, key: str, model: str, tokens: int, priority: int = PRIORITY_INTERACTIVE) -> float:
+        """
+        Wartet, bis die Anfrage gesendet werden darf, und reserviert die Kapazität.
+
+        Parameter:
+          key: Bezeichner des API-Keys (siehe api_key_id).
+          model: Der Modellname.
+          tokens: Geschätzte Tokens der Anfrage (siehe estimate_tokens).
+          priority: Priorität; kleinere Werte werden zuerst bedient.
+
+        Rückgabe:
+          Die Wartezeit in Sekunden.
+        """
+        loop = asyncio.get_running_loop()
+        group = self._group(key, model)
+        future = loop.create_future()
+        enqueued_at = time.monotonic()
+        heapq.heappush(group.waiters, (priority, next(self._sequence), tokens, future))
+        self._dispatch(group)
+        try:
+            await future
+        finally:
+            # Auch abgebrochene Wartende aus der Warteschlangenlänge entfernen
+            self._export_queue_depth(group)
+        waited = time.monotonic() - enqueued_at
+        METRICS.observe("genai_rate_limit_wait_seconds", waited, {"model": model})
+        self._stats["acquired"] += 1
+        self._stats["total_wait"] += waited
+        self._stats["last_wait"] = waited
+        self._stats["max_wait"] = max(self._stats["max_wait"], waited)
+        return waited
+
+    def settle(self, key: str, model: str, estimated: int, actual: int | None) -> None:
+        """
+        Gleicht das Tokens-pro-Minute-Bucket mit dem tatsächlichen Verbrauch
+        aus usage_metadata ab.
+        """
+        if actual is None or actual == estimated:
+            return
+        group = self._group(key, model)
+        group.tokens.consume(actual - estimated, time.monotonic())
+
+    def throttle(self, key: str, model: str, delay: float) -> None:
+        """
+        Pausiert alle Anfragen einer Gruppe für delay Sekunden (z.B. nach einem 429).
+        """
+        group = self._group(key, model)
+        group.blocked_until = max(group.blocked_until, time.monotonic() + delay)
+        self._stats["throttled"] += 1
+
+    def _dispatch(self, group: _Group) -> None:
+        if group.timer is not None:
+            group.timer.cancel()
+            group.timer = None
+        while group.waiters:
+            _, _, tokens, future = group.waiters[0]
+            if future.done():
+                # Abgebrochene Wartende verwerfen
+                heapq.heappop(group.waiters)
+                continue
+            now = time.monotonic()
+            wait = max(group.blocked_until - now,
+                       group.requests.time_until(1, now),
+                       group.tokens.time_until(tokens, now))
+            if wait > 0:
+                group.timer = asyncio.get_running_loop().call_later(wait, self._dispatch, group)
+                break
+            heapq.heappop(group.waiters)
+            group.requests.consume(1, now)
+            group.tokens.consume(tokens, now)
+            future.set_result(None)
+        self._export_queue_depth(group)
+
+    @staticmethod
+    def _queue_depth(group: _Group) -> int:
+        return sum(1 for waiter in list(group.waiters) if not waiter[3].done())
+
+    def _export_queue_depth(self, group: _Group) -> None:
+        METRICS.set("genai_rate_limit_queue_depth", self._queue_depth(group), group.labels)
+
+    def stats(self) -> dict:
+        """
+        Gibt Warteschlangenlänge und Wartezeiten zurück (für den Debug-Modus).
+        """
+        stats = dict(self._stats)
+        stats["average_wait"] = stats["total_wait"] / stats["acquired"] if stats["acquired"] else 0.0
+        queue_depths = {
+            f"{key}/{model}": self._queue_depth(group)
+            for (key, model), group in list(self._groups.items())
+        }
+        stats["queue_depth"] = sum(queue_depths.values())
+        stats["queue_depth_by_group"] = queue_depths
+        return stats
@@ -0,0 +1,266 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from google.genai import types
+
+# Standardwerte für den Antwort-Cache
+DEFAULT_MEMORY_MAX_ENTRIES = 128
+DEFAULT_MEMORY_TTL = 3600  # in Sekunden
+DEFAULT_DISK_DIR = os.path.join(".cache", "responses")
+DEFAULT_DISK_MAX_ENTRIES = 1000
+DEFAULT_DISK_TTL = 86400  # in Sekunden
+
+# Überhang der Festplattenstufe über disk_max_entries (Anteil), bevor verdrängt wird;
+# so wird das Verzeichnis nicht bei jedem Speichern durchsucht
+DISK_EVICTION_SLACK = 0.1
+
+# Parameter, die die Antwort beeinflussen und daher in den Cache-Schlüssel einfließen:
+# die Sampling-Parameter und die Anzahl der Kandidaten (Fan-out)
+CACHE_KEY_PARAMS = ("temperature", "top_p", "top_k", "max_output_tokens", "candidate_count")
+
+
+def build_cache_key(model_name: str, prompt: str, images: list[bytes], params: dict, owner: str = "") -> str:
+    """
+    Berechnet einen inhaltsadressierten Cache-Schlüssel für eine Anfrage.
+
+    Parameter:
+      model_name: Der Name des verwendeten Modells.
+      prompt: Der Textprompt.
+      images: Die Rohdaten der Eingabebilder in Upload-Reihenfolge.
+      params: Parameter der Anfrage (temperature, top_p, top_k, max_output_tokens
+        und candidate_count, siehe CACHE_KEY_PARAMS). Fehlende Parameter zählen als None.
+      owner: Optionale Kennung des API-Keys (z.B. rate_limiter.api_key_id).
+             Mit Kennung werden Antworten nur für Anfragen mit demselben Key
+             wiederverwendet; ohne (Standard) teilen sich alle Keys den Eintrag.
+
+    Rückgabe:
+      Ein SHA-256-Hexdigest, der die Anfrage eindeutig beschreibt.
+    """
+    digest = hashlib.sha256()
+    digest.update(model_name.encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(prompt.encode("utf-8"))
+    for image_bytes in images:
+        digest.update(b"\x00")
+        digest.update(hashlib.sha256(image_bytes).digest())
+    sampling = {name: params.get(name) for name in CACHE_KEY_PARAMS}
+    digest.update(b"\x00")
+    digest.update(json.dumps(sampling, sort_keys=True).encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(owner.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """
+    Zweistufiger Cache für API-Antworten.
+
+    Die erste Stufe ist ein LRU-Cache im Arbeitsspeicher, die optionale zweite
+    Stufe legt Antworten als JSON-Dateien auf der Festplatte ab. Beide Stufen
+    haben eigene Größen- und TTL-Grenzen. Der Cache ist threadsicher, damit er
+    von mehreren Streamlit-Sitzungen gemeinsam genutzt werden kann.
+    """
+
+    def __init__(self, memory_max_entries: int = DEFAULT_MEMORY_MAX_ENTRIES,
+                 memory_ttl: float = DEFAULT_MEMORY_TTL,
+                 disk_enabled: bool = False,
+                 disk_dir: str = DEFAULT_DISK_DIR,
+                 disk_max_entries: int = DEFAULT_DISK_MAX_ENTRIES,
+                 disk_ttl: float = DEFAULT_DISK_TTL):
+        self.memory_max_entries = memory_max_entries
+        self.memory_ttl = memory_ttl
+        self.disk_enabled = disk_enabled
+        self.disk_dir = disk_dir
+        self.disk_max_entries = disk_max_entries
+        self.disk_ttl = disk_ttl
+        self._memory: OrderedDict[str, tuple[float, types.GenerateContentResponse]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+        # Schlüssel der Festplattenstufe; wird beim ersten Speichern aus dem Verzeichnis gelesen
+        self._disk_keys: set[str] | None = None
+        if self.disk_enabled:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config: dict) -> "ResponseCache":
+        """
+        Erstellt einen Cache aus dem Abschnitt "response_cache" der API-Konfiguration.
+        """
+        return cls(
+            memory_max_entries=config.get("memory_max_entries", DEFAULT_MEMORY_MAX_ENTRIES),
+            memory_ttl=config.get("memory_ttl", DEFAULT_MEMORY_TTL),
+            disk_enabled=config.get("disk_enabled", False),
+            disk_dir=config.get("disk_dir", DEFAULT_DISK_DIR),
+            disk_max_entries=config.get("disk_max_entries", DEFAULT_DISK_MAX_ENTRIES),
+            disk_ttl=config.get("disk_ttl", DEFAULT_DISK_TTL),
+        )
+
+    def get(self, key: str) -> types.GenerateContentResponse | None:
+        """
+        Liefert die gecachte Antwort zu einem Schlüssel oder None.
+        Treffer aus der Festplattenstufe werden in den Speicher übernommen.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                stored_at, response = entry
+                if now - stored_at <= self.memory_ttl:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return response
+                del self._memory[key]
+
+            entry = self._disk_get(key, now)
+            if entry is not None:
+                # Die Speicherstufe übernimmt den Speicherzeitpunkt, damit die TTL nicht neu beginnt
+                stored_at, response = entry
+                self._memory_put(key, response, stored_at)
+                self._stats["disk_hits"] += 1
+                return response
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, key: str, response: types.GenerateContentResponse) -> None:
+        """
+        Speichert eine Antwort in allen aktiven Cache-Stufen.
+        """
+        now = time.time()
+        with self._lock:
+            self._memory_put(key, response, now)
+            self._disk_put(key, response)
+            self._stats["stores"] += 1
+
+    def clear(self) -> None:
+        """
+        Leert beide Cache-Stufen. Die Zähler bleiben erhalten.
+        """
+        with self._lock:
+            self._memory.clear()
+            if self.disk_enabled and os.path.isdir(self.disk_dir):
+                for file_name in os.listdir(self.disk_dir):
+                    if file_name.endswith(".json"):
+                        os.remove(os.path.join(self.disk_dir, file_name))
+            self._disk_keys = None
+
+    def stats(self) -> dict:
+        """
+        Gibt Trefferzähler und Füllstand der Cache-Stufen zurück.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+            stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+            return stats
+
+    def _memory_put(self, key: str, response: types.GenerateContentResponse, now: float) -> None:
+        self._memory[key] = (now, response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_max_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _disk_get(self, key: str, now: float) -> tuple[float, types.GenerateContentResponse] | None:
+        """
+        Liest einen Eintrag der Festplattenstufe.
+
+        Die mtime einer Datei ist ihr Speicherzeitpunkt und bestimmt die TTL;
+        die atime ist der letzte Zugriff und bestimmt die Verdrängung (LRU).
+
+        Rückgabe:
+          Speicherzeitpunkt und Antwort, oder None bei Fehltreffer bzw. abgelaufenem Eintrag.
+        """
+        if not self.disk_enabled:
+            return None
+        from google.genai import types
+
+        path = self._disk_path(key)
+        try:
+            stored_at = os.path.getmtime(path)
+            if now - stored_at > self.disk_ttl:
+                self._disk_remove(key)
+                return None
+            with open(path, 'r', encoding="utf-8") as f:
+                response = types.GenerateContentResponse.model_validate_json(f.read())
+            # Nur die Zugriffszeit aktualisieren; die mtime bleibt der Speicherzeitpunkt
+            os.utime(path, (now, stored_at))
+            return stored_at, response
+        except FileNotFoundError:
+            if self._disk_keys is not None:
+                self._disk_keys.discard(key)
+            return None
+        except (OSError, ValueError):
+            # Beschädigte Einträge werden verworfen und wie ein Fehltreffer behandelt
+            self._disk_remove(key)
+            return None
+
+    def _disk_put(self, key: str, response: types.GenerateContentResponse) -> None:
+        if not self.disk_enabled:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding="utf-8") as f:
+                f.write(response.model_dump_json(exclude_none=True))
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        if self._disk_keys is None:
+            self._disk_keys = self._disk_scan()
+        self._disk_keys.add(key)
+        # Erst bei einem Überhang verdrängen, damit nicht jedes Speichern das Verzeichnis durchsucht
+        slack = max(1, int(self.disk_max_entries * DISK_EVICTION_SLACK))
+        if len(self._disk_keys) > self.disk_max_entries + slack:
+            self._disk_evict()
+
+    def _disk_remove(self, key: str) -> None:
+        try:
+            os.remove(self._disk_path(key))
+        except OSError:
+            pass
+        if self._disk_keys is not None:
+            self._disk_keys.discard(key)
+
+    def _disk_scan(self) -> set[str]:
+        """
+        Liest die Schlüssel aller Einträge aus dem Cache-Verzeichnis.
+        """
+        try:
+            return {file_name[:-len(".json")] for file_name in os.listdir(self.disk_dir)
+                    if file_name.endswith(".json")}
+        except OSError:
+            return set()
+
+    def _disk_evict(self) -> None:
+        """
+        Verdrängt die am längsten nicht verwendeten Einträge (atime, siehe _disk_get),
+        bis höchstens disk_max_entries übrig sind. Das Verzeichnis wird dabei neu
+        eingelesen, da andere Prozesse Einträge angelegt oder entfernt haben können.
+        """
+        entries = []
+        for key in self._disk_scan():
+            try:
+                entries.append((os.path.getatime(self._disk_path(key)), key))
+            except OSError:
+                # Inzwischen entfernte Einträge überspringen
+                continue
+        entries.sort()
+        excess = max(0, len(entries) - self.disk_max_entries)
+        for _, key in entries[:excess]:
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
+        self._disk_keys = {key for _, key in entries[excess:]}
@@ -0,0 +1,346 @@
+"""
+Wiederholungsstrategie für API-Aufrufe: Klassifizierung der Fehler, Backoff
+mit "Decorrelated Jitter", Zeitbudget je Anfrage und ein Circuit Breaker je
+Modell, der bei anhaltenden Störungen sofort abbricht und auf das nächste
+Modell aus models.json ausweichen lässt.
+
+Das Modul ist unabhängig von Streamlit; generation.py wendet die Strategie in
+allen Generierungspfaden an.
+"""
+from __future__ import annotations
+
+import random
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING
+
+from metrics import METRICS
+
+if TYPE_CHECKING:
+    from google.genai import types
+
+# Fehlerklassen
+ERROR_AUTH = "auth"                  # 401/403: Key ungültig oder ohne Berechtigung
+ERROR_INVALID = "invalid"            # übrige 4xx: ungültige Anfrage, unbekanntes Modell
+ERROR_QUOTA = "quota"                # 429: Kontingent oder Ratenlimit erschöpft
+ERROR_TRANSIENT = "transient"        # 5xx und Netzwerkfehler
+ERROR_TIMEOUT = "timeout"            # Zeitüberschreitung eines Versuchs oder 408/504
+ERROR_SAFETY = "safety"              # Antwort von den Sicherheitsfiltern blockiert
+ERROR_CIRCUIT_OPEN = "circuit_open"  # Aufruf wegen offenem Circuit Breaker nicht gesendet
+ERROR_UNKNOWN = "unknown"
+
+# Nur diese Fehler können bei einem erneuten Versuch verschwinden; sie lösen
+# auch das Ausweichen auf ein anderes Modell aus
+RETRYABLE_ERRORS = frozenset({ERROR_QUOTA, ERROR_TRANSIENT, ERROR_TIMEOUT})
+
+# Fehler, die auf eine Störung des Modells hindeuten und für den Circuit Breaker
+# zählen. Ein 429 betrifft nur das Kontingent eines API-Keys und zählt weder als
+# Fehler noch als Erfolg, damit ein Key den Breaker nicht für alle anderen öffnet.
+BREAKER_ERRORS = frozenset({ERROR_TRANSIENT, ERROR_TIMEOUT})
+
+# Bezeichnungen der Fehlerklassen in Meldungen
+ERROR_LABELS = {
+    ERROR_AUTH: "Authentifizierung",
+    ERROR_INVALID: "ungültige Anfrage",
+    ERROR_QUOTA: "Kontingent erschöpft",
+    ERROR_TRANSIENT: "Serverfehler",
+    ERROR_TIMEOUT: "Zeitüberschreitung",
+    ERROR_SAFETY: "Sicherheitsfilter",
+    ERROR_CIRCUIT_OPEN: "Modell vorübergehend gesperrt",
+    ERROR_UNKNOWN: "unbekannter Fehler",
+}
+
+# finish_reason-Werte, mit denen die API blockierte Antworten kennzeichnet
+SAFETY_FINISH_REASONS = frozenset({
+    "SAFETY", "RECITATION", "BLOCKLIST", "PROHIBITED_CONTENT", "SPII",
+    "IMAGE_SAFETY", "IMAGE_PROHIBITED_CONTENT", "IMAGE_RECITATION"
+})
+
+# Standardwerte (Zeiten in Sekunden; 0 = unbegrenzt)
+DEFAULT_RETRY_CONFIG = {
+    "max_wait": 30,
+    "deadline": 120,
+    "attempt_timeout": 90
+}
+DEFAULT_CIRCUIT_BREAKER_CONFIG = {
+    "enabled": True,
+    "failure_threshold": 5,
+    "recovery_time": 30,
+    "max_fallbacks": 1
+}
+
+
+class SafetyBlockedError(RuntimeError):
+    """
+    Wird ausgelöst, wenn die Antwort von den Sicherheitsfiltern blockiert wurde.
+    """
+
+
+def blocked_reason(response: types.GenerateContentResponse) -> str | None:
+    """
+    Prüft, ob eine Antwort blockiert wurde: entweder der Prompt selbst
+    (prompt_feedback) oder alle Kandidaten ohne Inhalt mit einem finish_reason
+    aus SAFETY_FINISH_REASONS.
+
+    Rückgabe:
+      Der Grund (z.B. "SAFETY") oder None.
+    """
+    feedback = response.prompt_feedback
+    if feedback is not None and feedback.block_reason:
+        return getattr(feedback.block_reason, "value", str(feedback.block_reason))
+    candidates = response.candidates or []
+    if any(candidate.content and candidate.content.parts for candidate in candidates):
+        return None
+    for candidate in candidates:
+        reason = getattr(candidate.finish_reason, "value", candidate.finish_reason)
+        if reason in SAFETY_FINISH_REASONS:
+            return reason
+    return None
+
+
+def classify_error(error: BaseException) -> str:
+    """
+    Ordnet einen Fehler einer Fehlerklasse zu (siehe ERROR_*).
+    API-Fehler werden am HTTP-Code erkannt, Netzwerkfehler am Typ.
+    """
+    if isinstance(error, SafetyBlockedError):
+        return ERROR_SAFETY
+    if isinstance(error, TimeoutError):
+        return ERROR_TIMEOUT
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        if code in (401, 403):
+            return ERROR_AUTH
+        if code == 429:
+            return ERROR_QUOTA
+        if code in (408, 504):
+            return ERROR_TIMEOUT
+        if code >= 500:
+            return ERROR_TRANSIENT
+        if code >= 400:
+            return ERROR_INVALID
+    # Fehler des HTTP-Clients des SDK; httpx ist nur geladen, wenn das SDK es verwendet
+    httpx = sys.modules.get("httpx")
+    if httpx is not None:
+        if isinstance(error, httpx.TimeoutException):
+            return ERROR_TIMEOUT
+        if isinstance(error, httpx.TransportError):
+            return ERROR_TRANSIENT
+    if isinstance(error, ConnectionError):
+        return ERROR_TRANSIENT
+    return ERROR_UNKNOWN
+
+
+class RetryPolicy:
+    """
+    Entscheidet nach einem fehlgeschlagenen Versuch, ob und nach welcher
+    Wartezeit erneut versucht wird.
+
+    Wiederholt werden nur Fehler aus RETRYABLE_ERRORS. Die Wartezeit folgt
+    dem "Decorrelated Jitter": zufällig zwischen base_wait_time und dem
+    Dreifachen der vorherigen Wartezeit, höchstens max_wait. Eine vom Server
+    gemeldete Retry-After-Zeit wird nie unterschritten. Passt die nächste
+    Wartezeit nicht mehr in das Zeitbudget (deadline), wird abgebrochen.
+
+    Parameter:
+      max_retries: Maximale Anzahl der Versuche je Modell.
+      base_wait_time: Kleinste Wartezeit zwischen zwei Versuchen.
+      max_wait: Größte Wartezeit zwischen zwei Versuchen.
+      deadline: Zeitbudget einer Anfrage über alle Versuche, Wartezeiten und
+        Ausweichmodelle hinweg (None = unbegrenzt).
+      attempt_timeout: Zeitlimit eines einzelnen Versuchs (None = unbegrenzt).
+    """
+
+    def __init__(self, max_retries: int, base_wait_time: float,
+                 max_wait: float | None = DEFAULT_RETRY_CONFIG["max_wait"],
+                 deadline: float | None = DEFAULT_RETRY_CONFIG["deadline"],
+                 attempt_timeout: float | None = DEFAULT_RETRY_CONFIG["attempt_timeout"]):
+        self.max_retries = max_retries
+        self.base_wait_time = base_wait_time
+        self.max_wait = max_wait
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+
+    @classmethod
+    def from_config(cls, config: dict, max_retries: int, base_wait_time: float) -> "RetryPolicy":
+        """
+        Erstellt die Strategie aus dem Abschnitt "retry" der api_config.json.
+        Der Wert 0 steht dort für unbegrenzt.
+        """
+        settings = {**DEFAULT_RETRY_CONFIG, **config}
+        return cls(max_retries, base_wait_time, max_wait=settings["max_wait"] or None,
+                   deadline=settings["deadline"] or None, attempt_timeout=settings["attempt_timeout"] or None)
+
+    def next_delay(self, previous: float | None, retry_after: float | None = None) -> float:
+        """
+        Wartezeit vor dem nächsten Versuch (Decorrelated Jitter).
+
+        Parameter:
+          previous: Die vorherige Wartezeit dieser Anfrage oder None beim ersten Fehler.
+          retry_after: Vom Server gemeldete Wartezeit (siehe rate_limiter.retry_after_seconds).
+        """
+        upper = max(self.base_wait_time, (previous or self.base_wait_time) * 3)
+        delay = random.uniform(self.base_wait_time, upper)
+        if self.max_wait is not None:
+            delay = min(delay, self.max_wait)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def remaining(self, started: float) -> float | None:
+        """
+        Verbleibendes Zeitbudget in Sekunden (None = unbegrenzt).
+
+        Parameter:
+          started: Beginn der Anfrage (time.monotonic()).
+        """
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - (time.monotonic() - started))
+
+    def attempt_timeout_for(self, started: float) -> float | None:
+        """
+        Zeitlimit für den nächsten Versuch: attempt_timeout, höchstens das verbleibende Budget.
+        """
+        remaining = self.remaining(started)
+        if remaining is None:
+            return self.attempt_timeout
+        return remaining if self.attempt_timeout is None else min(self.attempt_timeout, remaining)
+
+    def should_retry(self, error_class: str, attempt: int, delay: float, started: float) -> bool:
+        """
+        Prüft, ob nach dem Versuch attempt (ab 0) erneut versucht wird.
+        """
+        if error_class not in RETRYABLE_ERRORS or attempt >= self.max_retries - 1:
+            return False
+        remaining = self.remaining(started)
+        return remaining is None or delay < remaining
+
+
+def fallback_chain(model_name: str, models: list[str], max_fallbacks: int) -> list[str]:
+    """
+    Ausweichmodelle für model_name: die in models (Reihenfolge aus
+    models.json) folgenden Modelle, am Ende der Liste wieder von vorn.
+
+    Rückgabe:
+      Höchstens max_fallbacks Modellnamen, ohne model_name selbst.
+    """
+    if max_fallbacks <= 0 or model_name not in models:
+        return []
+    index = models.index(model_name)
+    ordered = models[index + 1:] + models[:index]
+    return ordered[:max_fallbacks]
+
+
+class CircuitBreakerRegistry:
+    """
+    Circuit Breaker je Modell, prozessweit und threadsicher.
+
+    Nach failure_threshold aufeinanderfolgenden Fehlern aus BREAKER_ERRORS
+    öffnet der Breaker eines Modells: Aufrufe werden für recovery_time
+    Sekunden nicht gesendet, sondern scheitern sofort. Danach ist genau ein
+    Probeaufruf erlaubt (half_open); gelingt er, schließt der Breaker, sonst
+    öffnet er erneut. Fehler wie 401/403 oder blockierte Antworten sagen
+    nichts über den Zustand des Modells aus und zählen wie ein Erfolg;
+    429 (Kontingent eines Keys) wird gar nicht gemeldet.
+
+    Parameter:
+      failure_threshold: Aufeinanderfolgende Fehler, nach denen der Breaker öffnet.
+      recovery_time: Sekunden, die der Breaker offen bleibt.
+    """
+
+    def __init__(self, failure_threshold: int = DEFAULT_CIRCUIT_BREAKER_CONFIG["failure_threshold"],
+                 recovery_time: float = DEFAULT_CIRCUIT_BREAKER_CONFIG["recovery_time"]):
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self._models: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: dict) -> "CircuitBreakerRegistry":
+        """
+        Erstellt die Registry aus dem Abschnitt "circuit_breaker" der api_config.json.
+        """
+        settings = {**DEFAULT_CIRCUIT_BREAKER_CONFIG, **config}
+        return cls(failure_threshold=settings["failure_threshold"], recovery_time=settings["recovery_time"])
+
+    def _entry(self, model: str) -> dict:
+        entry = self._models.get(model)
+        if entry is None:
+            entry = {"state": "closed", "failures": 0, "opened_at": 0.0, "probe_started": 0.0,
+                     "rejected": 0, "opened": 0}
+            self._models[model] = entry
+        return entry
+
+    def allow(self, model: str) -> bool:
+        """
+        Prüft, ob ein Aufruf an das Modell gesendet werden darf. Im Zustand
+        half_open wird nur ein Probeaufruf zugelassen; bleibt dessen Ergebnis
+        aus, ist nach recovery_time ein weiterer erlaubt.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entry(model)
+            if entry["state"] == "closed":
+                return True
+            if entry["state"] == "open" and now - entry["opened_at"] >= self.recovery_time:
+                entry["state"] = "half_open"
+                entry["probe_started"] = 0.0
+            if entry["state"] == "half_open" and now - entry["probe_started"] >= self.recovery_time:
+                entry["probe_started"] = now
+                return True
+            entry["rejected"] += 1
+        METRICS.inc("genai_circuit_breaker_total", {"model": model, "event": "rejected"})
+        return False
+
+    def retry_in(self, model: str) -> float:
+        """
+        Sekunden, bis das Modell wieder einen Aufruf zulässt (0, wenn sofort).
+        """
+        with self._lock:
+            entry = self._entry(model)
+            if entry["state"] == "closed":
+                return 0.0
+            started = entry["probe_started"] if entry["state"] == "half_open" else entry["opened_at"]
+            return max(0.0, self.recovery_time - (time.monotonic() - started))
+
+    def record(self, model: str, healthy: bool) -> None:
+        """
+        Meldet das Ergebnis eines Aufrufs. healthy ist False für Fehler aus BREAKER_ERRORS.
+        """
+        event = None
+        with self._lock:
+            entry = self._entry(model)
+            if healthy:
+                if entry["state"] != "closed":
+                    event = "closed"
+                entry.update(state="closed", failures=0)
+            else:
+                entry["failures"] += 1
+                if entry["state"] == "half_open" or (entry["state"] == "closed"
+                                                     and entry["failures"] >= self.failure_threshold):
+                    entry.update(state="open", opened_at=time.monotonic())
+                    entry["opened"] += 1
+                    event = "opened"
+        if event is not None:
+            METRICS.inc("genai_circuit_breaker_total", {"model": model, "event": event})
+
+    def state(self, model: str) -> str:
+        with self._lock:
+            return self._entry(model)["state"]
+
+    def stats(self) -> dict:
+        """
+        Gibt Zustand, Fehlerzähler und Sperrzeit je Modell zurück (für den Debug-Modus).
+        """
+        with self._lock:
+            models = list(self._models)
+        return {
+            model: {
+                **{name: value for name, value in self._models[model].items()
+                   if name not in ("opened_at", "probe_started")},
+                "retry_in": round(self.retry_in(model), 1)
+            }
+            for model in models
+        }
@@ -0,0 +1,395 @@
+"""
+Headless HTTP-API für die Generierungspipeline (siehe pipeline.py), ohne Streamlit.
+
+Endpunkte:
+  POST /v1/generate  multipart/form-data mit "prompt" sowie optional "model",
+                     "temperature", "top_p", "top_k", "max_output_tokens" und
+                     Eingabebildern im Feld "images". Antwort: JSON mit Text und
+                     Bildern (Base64). Mit "Accept: image/*" wird stattdessen das
+                     erste Bild unverändert mit seinem MIME-Typ zurückgegeben.
+  GET  /healthz      Auslastung des Servers, des Client-Pools und der Caches.
+  GET  /metrics      Metriken im Textformat von Prometheus.
+
+Der API-Key wird im Header "x-goog-api-key" erwartet; fehlt er, gilt
+GENAI_API_KEY aus der Umgebung. Pro Key wird ein Client wiederverwendet;
+auch Antwort-Cache und zusammengeführte Anfragen sind nach Key getrennt.
+Höchstens max_concurrency Anfragen werden gleichzeitig bearbeitet und
+höchstens max_queue warten; weitere Anfragen erhalten sofort 503 mit
+Retry-After, ebenso Anfragen, die länger als queue_timeout warten.
+
+Fehler der API werden nach ihrer Klasse (siehe retry_policy.py) beantwortet:
+401 bei einem abgelehnten API-Key, 400 bei ungültigen Anfragen, 422 bei
+blockierten Antworten, 503 mit Retry-After bei offenem Circuit Breaker und
+sonst 502. Der Header X-Model nennt das Modell, das tatsächlich geantwortet
+hat (ggf. ein Ausweichmodell).
+
+Aufruf (aus dem Repository-Verzeichnis):
+    GENAI_API_KEY=... python server.py --port 8080
+    curl -F prompt="Ein Logo für ein Café." -F images=@bild.png http://127.0.0.1:8080/v1/generate
+"""
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import asynccontextmanager
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+
+from config_store import API_CONFIG_SCHEMA, MODELS_SCHEMA, ConfigStore, ConfigValidationError
+from context_cache import ContextCacheRegistry
+from generation import DEFAULT_BASE_WAIT_TIME, DEFAULT_MAX_RETRIES, generate_content_with_retry_async, retry_stats
+from image_ingest import DEFAULT_INGEST_BUDGET
+from image_preprocessing import PreprocessingCache
+from metrics import DEFAULT_METRICS_CONFIG, METRICS, OTelJsonExporter, Trace
+from pipeline import (SAMPLING_PARAMS, ClientPool, apply_context_cache, build_generation_config, ingest_image,
+                      parse_response, prepare_contents)
+from rate_limiter import RateLimitScheduler, api_key_id
+from response_cache import ResponseCache, build_cache_key
+from retry_policy import (DEFAULT_CIRCUIT_BREAKER_CONFIG, ERROR_AUTH, ERROR_CIRCUIT_OPEN, ERROR_INVALID, ERROR_SAFETY,
+                          CircuitBreakerRegistry, RetryPolicy, fallback_chain)
+
+logger = logging.getLogger(__name__)
+
+# Standardwerte für den Server (Abschnitt "server" in api_config.json)
+DEFAULT_SERVER_CONFIG = {
+    "host": "127.0.0.1",
+    "port": 8080,
+    "max_concurrency": 8,
+    "max_queue": 32,
+    "queue_timeout": 30,
+    "max_images": 4,
+    "client_pool_size": 32,
+    "model": "gemini-2.0-flash-exp"
+}
+
+# Empfohlene Wartezeit für abgewiesene Anfragen (Header Retry-After, in Sekunden)
+RETRY_AFTER_SECONDS = 1
+
+INT_PARAMS = ("top_k", "max_output_tokens")
+
+# HTTP-Status je Fehlerklasse; übrige Fehler der API ergeben 502
+ERROR_STATUS = {ERROR_AUTH: 401, ERROR_INVALID: 400, ERROR_SAFETY: 422, ERROR_CIRCUIT_OPEN: 503}
+
+
+class ServerBusyError(RuntimeError):
+    """
+    Wird ausgelöst, wenn die Warteschlange voll ist oder eine Anfrage zu lange wartet.
+    """
+
+
+class AdmissionLimiter:
+    """
+    Begrenzt die gleichzeitig bearbeiteten Anfragen und die Länge der
+    Warteschlange davor. Ist beides ausgeschöpft, wird eine Anfrage sofort
+    abgewiesen, statt unbegrenzt Speicher und Verbindungen zu binden.
+    Alle Methoden außer stats() müssen in derselben Event-Loop laufen.
+
+    Parameter:
+      max_concurrency: Maximale Anzahl gleichzeitig bearbeiteter Anfragen.
+      max_queue: Maximale Anzahl wartender Anfragen.
+      queue_timeout: Maximale Wartezeit in der Warteschlange in Sekunden.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._stats = {"admitted": 0, "rejected": 0, "timed_out": 0}
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Belegt einen Platz für die Dauer des Blocks.
+
+        Ausnahmen:
+          ServerBusyError, wenn die Warteschlange voll ist oder die Wartezeit abläuft.
+        """
+        # Gezählt wird selbst, da der Semaphor erst beim nächsten Durchlauf der Loop belegt wird
+        if self.active + self.waiting >= self.max_concurrency + self.max_queue:
+            self._stats["rejected"] += 1
+            raise ServerBusyError(f"Server ausgelastet ({self.active} aktiv, {self.waiting} wartend).")
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._stats["timed_out"] += 1
+            raise ServerBusyError(f"Keine freie Kapazität nach {self.queue_timeout:g} Sekunden.") from None
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        self._stats["admitted"] += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return dict(self._stats, active=self.active, waiting=self.waiting,
+                    max_concurrency=self.max_concurrency, max_queue=self.max_queue)
+
+
+def _error(status_code: int, message: str, headers: dict | None = None) -> JSONResponse:
+    return JSONResponse({"error": message}, status_code=status_code, headers=headers)
+
+
+def _sampling_params(form, defaults: dict) -> dict:
+    """
+    Liest die Sampling-Parameter aus dem Formular; fehlende Felder übernehmen die Standardwerte.
+
+    Ausnahmen:
+      ValueError bei nicht numerischen Werten.
+    """
+    params = {}
+    for name in SAMPLING_PARAMS:
+        value = form.get(name)
+        if value is None or value == "":
+            params[name] = defaults.get(name)
+            continue
+        try:
+            params[name] = int(value) if name in INT_PARAMS else float(value)
+        except ValueError:
+            raise ValueError(f"Ungültiger Wert für {name}: {value!r}") from None
+    return params
+
+
+async def generate(request: Request) -> Response:
+    state = request.app.state
+    started = time.perf_counter()
+    try:
+        async with state.limiter.slot():
+            response = await _generate(request)
+    except ServerBusyError as e:
+        response = _error(503, str(e), headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+    except HTTPException as e:
+        # z.B. ein fehlerhafter multipart-Body (400)
+        response = _error(e.status_code, e.detail, headers=e.headers)
+    except Exception:
+        # Auch unerwartete Fehler als JSON beantworten; Details nur im Log
+        logger.exception("Unerwarteter Fehler bei der Bearbeitung von /v1/generate")
+        response = _error(500, "Interner Serverfehler.")
+    METRICS.inc("server_requests_total", {"status": str(response.status_code)})
+    METRICS.observe("server_request_duration_seconds", time.perf_counter() - started)
+    return response
+
+
+async def _generate(request: Request) -> Response:
+    state = request.app.state
+    config = state.config
+    api_key = request.headers.get("x-goog-api-key") or state.default_api_key
+    if not api_key:
+        return _error(401, "API-Key fehlt (Header x-goog-api-key).")
+    # Zu große Uploads ablehnen, bevor der Body gelesen wird
+    max_body = config["max_images"] * state.ingest_budget["max_bytes"] + 1024 * 1024
+    try:
+        content_length = int(request.headers.get("content-length") or 0)
+    except ValueError:
+        return _error(400, "Ungültiger Header Content-Length.")
+    if content_length > max_body:
+        return _error(413, f"Anfrage größer als {max_body} Bytes.")
+
+    async with request.form(max_files=config["max_images"]) as form:
+        prompt = str(form.get("prompt") or "").strip()
+        if not prompt:
+            return _error(400, "Feld 'prompt' fehlt.")
+        model_name = str(form.get("model") or config["model"])
+        try:
+            params = _sampling_params(form, state.defaults)
+        except ValueError as e:
+            return _error(400, str(e))
+        uploads = [(upload.filename or f"image_{index}", await upload.read())
+                   for index, upload in enumerate(form.getlist("images"), start=1) if not isinstance(upload, str)]
+
+    trace = Trace("server_generate", {"model": model_name, "images": len(uploads)}, exporter=state.trace_exporter)
+    status = "error"
+    try:
+        # Header lesen, Budget prüfen und vorverarbeiten blockiert die Event-Loop nicht
+        def prepare() -> dict:
+            entries = [ingest_image(data, name, state.ingest_budget) for name, data in uploads]
+            return prepare_contents(prompt, entries, state.preprocessing, state.preprocessing_cache, trace)
+
+        prepared = await run_in_threadpool(prepare)
+        if prepared["skipped"]:
+            return _error(422, "; ".join(prepared["skipped"]))
+
+        # Treffer nur für denselben Key: ein ungültiger Key darf keine Antwort eines gültigen erhalten
+        cache_key = build_cache_key(model_name, prompt, prepared["input_images"], params, api_key_id(api_key))
+        response = state.response_cache.get(cache_key)
+        cached = response is not None
+        trace.annotate(cache_hit=cached)
+        if response is None:
+            client = state.clients.get(api_key)
+            # Anlegen oder Verlängern des Context Caches ist ein synchroner API-Aufruf
+            context = await run_in_threadpool(apply_context_cache, prepared, client, model_name,
+                                              state.context_cache, api_key_id(api_key), trace)
+            # Ein Context Cache gilt nur für sein eigenes Modell
+            fallback_models = [] if context["cached_content"] else fallback_chain(
+                model_name, state.models, state.max_fallbacks)
+            error_messages = []
+            with trace.span("api_call"):
+                response = await generate_content_with_retry_async(
+                    client=client,
+                    model_name=model_name,
+                    contents=context["contents"],
+                    config=build_generation_config(params, cached_content=context["cached_content"]),
+                    max_retries=state.max_retries,
+                    base_wait_time=state.base_wait_time,
+                    on_warning=logger.warning,
+                    on_error=error_messages.append,
+                    coalesce_key=cache_key,
+                    scheduler=state.scheduler,
+                    scheduler_key=api_key_id(api_key),
+                    trace=trace,
+                    policy=state.retry_policy,
+                    breakers=state.breakers,
+                    fallback_models=fallback_models
+                )
+            if response is None or not response.candidates:
+                if context["cached_content"]:
+                    state.context_cache.invalidate(context["key"])
+                status_code = ERROR_STATUS.get(trace.root["attributes"].get("error_class"), 502)
+                headers = None
+                if status_code == 503:
+                    headers = {"Retry-After": str(max(RETRY_AFTER_SECONDS, round(state.breakers.retry_in(model_name))))}
+                return _error(status_code, error_messages[-1] if error_messages
+                              else "Keine gültige Antwort von der API erhalten.", headers=headers)
+            served_model = trace.root["attributes"].get("fallback_model", model_name)
+            # Antworten eines Ausweichmodells gehören nicht unter den Schlüssel des angefragten Modells
+            if served_model == model_name:
+                state.response_cache.put(cache_key, response)
+            model_name = served_model
+        status = "ok"
+    finally:
+        trace.finish(status=status)
+
+    parsed = parse_response(response)
+    images = [image for image in parsed["images"] if image["mime_type"]]
+    headers = {"X-Model": model_name, "X-Cache": "hit" if cached else "miss"}
+    if "image/" in request.headers.get("accept", ""):
+        if not images:
+            return _error(404, "Die Antwort enthält kein Bild.", headers=headers)
+        # Originalbytes ohne Dekodierung oder Base64
+        return Response(images[0]["data"], media_type=images[0]["mime_type"], headers=headers)
+    return JSONResponse({
+        "model": model_name,
+        "text": parsed["text"],
+        "images": [{"mime_type": image["mime_type"], "candidate": image["candidate"],
+                    "data": base64.b64encode(image["data"]).decode("ascii")} for image in images],
+        "finish_reasons": parsed["finish_reasons"],
+        "total_tokens": parsed["total_tokens"],
+        "cached": cached,
+        "duration_ms": round(trace.duration_ms(), 1)
+    }, headers=headers)
+
+
+async def healthz(request: Request) -> Response:
+    state = request.app.state
+    return JSONResponse({
+        "status": "ok",
+        "admission": state.limiter.stats(),
+        "clients": state.clients.stats(),
+        "response_cache": state.response_cache.stats(),
+        "context_cache": state.context_cache.stats() if state.context_cache is not None else None,
+        "rate_limiter": state.scheduler.stats(),
+        "circuit_breaker": state.breakers.stats() if state.breakers is not None else None,
+        "retries": retry_stats()
+    })
+
+
+async def metrics(request: Request) -> Response:
+    return PlainTextResponse(METRICS.to_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+def create_app(api_config: dict | None = None, rate_limits: dict | None = None,
+               default_api_key: str | None = None, models: list[str] | None = None) -> Starlette:
+    """
+    Erstellt die ASGI-Anwendung mit allen prozessweiten Objekten: Client-Pool,
+    Rate-Limiter, Circuit Breaker, Antwort- und Vorverarbeitungs-Cache und
+    Admission-Limiter.
+
+    Parameter:
+      api_config: Inhalt der api_config.json (Abschnitt "server" für den Server selbst).
+      rate_limits: Rate-Limits je Modell aus models.json.
+      default_api_key: API-Key für Anfragen ohne Header x-goog-api-key.
+      models: Modellliste aus models.json; ihre Reihenfolge bestimmt die Ausweichmodelle.
+    """
+    api_config = api_config or {}
+    config = {**DEFAULT_SERVER_CONFIG, **api_config.get("server", {})}
+    metrics_config = {**DEFAULT_METRICS_CONFIG, **api_config.get("metrics", {})}
+    app = Starlette(routes=[
+        Route("/v1/generate", generate, methods=["POST"]),
+        Route("/healthz", healthz, methods=["GET"]),
+        Route("/metrics", metrics, methods=["GET"]),
+    ])
+    app.state.config = config
+    app.state.default_api_key = default_api_key
+    app.state.defaults = {name: api_config.get(name) for name in SAMPLING_PARAMS}
+    app.state.max_retries = api_config.get("max_retries", DEFAULT_MAX_RETRIES)
+    app.state.base_wait_time = api_config.get("base_wait_time", DEFAULT_BASE_WAIT_TIME)
+    app.state.retry_policy = RetryPolicy.from_config(api_config.get("retry", {}), app.state.max_retries,
+                                                     app.state.base_wait_time)
+    breaker_config = {**DEFAULT_CIRCUIT_BREAKER_CONFIG, **api_config.get("circuit_breaker", {})}
+    app.state.breakers = (CircuitBreakerRegistry.from_config(breaker_config)
+                          if breaker_config["enabled"] else None)
+    app.state.models = models or []
+    app.state.max_fallbacks = breaker_config["max_fallbacks"] if app.state.breakers is not None else 0
+    app.state.ingest_budget = {**DEFAULT_INGEST_BUDGET, **api_config.get("image_ingest", {})}
+    app.state.preprocessing = api_config.get("image_preprocessing", {})
+    app.state.clients = ClientPool(config["client_pool_size"])
+    app.state.limiter = AdmissionLimiter(config["max_concurrency"], config["max_queue"], config["queue_timeout"])
+    app.state.scheduler = RateLimitScheduler(rate_limits)
+    app.state.response_cache = ResponseCache.from_config(api_config.get("response_cache", {}))
+    app.state.preprocessing_cache = PreprocessingCache()
+    context_cache_config = api_config.get("context_cache", {})
+    app.state.context_cache = (ContextCacheRegistry.from_config(context_cache_config)
+                               if context_cache_config.get("enabled", True) else None)
+    app.state.trace_exporter = (OTelJsonExporter(metrics_config["otel_log_path"])
+                                if metrics_config["otel_log_enabled"] else None)
+    return app
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=None, help="Adresse, an die der Server gebunden wird.")
+    parser.add_argument("--port", type=int, default=None, help="Port des Servers.")
+    parser.add_argument("--config", default=os.path.join("config", "api_config.json"), help="Pfad zur API-Konfiguration.")
+    parser.add_argument("--models-config", default=os.path.join("config", "models.json"),
+                        help="Pfad zur Modellkonfiguration mit den Rate-Limits.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    config_store = ConfigStore(watch=False)
+    try:
+        api_config = config_store.load(args.config, API_CONFIG_SCHEMA)
+    except (FileNotFoundError, json.JSONDecodeError, ConfigValidationError) as e:
+        logger.warning("API-Konfiguration wird nicht verwendet: %s", e)
+        api_config = {}
+    try:
+        models_config = config_store.load(args.models_config, MODELS_SCHEMA)
+    except (FileNotFoundError, json.JSONDecodeError, ConfigValidationError) as e:
+        logger.warning("Rate-Limits und Ausweichmodelle werden nicht verwendet: %s", e)
+        models_config = {}
+
+    app = create_app(api_config, models_config.get("rate_limits", {}), default_api_key=os.environ.get("GENAI_API_KEY"),
+                     models=models_config.get("models", []))
+    config = app.state.config
+    uvicorn.run(app, host=args.host or config["host"], port=args.port or config["port"], log_level="info")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,32 @@
+from __future__ import annotations
+
 import streamlit as st
-from google import genai
-from google.genai import types
-from PIL import Image, UnidentifiedImageError, ImageFile
-from io import BytesIO
 import json
-import re  # Für die Validierung des API-Key-Formats
+import hashlib  # Für den Hash des API-Keys bei der Validierung
 import time  # Für Exponential Backoff bei Wiederholungsversuchen
 import os  # Für den Zugriff auf Umgebungsvariablen
+import sqlite3  # Für Fehler beim Schreiben des Verlaufs
+from typing import TYPE_CHECKING
+from response_cache import ResponseCache, build_cache_key
+from generation import (DEFAULT_MAX_RETRIES, DEFAULT_BASE_WAIT_TIME, coalescing_stats, generate_content_with_retry,
+                        generate_content_stream_with_retry, generate_fan_out, retry_stats)
+from batch import DEFAULT_CONCURRENCY, DEFAULT_OUTPUT_DIR, DEFAULT_ROOT_DIR, parse_manifest, resolve_within, run_batch
+from rate_limiter import RateLimitScheduler, api_key_id
+from image_preprocessing import PreprocessingCache
+from metrics import DEFAULT_METRICS_CONFIG, METRICS, OTelJsonExporter, Trace, start_prometheus_server
+from history_store import DEFAULT_HISTORY_CONFIG, HistoryStore
+from image_output import extension_for, inline_image, output_images, zip_bytes
+from context_cache import ContextCacheRegistry
+from retry_policy import (DEFAULT_CIRCUIT_BREAKER_CONFIG, RETRYABLE_ERRORS, CircuitBreakerRegistry, RetryPolicy,
+                          classify_error, fallback_chain)
+from pipeline import apply_context_cache, build_generation_config, ingest_image, parse_response, prepare_contents
+from config_store import (CONFIG_STORE, API_CONFIG_SCHEMA, MODELS_SCHEMA, PROMPTS_SCHEMA, THEMES_SCHEMA,
+                          ConfigValidationError)
+
+# Das SDK (google.genai) und PIL werden erst bei der ersten Verwendung geladen
+if TYPE_CHECKING:
+    from google import genai
+    from google.genai import types
 
 # Theming: Konfiguriere das Layout der Streamlit-App
 st.set_page_config(layout="wide")
@@ -26,10 +46,29 @@ EXAMPLE_PROMPTS_FALLBACK = [
     "Schreibe eine kurze Geschichte über die beiden Bilder."
 ]
 
-# Standardwerte für Wiederholungsversuche und Cache TTL
-DEFAULT_MAX_RETRIES = 3
-DEFAULT_BASE_WAIT_TIME = 1
+# Standardwerte für Cache TTL (Standardwerte für Wiederholungsversuche siehe generation.py)
 DEFAULT_CACHE_TTL = 3600  # in Sekunden
+DEFAULT_KEY_VALIDATION_TTL = 600  # in Sekunden
+
+# Standardwerte, falls die API-Konfiguration fehlt oder ungültig ist
+API_CONFIG_FALLBACK = {
+    "temperature": 0.7,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 1024,
+    "max_retries": DEFAULT_MAX_RETRIES,
+    "base_wait_time": DEFAULT_BASE_WAIT_TIME,
+    "cache_ttl": DEFAULT_CACHE_TTL,
+    "key_validation_ttl": DEFAULT_KEY_VALIDATION_TTL,
+    "streaming": True
+}
+
+# Fan-out: maximale Kandidaten pro Modell und Spalten im Ergebnisraster
+MAX_CANDIDATES = 4
+FAN_OUT_COLUMNS = 3
+
+# Anzahl der Anfragen, deren Latenzen pro Sitzung für den Debug-Modus gemerkt werden
+MAX_LATENCY_HISTORY = 20
 
 # Schwellwert für die Anzeige des Spinners (in Sekunden)
 SPINNER_THRESHOLD = 0.5
@@ -41,15 +80,28 @@ def load_models_from_config(config_file: str) -> list[str]:
     werden Standardmodelle zurückgegeben.
     """
     try:
-        with open(config_file, 'r') as f:
-            data = json.load(f)
-            return data.get('models', [])
+        data = CONFIG_STORE.load(config_file, MODELS_SCHEMA)
+        return data.get('models', [])
     except FileNotFoundError:
         st.warning(f"Konfigurationsdatei {config_file} nicht gefunden. Verwende Standardmodelle.")
         return ["gemini-2.0-flash-exp", "gemini-1.5-pro-001"]
     except json.JSONDecodeError:
         st.error(f"Fehler beim Lesen der JSON-Datei {config_file}. Bitte überprüfe das Format.")
         return ["gemini-2.0-flash-exp", "gemini-1.5-pro-001"]
+    except ConfigValidationError as e:
+        st.error(f"Ungültige Konfiguration in {config_file}: {'; '.join(e.errors)}")
+        return ["gemini-2.0-flash-exp", "gemini-1.5-pro-001"]
+
+def load_rate_limits_from_config(config_file: str) -> dict:
+    """
+    Lädt die Rate-Limits (Requests und Tokens pro Minute) je Modell aus der
+    Modellkonfiguration. Im Fehlerfall gelten die Standardgrenzen des Schedulers.
+    """
+    try:
+        data = CONFIG_STORE.load(config_file, MODELS_SCHEMA)
+        return data.get('rate_limits', {})
+    except (FileNotFoundError, json.JSONDecodeError, ConfigValidationError):
+        return {}
 
 def load_prompts_from_config(config_file: str) -> list[str]:
     """
@@ -57,15 +109,17 @@ def load_prompts_from_config(config_file: str) -> list[str]:
     Im Fehlerfall werden Fallback-Prompts genutzt.
     """
     try:
-        with open(config_file, 'r') as f:
-            data = json.load(f)
-            return data.get('prompts', [])
+        data = CONFIG_STORE.load(config_file, PROMPTS_SCHEMA)
+        return data.get('prompts', [])
     except FileNotFoundError:
         st.warning(f"Konfigurationsdatei {config_file} nicht gefunden. Verwende Standardprompts.")
         return EXAMPLE_PROMPTS_FALLBACK
     except json.JSONDecodeError:
         st.error(f"Fehler beim Lesen der JSON-Datei {config_file}. Bitte überprüfe das Format.")
         return EXAMPLE_PROMPTS_FALLBACK
+    except ConfigValidationError as e:
+        st.error(f"Ungültige Konfiguration in {config_file}: {'; '.join(e.errors)}")
+        return EXAMPLE_PROMPTS_FALLBACK
 
 def load_api_config(config_file: str) -> dict:
     """
@@ -73,31 +127,16 @@ def load_api_config(config_file: str) -> dict:
     Gibt im Fehlerfall Standardwerte zurück.
     """
     try:
-        with open(config_file, 'r') as f:
-            data = json.load(f)
-            return data
+        return CONFIG_STORE.load(config_file, API_CONFIG_SCHEMA)
     except FileNotFoundError:
         st.warning(f"Konfigurationsdatei {config_file} nicht gefunden. Verwende Standardwerte.")
-        return {
-            "temperature": 0.7,
-            "top_p": 0.95,
-            "top_k": 40,
-            "max_output_tokens": 1024,
-            "max_retries": DEFAULT_MAX_RETRIES,
-            "base_wait_time": DEFAULT_BASE_WAIT_TIME,
-            "cache_ttl": DEFAULT_CACHE_TTL
-        }
+        return API_CONFIG_FALLBACK
     except json.JSONDecodeError:
         st.error(f"Fehler beim Lesen der JSON-Datei {config_file}. Bitte überprüfe das Format.")
-        return {
-            "temperature": 0.7,
-            "top_p": 0.95,
-            "top_k": 40,
-            "max_output_tokens": 1024,
-            "max_retries": DEFAULT_MAX_RETRIES,
-            "base_wait_time": DEFAULT_BASE_WAIT_TIME,
-            "cache_ttl": DEFAULT_CACHE_TTL
-        }
+        return API_CONFIG_FALLBACK
+    except ConfigValidationError as e:
+        st.error(f"Ungültige Konfiguration in {config_file}: {'; '.join(e.errors)}")
+        return API_CONFIG_FALLBACK
 
 def load_themes_from_config(config_file: str) -> dict:
     """
@@ -105,120 +144,255 @@ def load_themes_from_config(config_file: str) -> dict:
     Im Fehlerfall wird ein leeres Dictionary zurückgegeben.
     """
     try:
-        with open(config_file, 'r') as f:
-            data = json.load(f)
-            return data.get('themes', {})
+        data = CONFIG_STORE.load(config_file, THEMES_SCHEMA)
+        return data.get('themes', {})
     except FileNotFoundError:
         st.warning(f"Konfigurationsdatei {config_file} nicht gefunden. Verwende Standard-Themes.")
         return {}
     except json.JSONDecodeError:
         st.error(f"Fehler beim Lesen der JSON-Datei {config_file}. Bitte überprüfe das Format.")
         return {}
+    except ConfigValidationError as e:
+        st.error(f"Ungültige Konfiguration in {config_file}: {'; '.join(e.errors)}")
+        return {}
+
+def cache_ttl(name: str, default: float) -> float:
+    """
+    Liest eine Cache-Gültigkeitsdauer beim Aufruf aus der API-Konfiguration
+    statt beim Import der App. Änderungen wirken daher ohne Neustart.
+    """
+    return load_api_config(API_CONFIG_FILE).get(name, default)
+
+@st.cache_resource
+def create_genai_client(api_key: str) -> dict:
+    """
+    Erstellt und cached den Google GenAI-Client zusammen mit seiner
+    Erstellungszeit. Das SDK wird erst hier importiert.
+    """
+    from google import genai
+
+    return {"client": genai.Client(api_key=api_key), "created_at": time.monotonic()}
 
-@st.cache_resource(ttl=load_api_config(API_CONFIG_FILE).get("cache_ttl", DEFAULT_CACHE_TTL))
 def get_genai_client(api_key: str) -> genai.Client:
     """
-    Initialisiert und cached den Google GenAI-Client.
-    Hierbei wird der Client direkt mit dem API-Key initialisiert. Es wird
-    ein kleiner Testaufruf durchgeführt, um sicherzustellen, dass der Client funktioniert.
+    Liefert den gecachten Google GenAI-Client; nach "cache_ttl" Sekunden wird
+    er neu erstellt. Die Erstellung des Clients löst keinen API-Aufruf aus;
+    die Prüfung des API-Keys erfolgt getrennt in validate_api_key.
     """
-    client = genai.Client(api_key=api_key)
-    client.models.generate_content(
-        model="gemini-2.0-flash-exp",
-        contents=["Erstelle eine futuristische Stadt."],
-        config=types.GenerateContentConfig(response_modalities=['Text', 'Image'])
-    )
-    return client
+    entry = create_genai_client(api_key)
+    if time.monotonic() - entry["created_at"] > cache_ttl("cache_ttl", DEFAULT_CACHE_TTL):
+        create_genai_client.clear(api_key)
+        entry = create_genai_client(api_key)
+    return entry["client"]
+
+@st.cache_resource
+def get_response_cache() -> ResponseCache:
+    """
+    Erstellt den prozessweiten Antwort-Cache.
+    Die Grenzen für Speicher- und Festplattenstufe stammen aus dem Abschnitt
+    "response_cache" der API-Konfiguration.
+    """
+    return ResponseCache.from_config(load_api_config(API_CONFIG_FILE).get("response_cache", {}))
+
+@st.cache_resource
+def get_context_cache() -> ContextCacheRegistry | None:
+    """
+    Erstellt die prozessweite Registry für das Context Caching der API
+    (Abschnitt "context_cache" der API-Konfiguration).
+
+    Rückgabe:
+      Die Registry oder None, wenn das Context Caching deaktiviert ist.
+    """
+    config = load_api_config(API_CONFIG_FILE).get("context_cache", {})
+    if not config.get("enabled", True):
+        return None
+    return ContextCacheRegistry.from_config(config)
+
+@st.cache_resource
+def get_circuit_breakers() -> CircuitBreakerRegistry | None:
+    """
+    Erstellt die prozessweiten Circuit Breaker je Modell (Abschnitt
+    "circuit_breaker" der API-Konfiguration), damit alle Sitzungen ein
+    gestörtes Modell gemeinsam erkennen.
+
+    Rückgabe:
+      Die Registry oder None, wenn der Circuit Breaker deaktiviert ist.
+    """
+    config = load_api_config(API_CONFIG_FILE).get("circuit_breaker", {})
+    if not config.get("enabled", True):
+        return None
+    return CircuitBreakerRegistry.from_config(config)
+
+@st.cache_data(show_spinner=False)
+def probe_api_key(key_hash: str, _api_key: str) -> dict:
+    """
+    Prüft den API-Key mit einer günstigen Metadaten-Abfrage (Modellliste mit
+    nur einem Eintrag) statt mit einem kostenpflichtigen Generierungsaufruf.
+
+    Das Ergebnis wird pro Key-Hash gemerkt; validate_api_key verwirft es nach
+    "key_validation_ttl" Sekunden. Der Key selbst fließt wegen des führenden
+    Unterstrichs nicht in den Cache-Schlüssel ein. Vorübergehende Fehler
+    (z.B. 5xx oder Netzwerkfehler) werden als Ausnahme weitergereicht und
+    daher nicht gemerkt.
+
+    Rückgabe:
+      Dictionary mit error (None, wenn der Key gültig ist, ansonsten die
+      Fehlermeldung der API) und checked_at (Zeitpunkt der Prüfung).
+    """
+    from google.genai import errors
+
+    client = get_genai_client(_api_key)
+    try:
+        client.models.list(config={"page_size": 1})
+        return {"error": None, "checked_at": time.time()}
+    except errors.ClientError as e:
+        if e.code in (400, 401, 403):
+            return {"error": str(e), "checked_at": time.time()}
+        raise
+
+@st.cache_resource
+def get_preprocessing_cache() -> PreprocessingCache:
+    """
+    Erstellt den prozessweiten Cache für vorverarbeitete Bilder, damit
+    dieselben Uploads bei erneuten Klicks nicht wieder verkleinert und
+    kodiert werden müssen.
+    """
+    return PreprocessingCache()
+
+@st.cache_resource
+def get_history_store() -> HistoryStore | None:
+    """
+    Öffnet den prozessweiten persistenten Verlauf, falls er in api_config.json aktiviert ist.
+    """
+    history_config = {**DEFAULT_HISTORY_CONFIG, **load_api_config(API_CONFIG_FILE).get("history", {})}
+    if not history_config["enabled"]:
+        return None
+    return HistoryStore.from_config(history_config)
+
+@st.cache_resource
+def get_trace_exporter() -> OTelJsonExporter | None:
+    """
+    Erstellt den prozessweiten Exporter für Traces im OTLP/JSON-Format,
+    falls er in api_config.json aktiviert ist.
+    """
+    metrics_config = {**DEFAULT_METRICS_CONFIG, **load_api_config(API_CONFIG_FILE).get("metrics", {})}
+    if not metrics_config["otel_log_enabled"]:
+        return None
+    return OTelJsonExporter(metrics_config["otel_log_path"])
+
+@st.cache_resource
+def start_metrics_endpoint():
+    """
+    Startet einmal pro Prozess den lokalen Prometheus-Endpunkt /metrics,
+    falls er in api_config.json aktiviert ist.
+    """
+    metrics_config = {**DEFAULT_METRICS_CONFIG, **load_api_config(API_CONFIG_FILE).get("metrics", {})}
+    if not metrics_config["prometheus_enabled"]:
+        return None
+    return start_prometheus_server(METRICS, metrics_config["prometheus_host"], metrics_config["prometheus_port"])
+
+@st.cache_resource
+def get_rate_limit_scheduler() -> RateLimitScheduler:
+    """
+    Erstellt den prozessweiten Scheduler, den sich alle Streamlit-Sitzungen
+    teilen. Die Limits je Modell stammen aus dem Abschnitt "rate_limits" der
+    Modellkonfiguration.
+    """
+    return RateLimitScheduler(load_rate_limits_from_config(MODEL_CONFIG_FILE))
 
 def validate_api_key(api_key: str) -> bool:
     """
-    Validiert den API-Key durch einen minimalen API-Aufruf.
+    Validiert den API-Key durch eine leichtgewichtige Metadaten-Abfrage.
     Nutzt strukturelles Pattern Matching (PEP 634) zur Auswertung der Fehlermeldung.
+    Scheitert die Abfrage nur vorübergehend (Kontingent, Serverfehler,
+    Zeitüberschreitung; siehe retry_policy.classify_error), wird gewarnt und
+    der Key nicht als ungültig gemeldet.
     
     Rückgabe:
-      True, wenn der API-Key gültig ist, ansonsten False.
+      True, wenn der API-Key gültig ist oder nicht geprüft werden konnte, ansonsten False.
     """
+    key_hash = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
     try:
-        client = get_genai_client(api_key)
-        client.models.generate_content(
-            model="gemini-2.0-flash-exp",
-            contents=["Test API Key"],
-            config=types.GenerateContentConfig(response_modalities=['Text', 'Image'])
-        )
-        return True
+        result = probe_api_key(key_hash, api_key)
+        if time.time() - result["checked_at"] > cache_ttl("key_validation_ttl", DEFAULT_KEY_VALIDATION_TTL):
+            probe_api_key.clear(key_hash, api_key)
+            result = probe_api_key(key_hash, api_key)
+        error_message = result["error"]
     except Exception as e:
+        if classify_error(e) in RETRYABLE_ERRORS:
+            st.warning(f"Validierung vorübergehend nicht möglich ({e}). Die Anfrage wird trotzdem gesendet.")
+            return True
         error_message = str(e)
-        match error_message:
-            case msg if "401" in msg:
-                st.error("API Key ist ungültig: Autorisierung fehlgeschlagen (401). Bitte überprüfe deinen API Key.")
-            case msg if "403" in msg:
-                st.error("API Key ist ungültig: Zugriff verboten (403). Dein API Key hat möglicherweise keine Berechtigung für diese Ressource.")
-            case _:
-                st.error(f"API Key ist ungültig: {error_message}")
-        return False
-
-def generate_content_with_retry(client: genai.Client, model_name: str, contents: list, config: types.GenerateContentConfig,
-                                max_retries: int, base_wait_time: int) -> types.GenerateContentResponse | None:
-    """
-    Generiert Inhalte unter Verwendung von Wiederholungsversuchen (Exponential Backoff).
-    
+    if error_message is None:
+        return True
+    match error_message:
+        case msg if "401" in msg:
+            st.error("API Key ist ungültig: Autorisierung fehlgeschlagen (401). Bitte überprüfe deinen API Key.")
+        case msg if "403" in msg:
+            st.error("API Key ist ungültig: Zugriff verboten (403). Dein API Key hat möglicherweise keine Berechtigung für diese Ressource.")
+        case _:
+            st.error(f"API Key ist ungültig: {error_message}")
+    return False
+
+def ingest_uploaded_file(uploaded_file, budget: dict) -> dict:
+    """
+    Liest ein hochgeladenes Bild genau einmal pro Sitzung ein.
+
+    Das Ergebnis (Rohdaten, Inhalts-Hash und Header-Informationen) wird im
+    Session State unter der file_id des Uploads gemerkt, sodass Reruns
+    (z.B. durch Schieberegler) die Datei weder erneut lesen noch öffnen.
+    Byte- und Pixelbudget werden geprüft, bevor Pixeldaten dekodiert werden.
+
     Parameter:
-      client: Der initialisierte GenAI-Client.
-      model_name: Der Name des zu verwendenden Modells.
-      contents: Liste der Inhalte (Text und ggf. Bilder).
-      config: Konfigurationseinstellungen für die API-Anfrage.
-      max_retries: Maximale Anzahl der Wiederholungsversuche bei einem Fehler.
-      base_wait_time: Basiswartezeit vor dem nächsten Versuch.
-    
+      uploaded_file: Das hochgeladene Bild (Dateiobjekt).
+      budget: Budget mit "max_bytes" und "max_pixels" (siehe image_ingest).
+
     Rückgabe:
-      Die API-Antwort, oder None, wenn alle Versuche fehlschlagen.
+      Dictionary aus pipeline.ingest_image (mit "error" bei Fehlern).
     """
-    for attempt in range(max_retries):
-        try:
-            response = client.models.generate_content(
-                model=model_name,
-                contents=contents,
-                config=config
-            )
-            return response  # Erfolgreiche Antwort
-        except Exception as e:
-            if attempt < max_retries - 1:
-                wait_time = base_wait_time * (2 ** attempt)
-                st.warning(f"API-Aufruf fehlgeschlagen (Versuch {attempt + 1}/{max_retries}). Wiederhole in {wait_time:.2f} Sekunden...")
-                time.sleep(wait_time)
-            else:
-                st.error(f"API-Aufruf ist nach {max_retries} Versuchen fehlgeschlagen: {str(e)}")
-                return None
-    return None
+    ingested = st.session_state.setdefault("ingested_images", {})
+    entry = ingested.get(uploaded_file.file_id)
+    if entry is not None:
+        return entry
+    entry = ingest_image(uploaded_file.getvalue(), uploaded_file.name, budget)
+    ingested[uploaded_file.file_id] = entry
+    return entry
+
+def prune_ingested_images(active_file_ids: list[str]) -> None:
+    """
+    Entfernt eingelesene Bilder aus dem Session State, die nicht mehr hochgeladen sind.
+    """
+    ingested = st.session_state.get("ingested_images", {})
+    for file_id in list(ingested):
+        if file_id not in active_file_ids:
+            del ingested[file_id]
 
-def display_image_metadata(uploaded_file, image_number: int) -> None:
+def display_image_metadata(image_entry: dict | None, image_number: int) -> None:
     """
     Zeigt die Metadaten eines hochgeladenen Bildes an.
+    Die Angaben stammen aus dem bereits eingelesenen Header (siehe ingest_uploaded_file).
     
     Parameter:
-      uploaded_file: Das hochgeladene Bild (Dateiobjekt).
+      image_entry: Das eingelesene Bild oder None, wenn kein Bild hochgeladen wurde.
       image_number: Die Bildnummer zur Kennzeichnung.
     """
-    if uploaded_file:
-        try:
-            image = Image.open(uploaded_file)
-            st.write(f"Bild {image_number}:")
-            st.write(f"- Größe: {image.size}")
-            st.write(f"- Format: {image.format}")
-        except FileNotFoundError:
-            st.error("Datei nicht gefunden.")
-        except UnidentifiedImageError as e:
-            st.error(f"Ungültiges Bildformat: {e}")
-        except ImageFile.DecompressionBombError:
-            st.error("Das Bild ist zu groß und kann nicht verarbeitet werden.")
-        except Exception as e:
-            st.exception(e)
-            st.error(f"Fehler beim Anzeigen der Metadaten von Bild {image_number}: {str(e)}")
+    if image_entry:
+        if "error" in image_entry:
+            st.error(f"Bild {image_number}: {image_entry['error']}")
+            return
+        st.write(f"Bild {image_number}:")
+        st.write(f"- Größe: {image_entry['size']}")
+        st.write(f"- Format: {image_entry['format']}")
     else:
         st.write(f"Bild {image_number}: Kein Bild hochgeladen.")
 
-def apply_theme() -> None:
-    available_themes = load_themes_from_config(THEME_CONFIG_FILE)
+def apply_theme(available_themes: dict) -> None:
+    """
+    Wendet das ausgewählte Theme per CSS an.
+
+    Parameter:
+      available_themes: Die bereits geladenen Themes (siehe load_themes_from_config).
+    """
     selected_theme = st.session_state.get("selected_theme", "")
     if selected_theme and selected_theme in available_themes:
         theme = available_themes[selected_theme]
@@ -243,58 +417,311 @@ def apply_theme() -> None:
 
 
 
-def main() -> None:
+def finish_trace(trace: Trace, status: str) -> None:
     """
-    Hauptfunktion der Streamlit-App.
-    
-    Steuert den Ablauf der Anwendung:
-      - Laden der Konfigurationsdateien
-      - Auswahl von Themes, Modellen und Prompts
-      - Upload von Bildern und Texteingabe
-      - Validierung des API-Keys und Aufruf der API zur Generierung von Inhalten
-      - Anzeige der Ergebnisse und Downloadoption für generierte Bilder
+    Schließt den Trace einer Anfrage ab und merkt sich die Aufschlüsselung
+    der Latenzen für die Debug-Anzeige dieser Sitzung.
     """
-    # Theme-Auswahl: Überprüfe, ob bereits ein Theme im Session State existiert
-    if "selected_theme" not in st.session_state:
-        st.session_state["selected_theme"] = ""
+    trace.finish(status=status)
+    history = st.session_state.setdefault("latency_history", [])
+    history.append({"status": status, "attributes": dict(trace.root["attributes"]), "spans": trace.breakdown()})
+    del history[:-MAX_LATENCY_HISTORY]
 
-    # Lade Themes und erzeuge eine Selectbox zur Auswahl
-    available_themes = load_themes_from_config(THEME_CONFIG_FILE)
-    theme_options = [""] + list(available_themes.keys())
-    new_theme = st.selectbox(
-        "Theme auswählen:",
-        options=theme_options,
-        index=theme_options.index(st.session_state.get("selected_theme", "")) if st.session_state.get("selected_theme", "") in theme_options else 0,
-        help="Wähle ein Theme aus, um das Erscheinungsbild der App zu ändern."
-    )
-    if new_theme != st.session_state.get("selected_theme", ""):
-        st.session_state["selected_theme"] = new_theme
-        st.rerun()  # Seite neu laden, damit das CSS wirksam wird
-    apply_theme()
+def record_history(api_key: str, model_name: str, prompt: str, params: dict, input_hashes: list[str],
+                   response: types.GenerateContentResponse | None, status: str,
+                   duration_ms: float | None, ttft_ms: float | None = None,
+                   total_tokens: int | None = None) -> None:
+    """
+    Speichert eine abgeschlossene Generierung im persistenten Verlauf und
+    merkt sich ihre id in der Sitzung. Bei mehreren Kandidaten werden die
+    Ausgaben aller Kandidaten gespeichert. Der Eintrag gehört dem API-Key,
+    mit dem generiert wurde, und ist nur mit diesem Key sichtbar.
+    """
+    history = get_history_store()
+    if history is None or status == "invalid_key":
+        return
+    parsed = parse_response(response)
+    try:
+        generation_id = history.record(
+            owner=api_key_id(api_key),
+            model=model_name,
+            prompt=prompt,
+            params=params,
+            input_hashes=input_hashes,
+            output_text=parsed["text"],
+            images=[(image["data"], image["mime_type"]) for image in parsed["images"] if image["mime_type"]],
+            status=status,
+            duration_ms=duration_ms,
+            ttft_ms=ttft_ms,
+            total_tokens=total_tokens
+        )
+    except (sqlite3.Error, OSError) as e:
+        st.warning(f"Die Generierung konnte nicht im Verlauf gespeichert werden: {e}")
+        return
+    st.session_state["last_generation_id"] = generation_id
 
-    st.title("Google GenAI Streamlit App")
-    st.write("Erstelle Inhalte basierend auf einem Textprompt und optional zwei Bildern.")
+def zip_download_button(label: str, entries, file_name: str, key: str) -> None:
+    """
+    Download-Button für mehrere Dateien als ZIP. Das Archiv wird erst beim
+    Klick erstellt (siehe image_output.zip_bytes). Streamlit hält die Daten
+    eines Downloads vollständig im Speicher, daher entsteht auch das Archiv
+    direkt im Speicher statt in einer temporären Datei.
 
-    # Initialisiere die Prompt-Historie im Session State
-    if 'prompt_history' not in st.session_state:
-        st.session_state.prompt_history = []
+    Parameter:
+      label: Beschriftung des Buttons.
+      entries: Funktion ohne Parameter, die die Einträge (Name, Bytes oder Dateipfad) liefert.
+      file_name: Name des Archivs.
+      key: Widget-Key.
+    """
+    st.download_button(label=label, data=lambda: zip_bytes(entries()), file_name=file_name,
+                       mime="application/zip", key=key, on_click="ignore")
 
-    # API-Key-Verwaltung: Möglichkeit, den API-Key aus Streamlit Secrets zu verwenden
-    use_secrets = st.checkbox("API Key aus Streamlit Secrets verwenden", value=False,
-                              help="Verwende den API Key, der sicher in Streamlit Secrets gespeichert ist.")
-    if use_secrets:
-        try:
-            api_key = st.secrets["GENAI_API_KEY"]
-        except KeyError:
-            st.error("API Key nicht in Streamlit Secrets gefunden. Bitte konfiguriere den API Key in der Streamlit Cloud.")
-            return
-    else:
-        api_key = st.text_input("API Key eingeben:", type="password",
-                                help="Bitte gib deinen Google GenAI API Key ein.")
+def display_image_downloads(images: list[dict], file_prefix: str, key_prefix: str) -> None:
+    """
+    Zeigt je Bild einen Download-Button mit dem tatsächlichen MIME-Typ und bei
+    mehreren Bildern zusätzlich einen Button für alle Bilder als ZIP.
 
-    # Debug-Modus für detaillierte Fehlerausgabe
-    debug_mode = st.checkbox("Debug-Modus aktivieren", help="Aktiviere den Debug-Modus, um zusätzliche Informationen für die Fehleranalyse anzuzeigen.")
+    Parameter:
+      images: Bilder mit data und mime_type (siehe image_output.output_images).
+      file_prefix: Präfix der Dateinamen.
+      key_prefix: Präfix für die Widget-Keys.
+    """
+    names = [f"{file_prefix}_{number}{extension_for(image['mime_type'])}" for number, image in enumerate(images, start=1)]
+    for number, (name, image) in enumerate(zip(names, images), start=1):
+        st.download_button(
+            label="Generiertes Bild herunterladen" if len(images) == 1 else f"Bild {number} herunterladen",
+            data=image["data"],
+            file_name=name,
+            mime=image["mime_type"],
+            key=f"{key_prefix}_download_{number}",
+            help="Lade das generierte Bild herunter."
+        )
+    if len(images) > 1:
+        zip_download_button("Alle Bilder als ZIP herunterladen",
+                            lambda: [(name, image["data"]) for name, image in zip(names, images)],
+                            f"{file_prefix}.zip", f"{key_prefix}_download_zip")
+
+def display_history_entry(history: HistoryStore, entry: dict, key_prefix: str) -> None:
+    """
+    Zeigt einen Verlaufseintrag vollständig an: Text, Bilder in voller Größe
+    und je Bild einen Download-Button, bei mehreren Bildern auch als ZIP.
+
+    Parameter:
+      history: Der Verlauf, aus dem die Bilder geladen werden.
+      entry: Der Eintrag (siehe HistoryStore.get).
+      key_prefix: Präfix für die Widget-Keys, damit derselbe Eintrag mehrfach angezeigt werden kann.
+    """
+    if entry["output_text"]:
+        st.write(entry["output_text"])
+    for output in entry["outputs"]:
+        data = history.load_blob(output["sha256"], output["mime_type"])
+        if data is None:
+            st.warning(f"Bilddatei {output['sha256'][:12]}… fehlt im Verlauf.")
+            continue
+        st.image(data, caption="Generiertes Bild", use_container_width=True)
+        st.download_button(
+            label="Bild herunterladen",
+            data=data,
+            file_name=f"generation_{entry['id']}_{output['position'] + 1}{extension_for(output['mime_type'])}",
+            mime=output["mime_type"],
+            key=f"{key_prefix}_download_{entry['id']}_{output['position']}"
+        )
+    if len(entry["outputs"]) > 1:
+        # Die Bilder werden direkt aus dem Blob-Verzeichnis ins Archiv kopiert
+        zip_download_button(
+            "Alle Bilder als ZIP herunterladen",
+            lambda: [(f"generation_{entry['id']}_{output['position'] + 1}{extension_for(output['mime_type'])}",
+                      history.blob_path(output["sha256"], output["mime_type"])) for output in entry["outputs"]],
+            f"generation_{entry['id']}.zip", f"{key_prefix}_download_zip_{entry['id']}")
+
+def display_latency_breakdown() -> None:
+    """
+    Zeigt im Debug-Modus die Latenzen der letzten Anfrage Schritt für Schritt
+    sowie die durchschnittliche Dauer je Schritt über alle Anfragen der Sitzung.
+    """
+    history = st.session_state.get("latency_history", [])
+    if not history:
+        return
+    st.markdown("### DEBUG: Latenzen der letzten Anfrage")
+    st.write(history[-1]["attributes"])
+    st.table(history[-1]["spans"])
+    durations: dict[str, list[float]] = {}
+    for entry in history:
+        for row in entry["spans"]:
+            durations.setdefault(row["Schritt"].strip(), []).append(row["Dauer (ms)"])
+    st.markdown(f"### DEBUG: Latenzen der Sitzung ({len(history)} Anfragen)")
+    st.table([
+        {"Schritt": stage, "Anzahl": len(values), "Mittel (ms)": round(sum(values) / len(values), 1),
+         "Maximum (ms)": max(values)}
+        for stage, values in durations.items()
+    ])
+    with st.expander("DEBUG: Prozessweite Metriken"):
+        st.write(METRICS.snapshot())
+
+def render_response_stream(events) -> dict:
+    """
+    Zeigt die Teilantworten eines Streams an, sobald sie eintreffen: Text wird
+    fortlaufend ergänzt, Bilder erscheinen, sobald sie vollständig sind. Bei
+    einem Neustart des Streams wird die bisherige Ausgabe verworfen.
 
+    Parameter:
+      events: Ereignisse von generate_content_stream_with_retry.
+
+    Rückgabe:
+      Das abschließende Ereignis mit "response" und "metrics".
+    """
+    results = st.empty()
+    output = results.container()
+    text_placeholder = None
+    text = ""
+    done = {"response": None, "metrics": None}
+    for event in events:
+        if event["type"] == "restart":
+            results.empty()
+            output = results.container()
+            text_placeholder = None
+        elif event["type"] == "chunk":
+            candidates = event["response"].candidates
+            if not candidates or not candidates[0].content or not candidates[0].content.parts:
+                continue
+            for part in candidates[0].content.parts:
+                if part.text:
+                    if text_placeholder is None:
+                        text_placeholder = output.empty()
+                        text = ""
+                    text += part.text
+                    text_placeholder.write(text)
+                elif part.inline_data:
+                    # Nachfolgender Text beginnt einen neuen Absatz unter dem Bild
+                    text_placeholder = None
+                    output.image(part.inline_data.data, caption="Generiertes Bild", use_container_width=True)
+        elif event["type"] == "done":
+            done = event
+    return done
+
+def render_candidates(response: types.GenerateContentResponse | None, latency: float, cached: bool = False) -> None:
+    """
+    Zeigt alle Kandidaten einer Antwort im aktuellen Container an (für das Fan-out-Raster).
+    """
+    st.caption(f"{latency:.2f} s" + (" · aus dem Cache" if cached else ""))
+    if response is None or not response.candidates:
+        st.error("Keine gültige Antwort von der API erhalten.")
+        return
+    for number, candidate in enumerate(response.candidates, start=1):
+        if len(response.candidates) > 1:
+            st.markdown(f"*Kandidat {number}*")
+        for part in (candidate.content.parts or []) if candidate.content else []:
+            if part.text:
+                st.write(part.text)
+            elif part.inline_data:
+                st.image(part.inline_data.data, caption="Generiertes Bild", use_container_width=True)
+
+def fan_out_zip_entries(model_name: str, response: types.GenerateContentResponse | None) -> list[tuple[str, bytes]]:
+    """
+    ZIP-Einträge für die Bilder eines Modells im Fan-out, benannt nach Modell und Kandidat.
+    """
+    return [(f"{model_name}_kandidat{image['candidate'] + 1}_{image['position'] + 1}{extension_for(image['mime_type'])}",
+             image["data"]) for image in output_images(response) if image["mime_type"]]
+
+def render_fan_out(client: genai.Client, model_names: list[str], contents: list, text_prompt: str,
+                   input_images: list[bytes], input_hashes: list[str], sampling_params: dict,
+                   candidate_count: int, max_retries: int, base_wait_time: float, api_key: str,
+                   trace: Trace, policy: RetryPolicy | None = None) -> str:
+    """
+    Sendet die Anfrage gleichzeitig an mehrere Modelle (bzw. mit mehreren
+    Kandidaten) und füllt ein Raster, sobald ein Modell fertig ist.
+    Antworten aus dem Antwort-Cache erscheinen sofort.
+
+    Parameter:
+      client: Der initialisierte GenAI-Client.
+      model_names: Die Modelle; das erste ist das ausgewählte Hauptmodell.
+      contents: Die Eingabeinhalte (Text und vorverarbeitete Bilder).
+      text_prompt, input_images, input_hashes: Für Cache-Schlüssel und Verlauf.
+      sampling_params: Temperatur, Top P, Top K und maximale Output-Tokens.
+      candidate_count: Anzahl der Kandidaten pro Modell.
+      max_retries, base_wait_time: Wiederholungsversuche pro Modell.
+      api_key: Der API-Key (für den Rate-Limiter).
+      trace: Der Trace der Anfrage.
+      policy: Optionale Wiederholungsstrategie (Zeitbudget, Zeitlimit je Versuch).
+
+    Rückgabe:
+      "ok", wenn mindestens ein Modell geantwortet hat, sonst "error".
+    """
+    st.subheader("Ergebnisse:")
+    params = {**sampling_params, "candidate_count": candidate_count} if candidate_count > 1 else sampling_params
+    config = build_generation_config(sampling_params, candidate_count)
+
+    # Raster mit einem Platzhalter pro Modell
+    columns = st.columns(min(len(model_names), FAN_OUT_COLUMNS))
+    slots = {}
+    for index, name in enumerate(model_names):
+        with columns[index % len(columns)]:
+            st.markdown(f"**{name}**")
+            slots[name] = st.empty()
+            slots[name].info("Generierung läuft...")
+
+    response_cache = get_response_cache()
+    cache_keys = {name: build_cache_key(name, text_prompt, input_images, params) for name in model_names}
+    summary = []
+    pending = []
+    zip_entries = []
+    for name in model_names:
+        cached_response = response_cache.get(cache_keys[name])
+        if cached_response is None:
+            pending.append(name)
+            continue
+        with slots[name].container():
+            render_candidates(cached_response, 0.0, cached=True)
+        zip_entries += fan_out_zip_entries(name, cached_response)
+        summary.append({"Modell": name, "Latenz (s)": 0.0, "Kandidaten": len(cached_response.candidates),
+                        "Status": "Cache"})
+
+    started = time.perf_counter()
+    for result in generate_fan_out(
+            client=client,
+            model_names=pending,
+            contents=contents,
+            config=config,
+            max_retries=max_retries,
+            base_wait_time=base_wait_time,
+            on_warning=st.warning,
+            on_error=st.error,
+            scheduler=get_rate_limit_scheduler(),
+            scheduler_key=api_key_id(api_key),
+            trace=trace,
+            policy=policy,
+            breakers=get_circuit_breakers()):
+        name, response = result["model"], result["response"]
+        ok = response is not None and bool(response.candidates)
+        if ok:
+            response_cache.put(cache_keys[name], response)
+        with slots[name].container():
+            render_candidates(response, result["latency"])
+        zip_entries += fan_out_zip_entries(name, response)
+        summary.append({"Modell": name, "Latenz (s)": round(result["latency"], 2),
+                        "Kandidaten": len(response.candidates) if ok else 0, "Status": "ok" if ok else "Fehler"})
+        record_history(api_key, name, text_prompt, params, input_hashes, response, "ok" if ok else "error",
+                       duration_ms=result["latency"] * 1000,
+                       total_tokens=response.usage_metadata.total_token_count if ok and response.usage_metadata else None)
+    wall_time = time.perf_counter() - started
+
+    st.table(summary)
+    if pending:
+        st.caption(f"Gesamtdauer {wall_time:.2f} s für {len(pending)} parallele Aufrufe "
+                   f"(Summe der Einzellatenzen {sum(row['Latenz (s)'] for row in summary):.2f} s).")
+    if zip_entries:
+        zip_download_button("Alle Bilder als ZIP herunterladen", lambda: zip_entries, "fan_out.zip", "fan_out_download_zip")
+    return "ok" if any(row["Status"] != "Fehler" for row in summary) else "error"
+
+def render_generation_tab(api_key: str, debug_mode: bool) -> None:
+    """
+    Zeigt die Einzelgenerierung an: Parameter, Bild-Uploads, Prompt-Eingabe,
+    Aufruf der API und Ergebnisse.
+
+    Parameter:
+      api_key: Der API-Key für die Generierung.
+      debug_mode: Ob zusätzliche Debug-Informationen angezeigt werden.
+    """
     with st.expander("Konfiguration"):
         # Lade verfügbare Modelle aus der Konfigurationsdatei
         available_models = load_models_from_config(MODEL_CONFIG_FILE)
@@ -313,6 +740,19 @@ def main() -> None:
         max_output_tokens = api_config.get("max_output_tokens", 1024)
         max_retries = api_config.get("max_retries", DEFAULT_MAX_RETRIES)
         base_wait_time = api_config.get("base_wait_time", DEFAULT_BASE_WAIT_TIME)
+        retry_policy = RetryPolicy.from_config(api_config.get("retry", {}), max_retries, base_wait_time)
+        # Fan-out: dieselbe Anfrage parallel an weitere Modelle bzw. mit mehreren Kandidaten
+        compare_models = st.multiselect(
+            "Zusätzliche Modelle zum Vergleich:",
+            [m for m in available_models if m != model_name],
+            help="Sendet dieselbe Anfrage gleichzeitig an alle gewählten Modelle und zeigt die Ergebnisse nebeneinander an."
+        )
+        candidate_count = st.number_input(
+            "Kandidaten pro Modell:", min_value=1, max_value=MAX_CANDIDATES, value=1, step=1,
+            help="Anzahl der Varianten pro Modell (candidate_count). Nicht jedes Modell unterstützt mehrere Kandidaten."
+        )
+        streaming = st.checkbox("Streaming", value=api_config.get("streaming", True),
+                                help="Zeigt Text und Bilder an, sobald sie eintreffen, statt auf die vollständige Antwort zu warten.")
 
     # Layout mit zwei Spalten für Schieberegler und Bild-Uploads
     col1, col2 = st.columns(2)
@@ -331,14 +771,29 @@ def main() -> None:
         uploaded_file2 = st.file_uploader("Bild 2 hochladen", type=["png", "jpg", "jpeg"],
                                           help="Lade das zweite Bild hoch.")
 
+    # Uploads einmal pro Sitzung einlesen: nur Header und Budget, keine Dekodierung
+    uploaded_files = [f for f in (uploaded_file1, uploaded_file2) if f is not None]
+    prune_ingested_images([f.file_id for f in uploaded_files])
+    ingest_budget = api_config.get("image_ingest", {})
+    image_entries = [
+        ingest_uploaded_file(f, ingest_budget) if f is not None else None
+        for f in (uploaded_file1, uploaded_file2)
+    ]
+
     # Auswahl eines Beispiel-Prompts oder Verwendung der Prompt-Historie
     available_prompts = load_prompts_from_config(PROMPT_CONFIG_FILE)
     # Auswahl eines Beispiel-Prompts aus der JSON oder Prompt-Historie
     selected_prompt = st.selectbox("Oder wähle einen Beispiel-Prompt:", [""] + available_prompts,
                                    help="Wähle einen Beispiel-Prompt aus, um schnell loszulegen.")
-    if st.session_state.prompt_history:
+    # Ohne persistenten Verlauf (oder ohne API-Key) bleibt die Historie auf die Sitzung beschränkt
+    history = get_history_store()
+    if history is not None and api_key:
+        recent_prompts = history.recent_prompts(api_key_id(api_key), 5)
+    else:
+        recent_prompts = st.session_state.prompt_history
+    if recent_prompts:
         st.write("Prompt-Historie:")
-        selected_history_prompt = st.selectbox("Wähle einen Prompt aus der Historie:", [""] + st.session_state.prompt_history,
+        selected_history_prompt = st.selectbox("Wähle einen Prompt aus der Historie:", [""] + recent_prompts,
                                                help="Wähle einen zuvor verwendeten Prompt aus.")
         if selected_history_prompt:
             selected_prompt = selected_history_prompt
@@ -355,66 +810,164 @@ def main() -> None:
     st.subheader("Bild-Metadaten")
     col_meta1, col_meta2 = st.columns(2)
     with col_meta1:
-        display_image_metadata(uploaded_file1, 1)
+        display_image_metadata(image_entries[0], 1)
     with col_meta2:
-        display_image_metadata(uploaded_file2, 2)
+        display_image_metadata(image_entries[1], 2)
 
-    generated_image = None  # Speichert das generierte Bild
-    generated_image_bytes = None  # Speichert die Bilddaten als Bytes
+    generated_images = []  # Generierte Bilder (unveränderte Bytes und MIME-Typ)
 
     if st.button("Generieren", help="Starte die Bildgenerierung."):
         if not api_key:
             st.error("Bitte gib einen gültigen API Key ein!")
             return
 
+        # Fan-out bei weiteren Modellen oder mehreren Kandidaten (ohne Streaming)
+        fan_out = bool(compare_models) or candidate_count > 1
+        # Zeitmessung aller Schritte dieser Anfrage (siehe metrics.py)
+        trace = Trace("generate", {"model": model_name, "streaming": streaming and not fan_out, "fan_out": fan_out},
+                      exporter=get_trace_exporter())
+        status = "error"
+        response = None
+        stream_metrics = None
+        served_model = model_name  # Bei einem Ausweichmodell dessen Name
+        sampling_params = {
+            "temperature": temperature,
+            "top_p": top_p,
+            "top_k": top_k,
+            "max_output_tokens": max_output_tokens
+        }
+        input_hashes = [entry["sha256"] for entry in image_entries if entry is not None and "error" not in entry]
+
         # Validierung des API-Keys
-        if not validate_api_key(api_key):
+        with trace.span("key_validation"):
+            key_valid = validate_api_key(api_key)
+        if not key_valid:
+            finish_trace(trace, "invalid_key")
             return
 
         try:
             # Initialisiere den GenAI-Client
-            client = get_genai_client(api_key)
-
-            # Verarbeite den Textprompt und ggf. hochgeladene Bilder
-            contents = [text_prompt]
-            # Vor der Verarbeitung des Bildes in der Generierung:
-            for uploaded_file in [uploaded_file1, uploaded_file2]:
-                if uploaded_file is not None:
-                    try:
-                        # Stelle sicher, dass der Dateizeiger am Anfang steht
-                        uploaded_file.seek(0)
-                        image_bytes = uploaded_file.read()
-                        image_input = Image.open(BytesIO(image_bytes))
-                        contents.append(image_input)
-                    except UnidentifiedImageError as e:
-                        st.exception(e)
-                        st.error(f"Fehler beim Verarbeiten des Bildes: {uploaded_file.name}")
-                        continue
+            with trace.span("client"):
+                client = get_genai_client(api_key)
 
+            # Verarbeite den Textprompt und ggf. hochgeladene Bilder (siehe pipeline.py)
+            prepared = prepare_contents(
+                text_prompt,
+                [entry for entry in image_entries if entry is not None],
+                api_config.get("image_preprocessing", {}),
+                get_preprocessing_cache(),
+                trace=trace
+            )
+            for message in prepared["skipped"]:
+                st.error(message)
+            contents = prepared["contents"]
+            input_images = prepared["input_images"]  # Vorverarbeitete Bilddaten für den Cache-Schlüssel
+            preprocessing_report = prepared["report"]  # Bytegrößen vor/nach der Vorverarbeitung
 
             # Debug-Ausgabe der Eingabedaten
             if debug_mode:
                 st.markdown("### DEBUG: Eingabeinhalte")
                 st.write("Contents:", contents)
+                if preprocessing_report:
+                    st.markdown("### DEBUG: Bildvorverarbeitung")
+                    st.table(preprocessing_report)
 
-            # API-Anfrage mit Wiederholungsversuchen
-            with st.spinner("Generierung läuft..."):
-                response = generate_content_with_retry(
+            if fan_out:
+                status = render_fan_out(
                     client=client,
-                    model_name=model_name,
+                    model_names=[model_name] + compare_models,
                     contents=contents,
-                    config=types.GenerateContentConfig(
-                        response_modalities=['Text', 'Image'],
-                        temperature=temperature,
-                        top_p=top_p,
-                        top_k=top_k,
-                        max_output_tokens=max_output_tokens
-                    ),
+                    text_prompt=text_prompt,
+                    input_images=input_images,
+                    input_hashes=input_hashes,
+                    sampling_params=sampling_params,
+                    candidate_count=candidate_count,
                     max_retries=max_retries,
-                    base_wait_time=base_wait_time
+                    base_wait_time=base_wait_time,
+                    api_key=api_key,
+                    trace=trace,
+                    policy=retry_policy
                 )
+                return
 
+            # Antwort-Cache: identische Anfragen werden nicht erneut an die API gesendet
+            response_cache = get_response_cache()
+            cache_key = build_cache_key(model_name, text_prompt, input_images, sampling_params)
+            with trace.span("cache_lookup"):
+                response = response_cache.get(cache_key)
+            trace.annotate(cache_hit=response is not None)
+            # Context Caching: wiederholt verwendete Bilder werden nicht erneut hochgeladen
+            context = {"contents": contents, "cached_content": None, "key": None}
             if response is None:
+                context = apply_context_cache(prepared, client, model_name, get_context_cache(),
+                                              api_key_id(api_key), trace)
+                if debug_mode and context["cached_content"]:
+                    st.info(f"Eingabebilder aus dem Context Cache ({context['cached_content']}).")
+            generation_config = build_generation_config(sampling_params, cached_content=context["cached_content"])
+            # Ausweichmodelle bei einem gestörten Modell; ein Context Cache gilt nur für sein eigenes Modell
+            breakers = get_circuit_breakers()
+            fallback_models = []
+            if breakers is not None and not context["cached_content"]:
+                breaker_config = {**DEFAULT_CIRCUIT_BREAKER_CONFIG, **api_config.get("circuit_breaker", {})}
+                fallback_models = fallback_chain(model_name, available_models, breaker_config["max_fallbacks"])
+            streamed = False  # Ergebnisse wurden bereits während des Streams angezeigt
+            if response is not None:
+                if debug_mode:
+                    st.info(f"Antwort aus dem Cache geladen (Schlüssel {cache_key[:12]}…).")
+            elif streaming:
+                st.subheader("Ergebnisse:")
+                # Der Span umfasst auch die Anzeige der Teilantworten
+                with trace.span("api_call"):
+                    done = render_response_stream(generate_content_stream_with_retry(
+                        client=client,
+                        model_name=model_name,
+                        contents=context["contents"],
+                        config=generation_config,
+                        max_retries=max_retries,
+                        base_wait_time=base_wait_time,
+                        on_warning=st.warning,
+                        on_error=st.error,
+                        scheduler=get_rate_limit_scheduler(),
+                        scheduler_key=api_key_id(api_key),
+                        trace=trace,
+                        policy=retry_policy,
+                        breakers=breakers,
+                        fallback_models=fallback_models
+                    ))
+                response, stream_metrics = done["response"], done["metrics"]
+                streamed = True
+            else:
+                # API-Anfrage mit Wiederholungsversuchen
+                with st.spinner("Generierung läuft..."), trace.span("api_call"):
+                    response = generate_content_with_retry(
+                        client=client,
+                        model_name=model_name,
+                        contents=context["contents"],
+                        config=generation_config,
+                        max_retries=max_retries,
+                        base_wait_time=base_wait_time,
+                        on_warning=st.warning,
+                        on_error=st.error,
+                        coalesce_key=cache_key,
+                        scheduler=get_rate_limit_scheduler(),
+                        scheduler_key=api_key_id(api_key),
+                        trace=trace,
+                        policy=retry_policy,
+                        breakers=breakers,
+                        fallback_models=fallback_models
+                    )
+            if not trace.root["attributes"].get("cache_hit"):
+                served_model = trace.root["attributes"].get("fallback_model", model_name)
+                # Antworten eines Ausweichmodells gehören nicht unter den Schlüssel des gewählten Modells
+                if served_model != model_name:
+                    st.info(f"{model_name} war nicht verfügbar; die Antwort stammt von {served_model}.")
+                elif response is not None and response.candidates:
+                    response_cache.put(cache_key, response)
+
+            if response is None:
+                if context["cached_content"]:
+                    # Der Cache könnte die Ursache sein; beim nächsten Mal neu anlegen
+                    get_context_cache().invalidate(context["key"])
                 st.error("Die Bildgenerierung ist fehlgeschlagen. Bitte versuche es später noch einmal.")
                 return
 
@@ -422,45 +975,323 @@ def main() -> None:
             if debug_mode:
                 st.markdown("### DEBUG: API-Antwort")
                 st.write(response)
+                if stream_metrics:
+                    st.markdown("### DEBUG: Streaming")
+                    st.write(stream_metrics)
 
-            # Ergebnisse anzeigen
-            st.subheader("Ergebnisse:")
+            # Ergebnisse anzeigen (beim Streaming bereits geschehen)
+            if not streamed:
+                st.subheader("Ergebnisse:")
             if not response or not response.candidates:
                 st.error("Keine gültige Antwort von der API erhalten.")
                 return
 
-            for part in response.candidates[0].content.parts:
-                if hasattr(part, 'text') and part.text:
-                    st.write(part.text)
-                elif hasattr(part, 'inline_data') and part.inline_data:
-                    try:
-                        image_output = Image.open(BytesIO(part.inline_data.data))
-                        st.image(image_output, caption="Generiertes Bild", use_container_width=True)
-                        generated_image = image_output
-                        generated_image_bytes = part.inline_data.data
+            # Dekodierung und Anzeige der Ausgabe (beim Streaming nur Dekodierung)
+            with trace.span("render"):
+                for part in response.candidates[0].content.parts:
+                    if hasattr(part, 'text') and part.text:
+                        if not streamed:
+                            st.write(part.text)
+                    elif hasattr(part, 'inline_data') and part.inline_data:
+                        # Die Bytes werden unverändert angezeigt und heruntergeladen, nicht dekodiert
+                        image = inline_image(part.inline_data)
+                        if image["mime_type"] is None:
+                            st.error("Fehlerhafte Bilddaten in der API-Antwort.")
+                            continue
+                        if not streamed:
+                            st.image(image["data"], caption="Generiertes Bild", use_container_width=True)
+                        generated_images.append(image)
                         # Aktualisiere die Prompt-Historie
                         if text_prompt not in st.session_state.prompt_history:
                             st.session_state.prompt_history.append(text_prompt)
                             st.session_state.prompt_history = st.session_state.prompt_history[-5:]
-                    except UnidentifiedImageError as e:
-                        st.exception(e)
-                        st.error("Fehlerhafte Bilddaten in der API-Antwort.")
-                else:
-                    st.error("Unbekannter Inhaltstyp in der Antwort.")
+                    else:
+                        st.error("Unbekannter Inhaltstyp in der Antwort.")
+            status = "ok"
 
         except Exception as e:
             st.exception(e)
             st.error(f"Ein Fehler ist aufgetreten: {str(e)}")
+        finally:
+            finish_trace(trace, status)
+            # Im Fan-out-Modus wird jedes Modell einzeln gespeichert
+            if not fan_out:
+                ttft = (stream_metrics or {}).get("ttft")
+                record_history(api_key, served_model, text_prompt, sampling_params, input_hashes, response, status,
+                               duration_ms=trace.duration_ms(),
+                               ttft_ms=ttft * 1000 if ttft is not None else None,
+                               total_tokens=trace.root["attributes"].get("tokens_total"))
 
-    # Download-Button für das generierte Bild, falls vorhanden
-    if generated_image and generated_image_bytes:
-        st.download_button(
-            label="Generiertes Bild herunterladen",
-            data=generated_image_bytes,
-            file_name="generated_image.png",
-            mime="image/png",
-            help="Lade das generierte Bild herunter."
-        )
+    # Debug-Ausgabe der Cache-Statistik
+    if debug_mode:
+        st.markdown("### DEBUG: Antwort-Cache")
+        st.write(get_response_cache().stats())
+        if get_context_cache() is not None:
+            st.markdown("### DEBUG: Context Cache")
+            st.write(get_context_cache().stats())
+        st.markdown("### DEBUG: Zusammengeführte Anfragen")
+        st.write(coalescing_stats())
+        st.markdown("### DEBUG: Rate-Limiter")
+        st.write(get_rate_limit_scheduler().stats())
+        if get_circuit_breakers() is not None:
+            st.markdown("### DEBUG: Circuit Breaker")
+            st.write(get_circuit_breakers().stats())
+        st.markdown("### DEBUG: Wiederholungen")
+        st.write(retry_stats())
+        display_latency_breakdown()
+
+    # Download-Buttons für die generierten Bilder, falls vorhanden
+    if generated_images:
+        display_image_downloads(generated_images, "generated_image", "generated")
+    elif history is not None and st.session_state.get("last_generation_id"):
+        # Nach einem Rerun das letzte Ergebnis aus dem Verlauf erneut anzeigen
+        last_entry = history.get(api_key_id(api_key), st.session_state["last_generation_id"])
+        if last_entry is not None and last_entry["status"] == "ok":
+            st.subheader("Letztes Ergebnis:")
+            display_history_entry(history, last_entry, "last")
+
+def render_batch_tab(api_key: str, debug_mode: bool) -> None:
+    """
+    Zeigt den Batch-Modus an: Ein Manifest (JSONL oder CSV) mit Prompts und
+    Bildpfaden wird mit begrenzter Parallelität abgearbeitet. Bereits
+    abgeschlossene Zeilen im Ausgabeverzeichnis werden übersprungen.
+
+    Parameter:
+      api_key: Der API-Key für die Generierung.
+      debug_mode: Ob zusätzliche Debug-Informationen angezeigt werden.
+    """
+    st.write("Verarbeite viele Prompts auf einmal. Jede Zeile des Manifests benötigt ein Feld "
+             "\"prompt\" und optional \"images\", \"model\", \"temperature\", \"top_p\", \"top_k\" "
+             "und \"max_output_tokens\".")
+    api_config = load_api_config(API_CONFIG_FILE)
+    batch_config = api_config.get("batch", {})
+
+    manifest_file = st.file_uploader("Manifest hochladen", type=["jsonl", "csv"],
+                                     help="JSONL- oder CSV-Datei mit einer Anfrage pro Zeile.")
+    available_models = load_models_from_config(MODEL_CONFIG_FILE)
+    model_name = st.selectbox("Standardmodell:", available_models, key="batch_model",
+                              help="Wird für Zeilen ohne eigenes Modell verwendet.")
+    # Alle Pfade des Batch-Tabs bleiben innerhalb des konfigurierten Wurzelverzeichnisses
+    root_dir = batch_config.get("root_dir", DEFAULT_ROOT_DIR)
+    output_dir = st.text_input("Ausgabeverzeichnis:", value=batch_config.get("output_dir", DEFAULT_OUTPUT_DIR),
+                               help=f"Relativ zu {root_dir}. Ergebnisse und Fortschritts-Ledger werden hier "
+                                    "gespeichert. Ein abgebrochener Lauf wird im selben Verzeichnis fortgesetzt.")
+    image_base_dir = st.text_input("Basisverzeichnis für Bildpfade:", value=".",
+                                   help=f"Relativ zu {root_dir}. Relative Bildpfade im Manifest werden relativ "
+                                        "zu diesem Verzeichnis aufgelöst.")
+    concurrency = st.number_input("Parallele Anfragen:", min_value=1, max_value=32,
+                                  value=batch_config.get("concurrency", DEFAULT_CONCURRENCY),
+                                  help="Maximale Anzahl gleichzeitiger API-Anfragen.")
+
+    if not st.button("Batch starten", help="Starte die Verarbeitung des Manifests."):
+        return
+    if not api_key:
+        st.error("Bitte gib einen gültigen API Key ein!")
+        return
+    if manifest_file is None:
+        st.error("Bitte lade ein Manifest hoch.")
+        return
+    if not validate_api_key(api_key):
+        return
+
+    try:
+        output_dir = resolve_within(root_dir, output_dir)
+        rows = parse_manifest(manifest_file.getvalue().decode("utf-8"),
+                              os.path.splitext(manifest_file.name)[1].lower(),
+                              resolve_within(root_dir, image_base_dir), root_dir)
+    except (ValueError, UnicodeDecodeError) as e:
+        st.error(f"Manifest konnte nicht gelesen werden: {e}")
+        return
+
+    progress_bar = st.progress(0.0, text="Batch läuft...")
+    log = st.empty()
+    log_lines = []
+
+    def on_progress(entry: dict, finished: int, total: int) -> None:
+        progress_bar.progress(finished / total, text=f"{finished}/{total} Zeilen verarbeitet")
+        line = f"{entry['row_id']}: {entry['status']} ({entry['elapsed']:.1f}s)"
+        if entry.get("error"):
+            line += f" – {entry['error']}"
+        log_lines.append(line)
+        log.text("\n".join(log_lines[-20:]))
+
+    summary = run_batch(
+        client=get_genai_client(api_key),
+        rows=rows,
+        output_dir=output_dir,
+        defaults={
+            "model": model_name,
+            "temperature": api_config.get("temperature", 0.7),
+            "top_p": api_config.get("top_p", 0.95),
+            "top_k": api_config.get("top_k", 40),
+            "max_output_tokens": api_config.get("max_output_tokens", 1024)
+        },
+        concurrency=int(concurrency),
+        max_retries=api_config.get("max_retries", DEFAULT_MAX_RETRIES),
+        base_wait_time=api_config.get("base_wait_time", DEFAULT_BASE_WAIT_TIME),
+        on_progress=on_progress,
+        scheduler=get_rate_limit_scheduler(),
+        scheduler_key=api_key_id(api_key),
+        preprocessing=api_config.get("image_preprocessing", {}),
+        ingest_budget=api_config.get("image_ingest", {}),
+        policy=RetryPolicy.from_config(api_config.get("retry", {}),
+                                       api_config.get("max_retries", DEFAULT_MAX_RETRIES),
+                                       api_config.get("base_wait_time", DEFAULT_BASE_WAIT_TIME)),
+        breakers=get_circuit_breakers()
+    )
+    progress_bar.progress(1.0, text="Batch abgeschlossen")
+    st.success(f"{summary['done']} erfolgreich, {summary['failed']} fehlgeschlagen, "
+               f"{summary['skipped']} bereits erledigt (von {summary['total']}).")
+    if debug_mode:
+        st.markdown("### DEBUG: Batch-Zusammenfassung")
+        st.write(summary)
+
+
+def render_history_tab(api_key: str) -> None:
+    """
+    Zeigt den persistenten Verlauf seitenweise mit Vorschaubildern und
+    Volltextsuche über die Prompts. Bilder in voller Größe werden erst
+    geladen, wenn ein Eintrag geöffnet wird.
+
+    Parameter:
+      api_key: Der API-Key der Sitzung; angezeigt werden nur seine Einträge.
+    """
+    history = get_history_store()
+    if history is None:
+        st.info("Der Verlauf ist deaktiviert (\"history\" → \"enabled\" in api_config.json).")
+        return
+    if not api_key:
+        st.info("Gib deinen API Key ein, um deinen Verlauf zu sehen.")
+        return
+    owner = api_key_id(api_key)
+    page_size = {**DEFAULT_HISTORY_CONFIG, **load_api_config(API_CONFIG_FILE).get("history", {})}["page_size"]
+
+    query = st.text_input("Im Verlauf suchen:", key="history_query",
+                          help="Sucht in allen Prompts; jedes Wort wird als Wortanfang gesucht.")
+    # Cursor-Stapel für die Keyset-Paginierung: before_id jeder bisher geöffneten Seite
+    if st.session_state.get("history_cursor_query") != query:
+        st.session_state["history_cursor_query"] = query
+        st.session_state["history_cursors"] = [None]
+    cursors = st.session_state["history_cursors"]
+
+    entries = history.page(owner, query, before_id=cursors[-1], limit=page_size + 1)
+    has_more = len(entries) > page_size
+    entries = entries[:page_size]
+    total = history.count(owner, query)
+    st.caption(f"{total} Einträge · Seite {len(cursors)}")
+    if total:
+        # Alle Bilder der Treffer, fortlaufend aus der Datenbank gelesen und von der Festplatte kopiert
+        zip_download_button(
+            "Alle Bilder der Treffer als ZIP herunterladen",
+            lambda: ((f"generation_{output['generation_id']}_{output['position'] + 1}{extension_for(output['mime_type'])}",
+                      history.blob_path(output["sha256"], output["mime_type"])) for output in history.iter_outputs(owner, query)),
+            "verlauf.zip", "history_download_zip")
+
+    columns = st.columns(4)
+    for index, entry in enumerate(entries):
+        with columns[index % 4]:
+            if entry["thumbnail"]:
+                st.image(entry["thumbnail"], use_container_width=True)
+            created = time.strftime("%d.%m.%Y %H:%M", time.localtime(entry["created_at"]))
+            duration = f" · {entry['duration_ms'] / 1000:.1f} s" if entry["duration_ms"] is not None else ""
+            st.caption(f"#{entry['id']} · {created} · {entry['model']}{duration}")
+            st.write(entry["prompt"][:120] + ("…" if len(entry["prompt"]) > 120 else ""))
+            st.button("Öffnen", key=f"history_open_{entry['id']}",
+                      on_click=lambda generation_id=entry["id"]: st.session_state.update(history_selected=generation_id))
+
+    col_newer, col_older = st.columns(2)
+    with col_newer:
+        st.button("← Neuere", disabled=len(cursors) <= 1, on_click=cursors.pop)
+    with col_older:
+        st.button("Ältere →", disabled=not has_more,
+                  on_click=lambda: cursors.append(entries[-1]["id"]))
+
+    selected = st.session_state.get("history_selected")
+    entry = history.get(owner, selected) if selected else None
+    if entry is not None:
+        st.subheader(f"Eintrag #{entry['id']}")
+        st.write(f"**Prompt:** {entry['prompt']}")
+        st.write({
+            "Modell": entry["model"],
+            "Status": entry["status"],
+            "Parameter": entry["params"],
+            "Eingabebilder (SHA-256)": entry["input_hashes"],
+            "Dauer (ms)": entry["duration_ms"],
+            "Zeit bis zur ersten Teilantwort (ms)": entry["ttft_ms"],
+            "Tokens": entry["total_tokens"]
+        })
+        display_history_entry(history, entry, "history")
+
+def main() -> None:
+    """
+    Hauptfunktion der Streamlit-App.
+    
+    Steuert den Ablauf der Anwendung:
+      - Laden der Konfigurationsdateien
+      - Auswahl von Themes, Modellen und Prompts
+      - Upload von Bildern und Texteingabe
+      - Validierung des API-Keys und Aufruf der API zur Generierung von Inhalten
+      - Anzeige der Ergebnisse und Downloadoption für generierte Bilder
+      - Batch-Modus für Manifeste mit vielen Prompts
+      - Durchsuchbarer Verlauf aller Generierungen
+    """
+    # Theme-Auswahl: Überprüfe, ob bereits ein Theme im Session State existiert
+    if "selected_theme" not in st.session_state:
+        st.session_state["selected_theme"] = ""
+
+    # Lade Themes und erzeuge eine Selectbox zur Auswahl
+    available_themes = load_themes_from_config(THEME_CONFIG_FILE)
+    theme_options = [""] + list(available_themes.keys())
+    new_theme = st.selectbox(
+        "Theme auswählen:",
+        options=theme_options,
+        index=theme_options.index(st.session_state.get("selected_theme", "")) if st.session_state.get("selected_theme", "") in theme_options else 0,
+        help="Wähle ein Theme aus, um das Erscheinungsbild der App zu ändern."
+    )
+    if new_theme != st.session_state.get("selected_theme", ""):
+        st.session_state["selected_theme"] = new_theme
+        st.rerun()  # Seite neu laden, damit das CSS wirksam wird
+    apply_theme(available_themes)
+
+    st.title("Google GenAI Streamlit App")
+    st.write("Erstelle Inhalte basierend auf einem Textprompt und optional zwei Bildern.")
+
+    # Initialisiere die Prompt-Historie im Session State
+    if 'prompt_history' not in st.session_state:
+        st.session_state.prompt_history = []
+
+    # API-Key-Verwaltung: Möglichkeit, den API-Key aus Streamlit Secrets zu verwenden
+    use_secrets = st.checkbox("API Key aus Streamlit Secrets verwenden", value=False,
+                              help="Verwende den API Key, der sicher in Streamlit Secrets gespeichert ist.")
+    if use_secrets:
+        try:
+            api_key = st.secrets["GENAI_API_KEY"]
+        except KeyError:
+            st.error("API Key nicht in Streamlit Secrets gefunden. Bitte konfiguriere den API Key in der Streamlit Cloud.")
+            return
+    else:
+        api_key = st.text_input("API Key eingeben:", type="password",
+                                help="Bitte gib deinen Google GenAI API Key ein.")
+
+    # Prometheus-Endpunkt (optional); schlägt der Start fehl, wird es beim nächsten Rerun erneut versucht
+    try:
+        start_metrics_endpoint()
+    except OSError as e:
+        st.warning(f"Der Metrik-Endpunkt konnte nicht gestartet werden: {e}")
+
+    # Debug-Modus für detaillierte Fehlerausgabe
+    debug_mode = st.checkbox("Debug-Modus aktivieren", help="Aktiviere den Debug-Modus, um zusätzliche Informationen für die Fehleranalyse anzuzeigen.")
+    if debug_mode:
+        with st.expander("DEBUG: Konfigurations-Cache"):
+            st.write(CONFIG_STORE.stats())
+
+    tab_generate, tab_batch, tab_history = st.tabs(["Generierung", "Batch", "Verlauf"])
+    with tab_generate:
+        render_generation_tab(api_key, debug_mode)
+    with tab_batch:
+        render_batch_tab(api_key, debug_mode)
+    with tab_history:
+        render_history_tab(api_key)
 
 if __name__ == "__main__":
     # Erstelle den Konfigurationsordner, falls er nicht existiert
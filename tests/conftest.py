@@ -0,0 +1,10 @@
+"""
+Gemeinsame Einstellungen der Tests: Die Module liegen im Repository-Verzeichnis
+und werden wie von der App direkt importiert.
+"""
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
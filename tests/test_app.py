@@ -0,0 +1,52 @@
+"""
+Tests für die Prüfung des API-Keys in der Streamlit-App (streamlit_app..py).
+"""
+import os
+
+import httpx
+import pytest
+from google import genai
+from google.genai import errors
+from streamlit.testing.v1 import AppTest
+
+from benchmarks.stub_client import StubBackend
+
+APP_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "streamlit_app..py")
+
+
+def _api_error(code: int) -> errors.APIError:
+    error_class = errors.ServerError if code >= 500 else errors.ClientError
+    return error_class(code, {"error": {"code": code, "message": "", "status": ""}}, httpx.Response(code))
+
+
+def _run_with_failing_probe(monkeypatch, error: Exception) -> AppTest:
+    backend = StubBackend(generate_latency=0.0, metadata_latency=0.0)
+
+    def create_client(api_key: str = "", **kwargs):
+        client = backend.create_client(api_key)
+
+        def failing_list(**kwargs):
+            raise error
+
+        client.models.list = failing_list
+        return client
+
+    monkeypatch.setattr(genai, "Client", create_client)
+    monkeypatch.chdir(os.path.dirname(APP_FILE))
+    app = AppTest.from_file(APP_FILE, default_timeout=30)
+    app.run()
+    app.text_input[0].input(f"key-{id(error)}").run()
+    app.button[0].click().run()
+    return app
+
+
+@pytest.mark.parametrize("error", [_api_error(503), httpx.ConnectError("Verbindung getrennt")])
+def test_transient_probe_failure_is_only_a_warning(monkeypatch, error):
+    app = _run_with_failing_probe(monkeypatch, error)
+    assert any("Validierung vorübergehend nicht möglich" in warning.value for warning in app.warning)
+    assert not any("API Key ist ungültig" in message.value for message in app.error)
+
+
+def test_rejected_key_is_reported_as_invalid(monkeypatch):
+    app = _run_with_failing_probe(monkeypatch, _api_error(401))
+    assert any("API Key ist ungültig" in message.value for message in app.error)
@@ -0,0 +1,59 @@
+"""
+Tests für Manifest, Ledger und Pfadprüfungen im Batch-Modus (batch.py).
+"""
+import json
+import os
+
+import pytest
+
+from batch import LEDGER_FILE_NAME, parse_manifest, read_ledger, resolve_within
+
+
+@pytest.mark.parametrize("row_id", ["../evil", "a/b", "a\\b", "..", ".", "/tmp/evil"])
+def test_row_id_with_path_components_is_rejected(tmp_path, row_id):
+    manifest = json.dumps({"id": row_id, "prompt": "p"})
+    with pytest.raises(ValueError, match="Zeilen-ID"):
+        parse_manifest(manifest, ".jsonl", str(tmp_path))
+
+
+def test_plain_row_id_is_kept(tmp_path):
+    rows = parse_manifest('{"id": "stadt-01", "prompt": "p"}', ".jsonl", str(tmp_path))
+    assert rows[0]["id"] == "stadt-01"
+
+
+def test_resolve_within_rejects_escaping_paths(tmp_path):
+    assert resolve_within(str(tmp_path), "out") == os.path.join(os.path.realpath(tmp_path), "out")
+    for path in ("..", "../out", "/etc"):
+        with pytest.raises(ValueError, match="außerhalb"):
+            resolve_within(str(tmp_path), path)
+
+
+def test_resolve_within_rejects_symlinks_out_of_root(tmp_path):
+    root = tmp_path / "root"
+    root.mkdir()
+    (root / "link").symlink_to(tmp_path)
+    with pytest.raises(ValueError, match="außerhalb"):
+        resolve_within(str(root), "link/secret.png")
+
+
+def test_manifest_images_are_restricted_to_root(tmp_path):
+    root = str(tmp_path)
+    rows = parse_manifest('{"prompt": "p", "images": ["bilder/a.png"]}', ".jsonl", root, root)
+    assert rows[0]["images"] == [os.path.join(os.path.realpath(root), "bilder", "a.png")]
+    with pytest.raises(ValueError, match="außerhalb"):
+        parse_manifest('{"prompt": "p", "images": ["/etc/passwd"]}', ".jsonl", root, root)
+    with pytest.raises(ValueError, match="außerhalb"):
+        parse_manifest('{"prompt": "p", "images": ["../x.png"]}', ".jsonl", root, root)
+
+
+@pytest.mark.parametrize("line", ['["p"]', '"p"', "42", "null", '{"prompt": '])
+def test_malformed_manifest_line_reports_line_number(tmp_path, line):
+    manifest = '{"prompt": "a"}\n\n' + line
+    with pytest.raises(ValueError, match="Manifest-Zeile 3"):
+        parse_manifest(manifest, ".jsonl", str(tmp_path))
+
+
+def test_ledger_skips_entries_without_row_id(tmp_path):
+    entries = ['{"row_id": "a", "status": "ok"}', "[1, 2]", '"text"', '{"status": "ok"}', '{"row_id": "b", "sta']
+    (tmp_path / LEDGER_FILE_NAME).write_text("\n".join(entries), encoding="utf-8")
+    assert read_ledger(str(tmp_path)) == {"a": {"row_id": "a", "status": "ok"}}
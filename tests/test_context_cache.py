@@ -0,0 +1,81 @@
+"""
+Tests für die Fehlerbehandlung des Context Cachings (context_cache.py).
+"""
+import httpx
+import pytest
+from google.genai import types
+
+import context_cache
+from benchmarks.stub_client import StubBackend, stub_error
+from context_cache import ContextCacheRegistry
+
+PARTS = [types.Part(text="Präfix")]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = {"value": 1_000_000.0}
+    monkeypatch.setattr(context_cache.time, "time", lambda: now["value"])
+    return now
+
+
+def _failing_client(error: Exception):
+    client = StubBackend(metadata_latency=0.0).create_client("key")
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        raise error
+
+    client.caches.create = create
+    return client, calls
+
+
+@pytest.mark.parametrize("error", [httpx.ReadTimeout("Zeitüberschreitung"), TimeoutError(),
+                                   ConnectionResetError(), stub_error(400)])
+def test_failed_create_falls_back_to_inline(error):
+    registry = ContextCacheRegistry(min_uses=1)
+    client, _ = _failing_client(error)
+    assert registry.resolve(client, "model", "key", PARTS, owner="a") is None
+    assert registry.stats()["errors"] == 1
+
+
+def test_failed_create_is_not_retried_for_other_prefixes(clock):
+    registry = ContextCacheRegistry(min_uses=1, negative_ttl=60)
+    client, calls = _failing_client(httpx.ConnectTimeout("Zeitüberschreitung"))
+
+    for key in ("prefix-1", "prefix-2", "prefix-3"):
+        assert registry.resolve(client, "model", key, PARTS, owner="a") is None
+    assert len(calls) == 1
+    # Andere Keys und Modelle sind nicht betroffen
+    registry.resolve(client, "model", "prefix-4", PARTS, owner="b")
+    registry.resolve(client, "other-model", "prefix-5", PARTS, owner="a")
+    assert len(calls) == 3
+
+    clock["value"] += 61
+    registry.resolve(client, "model", "prefix-1", PARTS, owner="a")
+    assert len(calls) == 4
+
+
+def test_transport_error_on_update_recreates_cache(clock):
+    registry = ContextCacheRegistry(min_uses=1, ttl=100, refresh_margin=10)
+    backend = StubBackend(metadata_latency=0.0)
+    client = backend.create_client("key")
+    first = registry.resolve(client, "model", "prefix", PARTS, owner="a")
+    assert first is not None
+
+    def update(**kwargs):
+        raise httpx.ConnectError("Verbindung abgebrochen")
+
+    client.caches.update = update
+    clock["value"] += 95
+    second = registry.resolve(client, "model", "prefix", PARTS, owner="a")
+    assert second is not None and second != first
+    assert backend.calls["caches.create"] == 2
+
+
+def test_unexpected_errors_are_not_swallowed():
+    registry = ContextCacheRegistry(min_uses=1)
+    client, _ = _failing_client(KeyError("Programmierfehler"))
+    with pytest.raises(KeyError):
+        registry.resolve(client, "model", "key", PARTS, owner="a")
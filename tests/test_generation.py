@@ -0,0 +1,143 @@
+"""
+Tests für Generierung, Streaming und Coalescing (generation.py) mit einfachen Ersatz-Clients.
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from google.genai import errors, types
+
+import generation
+from retry_policy import CircuitBreakerRegistry, RetryPolicy
+
+
+def _api_error(code: int) -> errors.APIError:
+    status = "RESOURCE_EXHAUSTED" if code == 429 else "UNAVAILABLE"
+    error_class = errors.ServerError if code >= 500 else errors.ClientError
+    return error_class(code, {"error": {"code": code, "message": "", "status": status}}, httpx.Response(code))
+
+
+def _response(text: str) -> types.GenerateContentResponse:
+    return types.GenerateContentResponse(candidates=[
+        types.Candidate(content=types.Content(role="model", parts=[types.Part(text=text)]))
+    ])
+
+
+def _client(generate_content=None, generate_content_stream=None) -> SimpleNamespace:
+    return SimpleNamespace(aio=SimpleNamespace(models=SimpleNamespace(
+        generate_content=generate_content, generate_content_stream=generate_content_stream)))
+
+
+def test_fingerprint_hashes_image_bytes_without_serializing(monkeypatch):
+    image = types.Part.from_bytes(data=b"\x89PNG" * 1000, mime_type="image/png")
+    fingerprint = generation.request_fingerprint("m", ["Prompt", image], None)
+
+    def serialize(*args, **kwargs):
+        raise AssertionError("Bilddaten dürfen nicht serialisiert werden")
+
+    monkeypatch.setattr(types.Part, "model_dump_json", serialize)
+    assert generation.request_fingerprint("m", ["Prompt", image], None) == fingerprint
+    content = types.Content(role="user", parts=[image])
+    assert generation.request_fingerprint("m", ["Prompt", content], None) != fingerprint
+    other = types.Part.from_bytes(data=b"\x89PNG" * 999, mime_type="image/png")
+    assert generation.request_fingerprint("m", ["Prompt", other], None) != fingerprint
+
+
+def test_sync_wrapper_cancels_request_when_callback_raises():
+    calls = []
+
+    async def generate_content(**kwargs):
+        calls.append(kwargs)
+        raise _api_error(503)
+
+    def on_warning(message: str) -> None:
+        raise RuntimeError("Sitzung beendet")
+
+    with pytest.raises(RuntimeError, match="Sitzung beendet"):
+        generation.generate_content_with_retry(_client(generate_content), "m", ["abgebrochen"], None, 5, 0.05,
+                                               on_warning=on_warning)
+    time.sleep(0.3)
+    assert len(calls) == 1
+    assert generation.coalescing_stats()["in_flight"] == 0
+
+
+class _StallingStream:
+    """Liefert eine Teilantwort und bleibt dann hängen."""
+
+    def __init__(self):
+        self.chunks = [_response("Anfang")]
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.chunks:
+            return self.chunks.pop()
+        await asyncio.sleep(10)
+
+    async def aclose(self):
+        self.closed = True
+
+
+def test_stalled_stream_is_closed_when_consumer_stops():
+    streams = []
+
+    async def generate_content_stream(**kwargs):
+        streams.append(_StallingStream())
+        return streams[-1]
+
+    events = generation.generate_content_stream_with_retry(
+        _client(generate_content_stream=generate_content_stream), "m", ["p"], None, 1, 0)
+    assert next(events)["type"] == "chunk"
+    events.close()
+    deadline = time.monotonic() + 2
+    while not streams[0].closed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert streams[0].closed
+
+
+def test_stalled_stream_is_closed_after_timeout():
+    streams = []
+
+    async def generate_content_stream(**kwargs):
+        streams.append(_StallingStream())
+        return streams[-1]
+
+    async def run() -> list[dict]:
+        return [event async for event in generation.generate_content_stream_with_retry_async(
+            _client(generate_content_stream=generate_content_stream), "m", ["p"], None, 1, 0,
+            on_error=lambda msg: None, policy=RetryPolicy(1, 0, attempt_timeout=0.05))]
+
+    events = asyncio.run(run())
+    assert events[-1]["response"] is None
+    assert len(streams) == 1 and streams[0].closed
+
+
+def test_quota_errors_of_one_key_do_not_open_the_breaker_for_others():
+    breakers = CircuitBreakerRegistry(failure_threshold=2, recovery_time=60)
+    policy = RetryPolicy(3, 0.001)
+    models = []
+
+    async def exhausted(**kwargs):
+        raise _api_error(429)
+
+    async def healthy(**kwargs):
+        models.append(kwargs["model"])
+        return _response("ok")
+
+    async def run() -> None:
+        for _ in range(2):
+            assert await generation.generate_content_with_retry_async(
+                _client(exhausted), "primary", ["Key A"], None, 3, 0.001, on_warning=lambda msg: None,
+                on_error=lambda msg: None, policy=policy, breakers=breakers,
+                fallback_models=["fallback"]) is None
+        assert await generation.generate_content_with_retry_async(
+            _client(healthy), "primary", ["Key B"], None, 3, 0.001, policy=policy, breakers=breakers,
+            fallback_models=["fallback"]) is not None
+
+    asyncio.run(run())
+    assert models == ["primary"]
+    assert breakers.state("primary") == "closed"
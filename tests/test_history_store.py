@@ -0,0 +1,49 @@
+"""
+Tests für die Trennung des Verlaufs nach Besitzer (history_store.py).
+"""
+import sqlite3
+
+from history_store import HistoryStore
+
+
+def _store(tmp_path) -> HistoryStore:
+    return HistoryStore(str(tmp_path / "history.sqlite3"), str(tmp_path / "blobs"))
+
+
+def _record(store: HistoryStore, owner: str, prompt: str) -> int:
+    return store.record(owner=owner, model="m", prompt=prompt, params={}, input_hashes=[], output_text="",
+                        images=[(b"nicht wirklich ein Bild", "image/png")], status="ok")
+
+
+def test_entries_are_visible_only_to_their_owner(tmp_path):
+    store = _store(tmp_path)
+    own_id = _record(store, "alice", "Katze im Schnee")
+    other_id = _record(store, "bob", "Katze am Strand")
+
+    assert store.recent_prompts("alice") == ["Katze im Schnee"]
+    assert [entry["id"] for entry in store.page("alice")] == [own_id]
+    assert [entry["id"] for entry in store.page("alice", "Katze")] == [own_id]
+    assert store.count("alice", "Katze") == 1
+    assert [output["generation_id"] for output in store.iter_outputs("alice")] == [own_id]
+    assert store.get("alice", own_id)["prompt"] == "Katze im Schnee"
+    assert store.get("alice", other_id) is None
+
+
+def test_existing_database_is_migrated_without_exposing_old_entries(tmp_path):
+    db_path = tmp_path / "history.sqlite3"
+    connection = sqlite3.connect(db_path)
+    connection.execute(
+        "CREATE TABLE generations (id INTEGER PRIMARY KEY, created_at REAL NOT NULL, model TEXT NOT NULL, "
+        "prompt TEXT NOT NULL, params TEXT NOT NULL, input_hashes TEXT NOT NULL, "
+        "output_text TEXT NOT NULL DEFAULT '', status TEXT NOT NULL, duration_ms REAL, ttft_ms REAL, "
+        "total_tokens INTEGER)")
+    connection.execute("INSERT INTO generations (created_at, model, prompt, params, input_hashes, status) "
+                       "VALUES (0, 'm', 'alter Prompt', '{}', '[]', 'ok')")
+    connection.commit()
+    connection.close()
+
+    store = _store(tmp_path)
+    assert store.recent_prompts("") == []
+    assert store.count("alice") == 0
+    _record(store, "alice", "neuer Prompt")
+    assert store.recent_prompts("alice") == ["neuer Prompt"]
@@ -0,0 +1,18 @@
+"""
+Tests für die ZIP-Archive der Download-Buttons (image_output.py).
+"""
+import io
+import zipfile
+
+from image_output import zip_bytes
+
+
+def test_zip_bytes_packs_bytes_and_files_and_skips_missing_files(tmp_path):
+    image_path = tmp_path / "bild.png"
+    image_path.write_bytes(b"\x89PNG Datei")
+    archive = zip_bytes([("a.png", b"\x89PNG Bytes"), ("b.png", str(image_path)),
+                         ("fehlt.png", str(tmp_path / "fehlt.png"))])
+    with zipfile.ZipFile(io.BytesIO(archive)) as result:
+        assert result.namelist() == ["a.png", "b.png"]
+        assert result.read("b.png") == b"\x89PNG Datei"
+        assert all(info.compress_type == zipfile.ZIP_STORED for info in result.infolist())
@@ -0,0 +1,69 @@
+"""
+Tests für das Auslesen der Wartezeit aus API-Fehlern und die Metriken des Schedulers (rate_limiter.py).
+"""
+import asyncio
+import email.utils
+import time
+
+import httpx
+import pytest
+from google.genai import errors
+
+import rate_limiter
+from metrics import MetricsRegistry
+from rate_limiter import RateLimitScheduler, retry_after_seconds
+
+
+def _error_with_retry_after(value: str) -> errors.APIError:
+    response = httpx.Response(429, headers={"retry-after": value})
+    return errors.ClientError(429, {"error": {"code": 429, "message": "", "status": "RESOURCE_EXHAUSTED"}},
+                              response)
+
+
+def _error_with_retry_delay(value: str) -> errors.APIError:
+    details = [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": value}]
+    return errors.ClientError(429, {"error": {"code": 429, "message": "", "status": "RESOURCE_EXHAUSTED",
+                                              "details": details}})
+
+
+def test_numeric_retry_after():
+    assert retry_after_seconds(_error_with_retry_after("12")) == 12.0
+    assert retry_after_seconds(_error_with_retry_after("-3")) == 0.0
+
+
+def test_http_date_retry_after():
+    value = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert retry_after_seconds(_error_with_retry_after(value)) == pytest.approx(30, abs=2)
+
+
+@pytest.mark.parametrize("value", ["soon", "Mon, 99 Foo 2024 25:61:00 GMT", "1.5s"])
+def test_malformed_retry_after_is_ignored(value):
+    assert retry_after_seconds(_error_with_retry_after(value)) is None
+
+
+def test_retry_delay_from_error_details():
+    assert retry_after_seconds(_error_with_retry_delay("17s")) == 17.0
+    assert retry_after_seconds(errors.ServerError(503, {"error": {"code": 503, "message": "",
+                                                                  "status": "UNAVAILABLE"}})) is None
+
+
+def test_scheduler_exports_queue_depth_and_wait_time(monkeypatch):
+    registry = MetricsRegistry()
+    monkeypatch.setattr(rate_limiter, "METRICS", registry)
+    scheduler = RateLimitScheduler({"default": {"rpm": 1, "tpm": 1_000_000}})
+    depths = []
+
+    async def run() -> None:
+        first = asyncio.ensure_future(scheduler.acquire("key", "model", 10))
+        second = asyncio.ensure_future(scheduler.acquire("key", "model", 10))
+        await first
+        await asyncio.sleep(0)
+        depths.append(registry.snapshot()['genai_rate_limit_queue_depth{key="key",model="model"}'])
+        second.cancel()
+        await asyncio.gather(second, return_exceptions=True)
+
+    asyncio.run(run())
+    snapshot = registry.snapshot()
+    assert depths == [1]
+    assert snapshot['genai_rate_limit_queue_depth{key="key",model="model"}'] == 0
+    assert snapshot['genai_rate_limit_wait_seconds{model="model"}']["count"] == 1
@@ -0,0 +1,109 @@
+"""
+Tests für den Antwort-Cache (response_cache.py).
+"""
+import os
+
+import pytest
+from google.genai import types
+
+import response_cache
+from response_cache import ResponseCache, build_cache_key
+
+
+def _response(text: str) -> types.GenerateContentResponse:
+    return types.GenerateContentResponse(candidates=[
+        types.Candidate(content=types.Content(role="model", parts=[types.Part(text=text)]))
+    ])
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Steuerbare Uhr für response_cache (time.time)."""
+    now = {"value": 1_000_000.0}
+    monkeypatch.setattr(response_cache.time, "time", lambda: now["value"])
+    return now
+
+
+def _disk_cache(tmp_path, **kwargs) -> ResponseCache:
+    # Speicherstufe aus, damit jeder Treffer aus der Festplattenstufe kommt
+    return ResponseCache(memory_max_entries=0, disk_enabled=True, disk_dir=str(tmp_path), **kwargs)
+
+
+def _store(cache: ResponseCache, key: str, text: str, at: float) -> None:
+    cache.put(key, _response(text))
+    path = cache._disk_path(key)
+    os.utime(path, (at, at))
+
+
+def test_build_cache_key_depends_on_all_inputs():
+    params = {"temperature": 0.7, "top_p": 0.95, "top_k": 40, "max_output_tokens": 1024}
+    key = build_cache_key("model", "prompt", [b"image"], params)
+    assert key == build_cache_key("model", "prompt", [b"image"], dict(params))
+    assert key != build_cache_key("other", "prompt", [b"image"], params)
+    assert key != build_cache_key("model", "prompt 2", [b"image"], params)
+    assert key != build_cache_key("model", "prompt", [b"image 2"], params)
+    assert key != build_cache_key("model", "prompt", [b"image"], {**params, "temperature": 0.2})
+
+
+def test_build_cache_key_depends_on_candidate_count():
+    params = {"temperature": 0.7, "top_p": 0.95, "top_k": 40, "max_output_tokens": 1024}
+    single = build_cache_key("model", "prompt", [], params)
+    # Eine Antwort mit einem Kandidaten darf nicht für eine Fan-out-Anfrage mit mehreren ausgeliefert werden
+    assert single != build_cache_key("model", "prompt", [], {**params, "candidate_count": 3})
+    assert build_cache_key("model", "prompt", [], {**params, "candidate_count": 2}) != \
+        build_cache_key("model", "prompt", [], {**params, "candidate_count": 3})
+
+
+def test_disk_ttl_counts_from_storage_not_last_hit(tmp_path, clock):
+    cache = _disk_cache(tmp_path, disk_ttl=2)
+    _store(cache, "key", "antwort", clock["value"])
+
+    clock["value"] += 1.5
+    assert cache.get("key") is not None
+    # Ein Treffer verlängert die TTL nicht
+    clock["value"] += 1.5
+    assert cache.get("key") is None
+    assert not os.path.exists(cache._disk_path("key"))
+
+
+def test_disk_hit_keeps_memory_ttl_at_storage_time(tmp_path, clock):
+    cache = ResponseCache(memory_ttl=3, disk_enabled=True, disk_dir=str(tmp_path), disk_ttl=2)
+    _store(cache, "key", "antwort", clock["value"])
+    cache._memory.clear()
+
+    clock["value"] += 1.5
+    assert cache.get("key") is not None  # Treffer aus der Festplattenstufe
+    # In der Speicherstufe beginnt die TTL nicht beim Treffer neu
+    clock["value"] += 2
+    assert cache.get("key") is None
+
+
+def test_disk_eviction_is_least_recently_used(tmp_path, clock):
+    cache = _disk_cache(tmp_path, disk_max_entries=3)
+    _store(cache, "a", "a", clock["value"])
+    _store(cache, "b", "b", clock["value"] + 1)
+    _store(cache, "c", "c", clock["value"] + 2)
+    clock["value"] += 3
+    assert cache.get("a") is not None
+    # Ein Eintrag Überhang wird geduldet, erst danach wird verdrängt
+    _store(cache, "d", "d", clock["value"] + 1)
+    assert all(os.path.exists(cache._disk_path(key)) for key in "abcd")
+    _store(cache, "e", "e", clock["value"] + 2)
+    assert sorted(name[0] for name in os.listdir(tmp_path)) == ["a", "d", "e"]
+
+
+def test_disk_eviction_skips_entries_removed_concurrently(tmp_path, clock, monkeypatch):
+    cache = _disk_cache(tmp_path, disk_max_entries=1)
+    _store(cache, "a", "a", clock["value"])
+    _store(cache, "b", "b", clock["value"] + 1)
+    getatime = os.path.getatime
+
+    def racing_getatime(path):
+        # Ein anderer Prozess entfernt "a", während verdrängt wird
+        if path == cache._disk_path("a") and os.path.exists(path):
+            os.remove(path)
+        return getatime(path)
+
+    monkeypatch.setattr(os.path, "getatime", racing_getatime)
+    cache.put("c", _response("c"))
+    assert sorted(name[0] for name in os.listdir(tmp_path)) == ["c"]
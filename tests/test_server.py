@@ -0,0 +1,70 @@
+"""
+Tests für die HTTP-API (server.py) mit dem Stub-Client statt der echten API.
+"""
+import asyncio
+
+import httpx
+import pytest
+from google import genai
+
+import server
+from benchmarks.stub_client import StubBackend, stub_error
+
+VALID_KEY = "gueltiger-key"
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    """Stub-Backend, das nur VALID_KEY akzeptiert; andere Keys erhalten 401 wie von der API."""
+    backend = StubBackend(generate_latency=0.0, metadata_latency=0.0)
+
+    def create_client(api_key: str = "", **kwargs):
+        client = backend.create_client(api_key)
+        if api_key != VALID_KEY:
+            async def reject(**kwargs):
+                raise stub_error(401)
+            client.aio.models.generate_content = reject
+        return client
+
+    monkeypatch.setattr(genai, "Client", create_client)
+    return backend
+
+
+def _post(app, headers: dict) -> httpx.Response:
+    async def send():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.post("/v1/generate", data={"prompt": "Ein Logo"}, headers=headers)
+    return asyncio.run(send())
+
+
+def test_cached_response_is_not_served_to_another_key(backend):
+    app = server.create_app()
+    first = _post(app, {"x-goog-api-key": VALID_KEY})
+    assert first.status_code == 200
+    assert first.headers["x-cache"] == "miss"
+    assert _post(app, {"x-goog-api-key": VALID_KEY}).headers["x-cache"] == "hit"
+
+    rejected = _post(app, {"x-goog-api-key": "falscher-key"})
+    assert rejected.status_code == 401
+    assert "x-cache" not in rejected.headers
+    # Nur die erste Anfrage des gültigen Keys hat die (Stub-)API erreicht
+    assert backend.calls["generate_content"] == 1
+
+
+def test_malformed_content_length_is_rejected(backend):
+    app = server.create_app()
+    response = _post(app, {"x-goog-api-key": VALID_KEY, "content-length": "viel"})
+    assert response.status_code == 400
+    assert "Content-Length" in response.json()["error"]
+
+
+def test_unexpected_error_returns_json_500(backend, monkeypatch):
+    app = server.create_app()
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("kaputt")
+
+    monkeypatch.setattr(server, "prepare_contents", broken)
+    response = _post(app, {"x-goog-api-key": VALID_KEY})
+    assert response.status_code == 500
+    assert response.json() == {"error": "Interner Serverfehler."}